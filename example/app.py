@@ -1,17 +1,18 @@
 from flask import Flask, render_template, request, jsonify
 import pandas as pd
 import numpy as np
-import plotly.graph_objects as go
-import plotly.utils
-import json
 from datetime import datetime
 import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 
+from plot_payload import plot_payload, batch_payload, compressed_json, event_stream, simulation_events
+
 # Import with error handling
 try:
-    from t1dsim_ai.individual_model import DigitalTwin
+    from t1dsim_ai.registry import DigitalTwinRegistry
+    from t1dsim_ai.result_cache import SimulationResultCache
+    from t1dsim_ai.batch import simulate_cohort
     DIGITAL_TWIN_AVAILABLE = True
 except ImportError as e:
     print(f"Warning: Could not import DigitalTwin: {e}")
@@ -29,11 +30,21 @@ except ImportError as e:
 
 app = Flask(__name__)
 
+# Digital twins are loaded once per worker and shared by all requests
+if DIGITAL_TWIN_AVAILABLE:
+    # Hourly prefix checkpoints: edited scenarios resume at the first change
+    # Repeated simulations of an unchanged scenario are served from memory
+    twin_registry = DigitalTwinRegistry(
+        capacity=8, checkpoint_every=12, result_cache=SimulationResultCache(capacity=64)
+    )
+    twin_registry.warm_up()
+
 # Global variables
 current_digital_twin = 1
 current_scenario = None
-animation_frame = 0
-animation_data = None
+
+# Largest number of simulations (scenarios x digital twins) of a batch request
+MAX_BATCH_RUNS = 256
 
 # Scenario parameters
 scenario_params = {
@@ -147,321 +158,36 @@ def create_simple_scenario():
     
     return current_scenario
 
-def generate_plot(frame=None):
-    """Generate the simulation plot with Plotly"""
-    global current_scenario, current_digital_twin, animation_data
-    
-    try:
-        if current_scenario is None:
-            current_scenario = load_patient_data(current_digital_twin)
-        
-        if not DIGITAL_TWIN_AVAILABLE:
-            print("ERROR: DigitalTwin not available - cannot generate real simulation data")
-            # Return error plot
-            fig = go.Figure()
-            fig.add_annotation(text='DigitalTwin not available - please check installation', 
-                             xref="paper", yref="paper", x=0.5, y=0.5, showarrow=False, font=dict(size=16))
-            fig.update_layout(title='Error: DigitalTwin Not Available', height=400)
-            plot_json = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
-            return plot_json
-            
-        else:
-            # Use real DigitalTwin
-            print(f"Creating DigitalTwin with n_digitalTwin={current_digital_twin}")
-            myDigitalTwin = DigitalTwin(n_digitalTwin=current_digital_twin)
-            print(f"Running simulation...")
-            df_simulation = myDigitalTwin.simulate(current_scenario)
-            print(f"Simulation completed. Result shape: {df_simulation.shape}")
-            
-            # Debug: Print available columns and check Actual CGM data
-            print(f"Available columns in df_simulation: {df_simulation.columns.tolist()}")
-            print(f"df_simulation shape: {df_simulation.shape}")
-            
-            # Use real patient CGM data
-            if 'output_cgm' in df_simulation.columns:
-                cgm_actual_data = df_simulation.output_cgm.values
-                print(f"Using real patient CGM data from output_cgm - range: {cgm_actual_data.min():.1f} to {cgm_actual_data.max():.1f}")
-            elif 'cgm_Actual' in df_simulation.columns:
-                cgm_actual_data = df_simulation.cgm_Actual.values
-                print(f"Using cgm_Actual column - range: {cgm_actual_data.min():.1f} to {cgm_actual_data.max():.1f}")
-            else:
-                print("WARNING: No CGM data found, using fallback data")
-                cgm_actual_data = np.full(len(df_simulation), scenario_params['init_cgm'])
-            
-            # Debug: Check what columns are available and their data
-            print(f"=== COLUMN ANALYSIS ===")
-            print(f"Available columns: {df_simulation.columns.tolist()}")
-            
-            # Check if the AI model columns exist
-            has_cgm_nnpop = 'cgm_NNPop' in df_simulation.columns
-            has_cgm_nndt = 'cgm_NNDT' in df_simulation.columns
-            print(f"Has cgm_NNPop: {has_cgm_nnpop}")
-            print(f"Has cgm_NNDT: {has_cgm_nndt}")
-            
-            if has_cgm_nnpop:
-                pop_data = df_simulation.cgm_NNPop.values
-                actual_data = df_simulation.output_cgm.values
-                print(f"Population Model data range: {pop_data.min():.1f} to {pop_data.max():.1f}")
-                print(f"Population Model first 5 values: {pop_data[:5]}")
-                print(f"Actual CGM first 5 values: {actual_data[:5]}")
-                print(f"Are Population and Actual identical? {np.array_equal(pop_data, actual_data)}")
-                print(f"Population vs Actual correlation: {np.corrcoef(pop_data, actual_data)[0,1]:.3f}")
-            else:
-                print("WARNING: cgm_NNPop column not found - using fallback")
-                
-            if has_cgm_nndt:
-                dt_data = df_simulation.cgm_NNDT.values
-                print(f"Digital Twin data range: {dt_data.min():.1f} to {dt_data.max():.1f}")
-                print(f"Digital Twin first 5 values: {dt_data[:5]}")
-            else:
-                print("WARNING: cgm_NNDT column not found - using fallback")
-            
-            # Store animation data for frame-by-frame access
-            animation_data = {
-                'time_hours': np.arange(len(df_simulation)) / 12,
-                'cgm_actual': cgm_actual_data,
-                'cgm_pop': df_simulation.cgm_NNPop.values if 'cgm_NNPop' in df_simulation.columns else np.full(len(df_simulation), scenario_params['init_cgm']),
-                'cgm_dt': df_simulation.cgm_NNDT.values if 'cgm_NNDT' in df_simulation.columns else np.full(len(df_simulation), scenario_params['init_cgm']),
-                'insulin': df_simulation.input_insulin.values if 'input_insulin' in df_simulation.columns else np.full(len(df_simulation), scenario_params['basal_insulin']),
-                'meal_mask': df_simulation.input_meal_carbs != 0 if 'input_meal_carbs' in df_simulation.columns else np.zeros(len(df_simulation), dtype=bool)
-            }
-            
-            # Determine data range for animation
-            time_hours = animation_data['time_hours']
-            if frame is not None and frame < len(time_hours):
-                end_idx = frame + 1
-                time_hours_plot = time_hours[:end_idx]
-                cgm_actual_plot = animation_data['cgm_actual'][:end_idx]
-                cgm_pop_plot = animation_data['cgm_pop'][:end_idx]
-                cgm_dt_plot = animation_data['cgm_dt'][:end_idx]
-                insulin_plot = animation_data['insulin'][:end_idx]
-                meal_mask_plot = animation_data['meal_mask'][:end_idx]
-            else:
-                time_hours_plot = time_hours
-                cgm_actual_plot = animation_data['cgm_actual']
-                cgm_pop_plot = animation_data['cgm_pop']
-                cgm_dt_plot = animation_data['cgm_dt']
-                insulin_plot = animation_data['insulin']
-                meal_mask_plot = animation_data['meal_mask']
-            
-            # Add debugging
-            print(f"=== QUICK DATA TEST ===")
-            print(f"Are arrays empty?")
-            print(f"  time_hours_plot empty: {len(time_hours_plot) == 0}")
-            print(f"  cgm_actual_plot empty: {len(cgm_actual_plot) == 0}")
-            print(f"  cgm_pop_plot empty: {len(cgm_pop_plot) == 0}")
-            print(f"  cgm_dt_plot empty: {len(cgm_dt_plot) == 0}")
-
-            print(f"Are arrays all the same value?")
-            if len(cgm_actual_plot) > 0:
-                print(f"  cgm_actual all same: {np.all(cgm_actual_plot == cgm_actual_plot[0])}")
-                print(f"  cgm_actual value: {cgm_actual_plot[0]}")
-                print(f"  cgm_actual range: {cgm_actual_plot.min():.1f} to {cgm_actual_plot.max():.1f}")
-                print(f"  cgm_actual first 5 values: {cgm_actual_plot[:5]}")
-            if len(cgm_pop_plot) > 0:
-                print(f"  cgm_pop all same: {np.all(cgm_pop_plot == cgm_pop_plot[0])}")
-                print(f"  cgm_pop value: {cgm_pop_plot[0]}")
-                print(f"  cgm_pop range: {cgm_pop_plot.min():.1f} to {cgm_pop_plot.max():.1f}")
-            if len(cgm_dt_plot) > 0:
-                print(f"  cgm_dt all same: {np.all(cgm_dt_plot == cgm_dt_plot[0])}")
-                print(f"  cgm_dt value: {cgm_dt_plot[0]}")
-                print(f"  cgm_dt range: {cgm_dt_plot.min():.1f} to {cgm_dt_plot.max():.1f}")
-            
-            print(f"Time range: {time_hours_plot.min():.1f} to {time_hours_plot.max():.1f} hours")
-            print(f"Number of data points: {len(time_hours_plot)}")
-            
-            # Check for NaN or infinite values
-            print(f"Any NaN in cgm_actual: {np.any(np.isnan(cgm_actual_plot))}")
-            print(f"Any infinite in cgm_actual: {np.any(np.isinf(cgm_actual_plot))}")
-            print(f"Any NaN in cgm_pop: {np.any(np.isnan(cgm_pop_plot))}")
-            print(f"Any infinite in cgm_pop: {np.any(np.isinf(cgm_pop_plot))}")
-            print(f"Any NaN in cgm_dt: {np.any(np.isnan(cgm_dt_plot))}")
-            print(f"Any infinite in cgm_dt: {np.any(np.isinf(cgm_dt_plot))}")
-
-            # Create Plotly figure
-            fig = go.Figure()
-            
-            # Debug: Check data before creating traces
-            print(f"Creating traces with:")
-            print(f"  time_hours_plot: {len(time_hours_plot)} points, type: {type(time_hours_plot)}")
-            print(f"  cgm_actual_plot: {len(cgm_actual_plot)} points, type: {type(cgm_actual_plot)}")
-            print(f"  cgm_pop_plot: {len(cgm_pop_plot)} points, type: {type(cgm_pop_plot)}")
-            print(f"  cgm_dt_plot: {len(cgm_dt_plot)} points, type: {type(cgm_dt_plot)}")
-            
-            # Convert numpy arrays to lists for Plotly
-            time_list = time_hours_plot.tolist() if hasattr(time_hours_plot, 'tolist') else list(time_hours_plot)
-            cgm_actual_list = cgm_actual_plot.tolist() if hasattr(cgm_actual_plot, 'tolist') else list(cgm_actual_plot)
-            cgm_pop_list = cgm_pop_plot.tolist() if hasattr(cgm_pop_plot, 'tolist') else list(cgm_pop_plot)
-            cgm_dt_list = cgm_dt_plot.tolist() if hasattr(cgm_dt_plot, 'tolist') else list(cgm_dt_plot)
-            
-            print(f"After conversion:")
-            print(f"  time_list: {len(time_list)} points")
-            print(f"  cgm_actual_list: {len(cgm_actual_list)} points")
-            
-            # Add CGM traces with thicker, more visible lines and different styles
-            fig.add_trace(go.Scatter(x=time_list, y=cgm_actual_list, mode='lines+markers', 
-                                   name='Actual CGM', line=dict(color='#FF0000', width=5),
-                                   marker=dict(size=3, color='#FF0000')))
-            fig.add_trace(go.Scatter(x=time_list, y=cgm_pop_list, mode='lines+markers', 
-                                   name='Population Model', line=dict(color='#0000FF', width=4),
-                                   marker=dict(size=2, color='#0000FF')))
-            fig.add_trace(go.Scatter(x=time_list, y=cgm_dt_list, mode='lines+markers', 
-                                   name='Digital Twin', line=dict(color='#00FF00', width=4),
-                                   marker=dict(size=2, color='#00FF00')))
-            
-            # Test line removed - real CGM data is working!
-            
-            # Debug meal information
-            print(f"=== MEAL ANALYSIS ===")
-            print(f"Meal mask sum: {np.sum(meal_mask_plot)} meals found")
-            meal_times = time_hours_plot[meal_mask_plot]
-            print(f"Meal times: {meal_times}")
-            if np.sum(meal_mask_plot) > 0:
-                meal_carbs_debug = df_simulation.input_meal_carbs[meal_mask_plot].values
-                print(f"Meal carbs: {meal_carbs_debug}")
-            else:
-                print("Meal carbs: No meals")
-            print(f"User meal time: {scenario_params['meal_time']} minutes")
-            print(f"User meal size: {scenario_params['meal_size']}g carbs")
-            
-            # Add meal markers
-            if len(meal_times) > 0:
-                meal_carbs = df_simulation.input_meal_carbs.iloc[:len(meal_mask_plot)][meal_mask_plot]
-                fig.add_trace(go.Scatter(x=meal_times, y=[250] * len(meal_times), mode='markers',
-                                       name='Meals', marker=dict(color='#F0E68C', size=10, symbol='diamond')))
-            else:
-                print("WARNING: No meals found in the data!")
-            
-            # Add target range
-            fig.add_hrect(y0=70, y1=180, fillcolor="lightblue", opacity=0.2, 
-                         annotation_text="Target Range", annotation_position="top left")
-            
-            # Add threshold lines
-            fig.add_hline(y=70, line_dash="dash", line_color="red", annotation_text="Hypo Threshold")
-            fig.add_hline(y=180, line_dash="dash", line_color="red", annotation_text="Hyper Threshold")
-            fig.add_hline(y=250, line_dash="dash", line_color="orange", annotation_text="High Threshold")
-            
-            # Update layout
-            scenario_text = f'CGM={scenario_params["init_cgm"]} mg/dL, Basal={scenario_params["basal_insulin"]} U/h, Meal={scenario_params["meal_size"]}g at {scenario_params["meal_time"]}min'
-            fig.update_layout(
-                title=f'Greens Health Simulator - Patient {current_digital_twin}<br>{scenario_text}',
-                xaxis_title='Time (hours)',
-                yaxis_title='CGM (mg/dL)',
-                yaxis_range=[40, 380],
-                height=600,
-                showlegend=True,
-                template='plotly_white'
-            )
-            
-            # Convert to JSON
-            plot_json = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
-            print(f"Plot JSON length: {len(plot_json)}")
-            
-            # Debug: Check what's in the JSON
-            try:
-                plot_data = json.loads(plot_json)
-                print(f"Number of traces in JSON: {len(plot_data.get('data', []))}")
-                for i, trace in enumerate(plot_data.get('data', [])):
-                    print(f"Trace {i}: {trace.get('name', 'unnamed')} - {len(trace.get('x', []))} points")
-                    if trace.get('x') and trace.get('y'):
-                        x_vals = trace['x']
-                        y_vals = trace['y']
-                        if isinstance(x_vals, list) and len(x_vals) > 0:
-                            print(f"  X range: {min(x_vals):.1f} to {max(x_vals):.1f}")
-                        if isinstance(y_vals, list) and len(y_vals) > 0:
-                            print(f"  Y range: {min(y_vals):.1f} to {max(y_vals):.1f}")
-            except Exception as e:
-                print(f"Error parsing JSON: {e}")
-            
-            return plot_json
-        
-    except Exception as e:
-        print(f"Error generating plot: {e}")
-        import traceback
-        traceback.print_exc()
-        
-        # Return a simple error plot
-        try:
-            fig = go.Figure()
-            fig.add_annotation(text=f'Error: {str(e)}', xref="paper", yref="paper",
-                             x=0.5, y=0.5, showarrow=False, font=dict(size=16))
-            fig.update_layout(title='Error Loading Plot', height=400)
-            plot_json = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
-            return plot_json
-        except Exception as fallback_error:
-            print(f"Fallback plot also failed: {fallback_error}")
-            return '{"error": "Plot generation failed"}'
-        insulin_plot = animation_data['insulin'][:end_idx]
-        meal_mask_plot = animation_data['meal_mask'][:end_idx]
-    else:
-        time_hours_plot = time_hours
-        cgm_actual_plot = animation_data['cgm_actual']
-        cgm_pop_plot = animation_data['cgm_pop']
-        cgm_dt_plot = animation_data['cgm_dt']
-        insulin_plot = animation_data['insulin']
-        meal_mask_plot = animation_data['meal_mask']
-    
-    # Plot glucose data
-    ax1.plot(time_hours_plot, cgm_actual_plot, 'o-', color=color_actual, ms=3, lw=1, label='Actual CGM')
-    ax1.plot(time_hours_plot, cgm_pop_plot, 'o-', color=color_pop, ms=2, lw=1, label='Population Model')
-    ax1.plot(time_hours_plot, cgm_dt_plot, 'o-', color=color_dt, ms=2, lw=1, label='Digital Twin')
-    
-    # Add meal markers
-    if meal_mask_plot.any():
-        meal_times = time_hours_plot[meal_mask_plot]
-        # Get meal carbs for the current window only
-        meal_carbs = df_simulation.input_meal_carbs.iloc[:len(meal_mask_plot)][meal_mask_plot]
-        ax1.scatter(meal_times, [350] * len(meal_times), c=color_carbs, s=100, marker='^', label='Meals')
-        for i, (t, carbs) in enumerate(zip(meal_times, meal_carbs)):
-            ax1.annotate(f'{carbs}g', (t, 350), xytext=(0, 10), textcoords='offset points', 
-                        ha='center', fontsize=8, fontweight='bold')
-    
-    # Setup glucose plot
-    ax1.set_ylim(40, 380)
-    ax1.set_ylabel('CGM [mg/dL]', fontweight='bold')
-    ax1.grid(True, alpha=0.3, color='#E0E0E0')  # Light gray grid
-    ax1.axhspan(70, 180, facecolor='#20B2AA', alpha=0.2, label='Target Range')  # Teal target range
-    ax1.axhline(y=70, color='#FF6347', alpha=0.7, linestyle='--', lw=2)  # Orange-red warning line
-    ax1.axhline(y=180, color='#FF6347', alpha=0.7, linestyle='--', lw=2)  # Orange-red warning line
-    ax1.axhline(y=250, color='#F0E68C', alpha=0.7, linestyle='--', lw=2)  # Cream high line
-    ax1.legend(loc='upper right', frameon=True, fancybox=True, shadow=True)
-    ax1.set_facecolor('#FAFAFA')  # Light gray background
-    
-    # Plot insulin data
-    ax2.plot(time_hours_plot, insulin_plot, color=color_insulin, lw=2, label='Insulin [U/h]')
-    ax2.set_ylabel('Insulin [U/h]', fontweight='bold')
-    ax2.set_xlabel('Time [hours]', fontweight='bold')
-    ax2.grid(True, alpha=0.3, color='#E0E0E0')  # Light gray grid
-    ax2.legend()
-    ax2.set_facecolor('#FAFAFA')  # Light gray background
-    
-    # Add scenario info
-    scenario_text = f'Scenario: CGM={scenario_params["init_cgm"]} mg/dL, Basal={scenario_params["basal_insulin"]} U/h, Meal={scenario_params["meal_size"]}g at {scenario_params["meal_time"]}min'
-    fig.suptitle(f'Greens Health Simulator - Patient {current_digital_twin}\n{scenario_text}', 
-                 fontsize=14, fontweight='bold', color='#8B4513')  # Dark Reddish Brown title
+def simulate_scenario():
+    """Simulate the current scenario, None if DigitalTwin is not available"""
+    global current_scenario
     
-    # Set figure background
-    fig.patch.set_facecolor('#FAFAFA')  # Light gray background
+    if current_scenario is None:
+        current_scenario = load_patient_data(current_digital_twin)
     
-    plt.tight_layout()
+    if not DIGITAL_TWIN_AVAILABLE:
+        print("ERROR: DigitalTwin not available - cannot generate real simulation data")
+        return None
     
-    # Convert plot to base64 string
-    img = io.BytesIO()
-    plt.savefig(img, format='png', dpi=150, bbox_inches='tight')
-    img.seek(0)
-    plot_url = base64.b64encode(img.getvalue()).decode()
-    plt.close()
+    print(f"Getting DigitalTwin with n_digitalTwin={current_digital_twin}")
+    myDigitalTwin = twin_registry.get(current_digital_twin)
+    df_simulation = myDigitalTwin.simulate(current_scenario)
+    print(f"Simulation completed. Result shape: {df_simulation.shape}")
     
-    return plot_url
+    return df_simulation
+
+def generate_plot_data():
+    """Columnar plot data of the current scenario; the page builds the figure"""
+    df_simulation = simulate_scenario()
+    return plot_payload(current_scenario, df_simulation, current_digital_twin, scenario_params)
 
 @app.route('/')
 def index():
     """Main page"""
     try:
         print("Index route called")
-        plot_json = generate_plot()
-        print(f"Plot generated successfully")
-        return render_template('index.html', plot_json=plot_json, params=scenario_params, digital_twin=current_digital_twin)
+        plot_data = generate_plot_data()
+        return render_template('index.html', plot_data=plot_data, params=scenario_params, digital_twin=current_digital_twin)
     except Exception as e:
         print(f"Error in index route: {e}")
         import traceback
@@ -495,13 +221,10 @@ def update_scenario():
                 # Reload patient data for new digital twin
                 current_scenario = load_patient_data(current_digital_twin)
         
-        # Create new scenario if needed
-        if current_scenario is None:
-            current_scenario = load_patient_data(current_digital_twin)
-        plot_json = generate_plot()
+        plot_data = generate_plot_data()
         
-        return jsonify({
-            'plot_json': plot_json,
+        return compressed_json({
+            'plot_data': plot_data,
             'params': scenario_params,
             'digital_twin': current_digital_twin
         })
@@ -509,6 +232,15 @@ def update_scenario():
         print(f"Error in update_scenario: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/plot_data')
+def get_plot_data():
+    """Columnar plot data of the current scenario"""
+    try:
+        return compressed_json(generate_plot_data())
+    except Exception as e:
+        print(f"Error getting plot data: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/get_stats')
 def get_stats():
     """Get simulation statistics"""
@@ -517,7 +249,7 @@ def get_stats():
     if current_scenario is None:
         current_scenario = load_patient_data(current_digital_twin)
     
-    myDigitalTwin = DigitalTwin(n_digitalTwin=current_digital_twin)
+    myDigitalTwin = twin_registry.get(current_digital_twin)
     df_simulation = myDigitalTwin.simulate(current_scenario)
     
     # Calculate statistics
@@ -548,46 +280,51 @@ def get_stats():
     
     return jsonify(stats)
 
-@app.route('/get_animation_frame/<int:frame>')
-def get_animation_frame(frame):
-    """Get animation frame"""
-    global animation_frame
-    animation_frame = frame
-    plot_url = generate_plot(frame)
-    return jsonify({'plot_url': plot_url, 'frame': frame})
+@app.route('/simulate_batch', methods=['POST'])
+def simulate_batch():
+    """Simulate a list of scenario specs on one or several digital twins
 
-@app.route('/start_animation')
-def start_animation():
-    """Start animation sequence"""
-    global animation_frame
-    animation_frame = 0
-    return jsonify({'status': 'started', 'frame': animation_frame})
+    JSON body: {"scenarios": [spec, ...], "digital_twins": [id, ...],
+    "trajectories": true}. The spec keys are those of
+    t1dsim_ai.batch.scenario_from_spec, plus an optional "digital_twin";
+    digital_twins defaults to the current one. The scenarios of each twin
+    run in one batched rollout. Returns the TIR/TBR/TAR summaries and the
+    CGM trajectories (float32 columns) of every scenario and twin.
+    """
+    if not DIGITAL_TWIN_AVAILABLE:
+        return jsonify({'error': 'DigitalTwin not available'}), 503
+    
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'JSON object expected'}), 400
+    try:
+        results = simulate_cohort(twin_registry, data.get('scenarios', []),
+                                  data.get('digital_twins', [current_digital_twin]),
+                                  max_runs=MAX_BATCH_RUNS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return compressed_json(batch_payload(results, data.get('trajectories', True)))
+
+@app.route('/stream_simulation')
+def stream_simulation():
+    """Stream the simulation as server-sent events, one record per step
 
-@app.route('/get_animation_data')
-def get_animation_data():
-    """Get animation data for client-side animation"""
-    global animation_data, current_scenario, current_digital_twin
+    The browser appends the records to the plot, so an animation costs one
+    simulation (see plot_payload.simulation_events).
+    """
+    global current_scenario
+    
+    if not DIGITAL_TWIN_AVAILABLE:
+        return jsonify({'error': 'DigitalTwin not available'}), 503
     
     if current_scenario is None:
         current_scenario = load_patient_data(current_digital_twin)
     
-    myDigitalTwin = DigitalTwin(n_digitalTwin=current_digital_twin)
-    df_simulation = myDigitalTwin.simulate(current_scenario)
-    
-    # Prepare data for client-side animation
-    time_hours = np.arange(len(df_simulation)) / 12
-    animation_data = {
-        'time_hours': time_hours.tolist(),
-        'cgm_actual': df_simulation.cgm_Actual.tolist(),
-        'cgm_pop': df_simulation.cgm_NNPop.tolist(),
-        'cgm_dt': df_simulation.cgm_NNDT.tolist(),
-        'insulin': df_simulation.input_insulin.tolist(),
-        'meal_times': time_hours[df_simulation.input_meal_carbs != 0].tolist(),
-        'meal_carbs': df_simulation.input_meal_carbs[df_simulation.input_meal_carbs != 0].tolist(),
-        'total_frames': len(time_hours)
-    }
+    myDigitalTwin = twin_registry.get(current_digital_twin)
+    df_scenario = myDigitalTwin.preprocess_scenario(current_scenario)
     
-    return jsonify(animation_data)
+    return event_stream(simulation_events(myDigitalTwin, df_scenario, current_digital_twin))
 
 # Voice module routes
 @app.route('/voice_log_food', methods=['POST'])
@@ -1,12 +1,11 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, session
 import pandas as pd
 import numpy as np
-import plotly.graph_objects as go
-import plotly.utils
 import json
 from datetime import datetime
 import sys
 import os
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -14,9 +13,14 @@ load_dotenv()
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 
+from t1dsim_ai.jobs import SimulationJobQueue, scenario_key
+from plot_payload import plot_payload, batch_payload, compressed_json, event_stream, simulation_events
+
 # Import with error handling
 try:
-    from t1dsim_ai.individual_model import DigitalTwin
+    from t1dsim_ai.registry import DigitalTwinRegistry
+    from t1dsim_ai.result_cache import SimulationResultCache
+    from t1dsim_ai.batch import plan_cohort, simulate_runs
     DIGITAL_TWIN_AVAILABLE = True
 except ImportError as e:
     print(f"Warning: Could not import DigitalTwin: {e}")
@@ -44,14 +48,51 @@ else:
 
 app = Flask(__name__)
 
-# Global variables
-current_digital_twin = 1
-current_scenario = None
-animation_frame = 0
-animation_data = None
+# Digital twins are loaded once per worker and shared by all requests
+DIGITAL_TWIN_CACHE_SIZE = int(os.getenv('DIGITAL_TWIN_CACHE_SIZE', 8))
+PRELOAD_DIGITAL_TWINS = os.getenv('PRELOAD_DIGITAL_TWINS', 'true').lower() == 'true'
+
+# Simulation results cache: memory tier, plus an on-disk tier if a folder is set
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', 64))
+RESULT_CACHE_DIR = os.getenv('RESULT_CACHE_DIR')
+RESULT_CACHE_MAX_MB = int(os.getenv('RESULT_CACHE_MAX_MB', 256))
+
+if DIGITAL_TWIN_AVAILABLE:
+    # Hourly prefix checkpoints: edited scenarios resume at the first change
+    result_cache = SimulationResultCache(
+        capacity=RESULT_CACHE_SIZE,
+        cache_dir=RESULT_CACHE_DIR,
+        max_disk_bytes=RESULT_CACHE_MAX_MB * 2**20,
+    )
+    twin_registry = DigitalTwinRegistry(
+        capacity=DIGITAL_TWIN_CACHE_SIZE, checkpoint_every=12, result_cache=result_cache
+    )
+    if PRELOAD_DIGITAL_TWINS:
+        twin_registry.warm_up()
+
+# Simulations run in a background pool; identical in-flight requests share one job
+SIMULATION_WORKERS = int(os.getenv('SIMULATION_WORKERS', 2))
+SIMULATION_TIMEOUT = float(os.getenv('SIMULATION_TIMEOUT', 60))
+MAX_POLL_WAIT = 30
+
+# Largest number of simulations (scenarios x digital twins) of a batch request
+MAX_BATCH_RUNS = int(os.getenv('MAX_BATCH_RUNS', 256))
+job_queue = SimulationJobQueue(n_workers=SIMULATION_WORKERS)
+
+# Per-user state lives in the signed session cookie, so every worker and
+# restart must sign it with the same SECRET_KEY. A random key is only
+# accepted outside production: sessions then end when the process stops
+SECRET_KEY = os.getenv('SECRET_KEY')
+if not SECRET_KEY:
+    if os.getenv('FLASK_ENV') == 'production':
+        raise RuntimeError("SECRET_KEY must be set when FLASK_ENV=production")
+    print("⚠️ SECRET_KEY not set: using a random key, sessions are per process")
+    SECRET_KEY = os.urandom(32)
+app.secret_key = SECRET_KEY
 
-# Scenario parameters
-scenario_params = {
+# Default digital twin and scenario parameters of a new session
+DEFAULT_DIGITAL_TWIN = 1
+DEFAULT_SCENARIO_PARAMS = {
     'init_cgm': 110,
     'basal_insulin': 1.0,
     'carb_ratio': 12,
@@ -60,7 +101,23 @@ scenario_params = {
     'heart_rate': 70
 }
 
-def load_patient_data(digital_twin_id):
+def get_session_state():
+    """Digital twin and scenario parameters of the current session"""
+    digital_twin_id = session.get('digital_twin', DEFAULT_DIGITAL_TWIN)
+    params = dict(DEFAULT_SCENARIO_PARAMS, **session.get('params', {}))
+    return digital_twin_id, params
+
+def update_session_state(data):
+    """Update the session from the JSON body of a request"""
+    if 'digital_twin' in data:
+        session['digital_twin'] = int(data['digital_twin'])
+    params = dict(session.get('params', {}))
+    for key in ['init_cgm', 'basal_insulin', 'meal_size', 'meal_time']:
+        if key in data:
+            params[key] = float(data[key])
+    session['params'] = params
+
+def load_patient_data(digital_twin_id, scenario_params):
     """Load real patient data from the data files"""
     try:
         # Try to load from the data_example.csv file
@@ -109,15 +166,13 @@ def load_patient_data(digital_twin_id):
             return df_subset
         else:
             print(f"Data file not found: {data_file}")
-            return create_simple_scenario()
+            return create_simple_scenario(scenario_params)
     except Exception as e:
         print(f"Error loading patient data: {e}")
-        return create_simple_scenario()
+        return create_simple_scenario(scenario_params)
 
-def create_simple_scenario():
+def create_simple_scenario(scenario_params):
     """Create a simple scenario DataFrame"""
-    global current_scenario
-    
     # Create a simple scenario DataFrame
     sim_time = 5 * 60  # 5 hours
     n_points = sim_time // 5  # 5-minute intervals
@@ -145,315 +200,207 @@ def create_simple_scenario():
     if meal_time_idx < n_points:
         scenario_data['input_meal_carbs'][meal_time_idx] = scenario_params['meal_size']
     
-    current_scenario = pd.DataFrame(scenario_data)
-    return current_scenario
+    return pd.DataFrame(scenario_data)
 
-def generate_plot(frame=None):
-    """Generate the plot data"""
-    global current_scenario, current_digital_twin
+def run_simulation(digital_twin_id, scenario_params):
+    """Simulation job: plot and statistics of a digital twin and scenario"""
+    current_scenario = load_patient_data(digital_twin_id, scenario_params)
     
-    if current_scenario is None:
-        current_scenario = load_patient_data(current_digital_twin)
+    df_simulation = None
+    if DIGITAL_TWIN_AVAILABLE:
+        print(f"Getting DigitalTwin with n_digitalTwin={digital_twin_id}")
+        myDigitalTwin = twin_registry.get(digital_twin_id)
+        print("Running simulation...")
+        df_simulation = myDigitalTwin.simulate(current_scenario)
+        print(f"Simulation completed. Result shape: {df_simulation.shape}")
     
-    try:
-        # Create DigitalTwin and run simulation
-        if DIGITAL_TWIN_AVAILABLE:
-            print(f"Creating DigitalTwin with n_digitalTwin={current_digital_twin}")
-            myDigitalTwin = DigitalTwin(n_digitalTwin=current_digital_twin)
-            print("Running simulation...")
-            df_simulation = myDigitalTwin.simulate(current_scenario)
-            print(f"Simulation completed. Result shape: {df_simulation.shape}")
-            
-            # Print available columns for debugging
-            print(f"Available columns in df_simulation: {df_simulation.columns.tolist()}")
-            
-            # Use real patient CGM data
-            cgm_actual = df_simulation.output_cgm
-            print(f"Using real patient CGM data from output_cgm - range: {cgm_actual.min():.1f} to {cgm_actual.max():.1f}")
-            
-            # Check for required columns
-            has_cgm_nnpop = 'cgm_NNPop' in df_simulation.columns
-            has_cgm_nndt = 'cgm_NNDT' in df_simulation.columns
-            
-            print("=== COLUMN ANALYSIS ===")
-            print(f"Available columns: {df_simulation.columns.tolist()}")
-            print(f"Has cgm_NNPop: {has_cgm_nnpop}")
-            print(f"Has cgm_NNDT: {has_cgm_nndt}")
-            
-            if has_cgm_nnpop:
-                cgm_pop = df_simulation.cgm_NNPop
-                print(f"Population Model data range: {cgm_pop.min():.1f} to {cgm_pop.max():.1f}")
-                print(f"Population Model first 5 values: {cgm_pop.head().values}")
-                print(f"Actual CGM first 5 values: {cgm_actual.head().values}")
-                print(f"Are Population and Actual identical? {np.array_equal(cgm_pop, cgm_actual)}")
-                print(f"Population vs Actual correlation: {np.corrcoef(cgm_pop, cgm_actual)[0,1]:.3f}")
-            else:
-                cgm_pop = cgm_actual.copy()
-                print("Using actual CGM for population model (cgm_NNPop not found)")
-            
-            if has_cgm_nndt:
-                cgm_dt = df_simulation.cgm_NNDT
-                print(f"Digital Twin data range: {cgm_dt.min():.1f} to {cgm_dt.max():.1f}")
-                print(f"Digital Twin first 5 values: {cgm_dt.head().values}")
-            else:
-                cgm_dt = cgm_actual.copy()
-                print("Using actual CGM for digital twin (cgm_NNDT not found)")
-        else:
-            # Fallback to simple simulation
-            print("DigitalTwin not available, using fallback simulation")
-            cgm_actual = current_scenario['output_cgm'].values
-            cgm_pop = cgm_actual.copy()
-            cgm_dt = cgm_actual.copy()
-        
-        # Prepare data for plotting
-        time_hours_plot = np.arange(len(cgm_actual)) / 12  # Convert to hours
-        
-        # Quick data validation
-        print("=== QUICK DATA TEST ===")
-        print(f"Are arrays empty?")
-        print(f"  time_hours_plot empty: {len(time_hours_plot) == 0}")
-        print(f"  cgm_actual_plot empty: {len(cgm_actual) == 0}")
-        print(f"  cgm_pop_plot empty: {len(cgm_pop) == 0}")
-        print(f"  cgm_dt_plot empty: {len(cgm_dt) == 0}")
-        
-        print(f"Are arrays all the same value?")
-        print(f"  cgm_actual all same: {np.all(cgm_actual == cgm_actual[0])}")
-        if np.all(cgm_actual == cgm_actual[0]):
-            print(f"  cgm_actual value: {cgm_actual[0]}")
-        else:
-            print(f"  cgm_actual range: {cgm_actual.min():.1f} to {cgm_actual.max():.1f}")
-            print(f"  cgm_actual first 5 values: {cgm_actual[:5]}")
-        
-        print(f"  cgm_pop all same: {np.all(cgm_pop == cgm_pop[0])}")
-        if np.all(cgm_pop == cgm_pop[0]):
-            print(f"  cgm_pop value: {cgm_pop[0]}")
-        else:
-            print(f"  cgm_pop range: {cgm_pop.min():.1f} to {cgm_pop.max():.1f}")
-        
-        print(f"  cgm_dt all same: {np.all(cgm_dt == cgm_dt[0])}")
-        if np.all(cgm_dt == cgm_dt[0]):
-            print(f"  cgm_dt value: {cgm_dt[0]}")
-        else:
-            print(f"  cgm_dt range: {cgm_dt.min():.1f} to {cgm_dt.max():.1f}")
-        
-        print(f"Time range: {time_hours_plot[0]:.1f} to {time_hours_plot[-1]:.1f} hours")
-        print(f"Number of data points: {len(time_hours_plot)}")
-        
-        # Check for NaN or infinite values
-        print(f"Any NaN in cgm_actual: {np.any(np.isnan(cgm_actual))}")
-        print(f"Any infinite in cgm_actual: {np.any(np.isinf(cgm_actual))}")
-        print(f"Any NaN in cgm_pop: {np.any(np.isnan(cgm_pop))}")
-        print(f"Any infinite in cgm_pop: {np.any(np.isinf(cgm_pop))}")
-        print(f"Any NaN in cgm_dt: {np.any(np.isnan(cgm_dt))}")
-        print(f"Any infinite in cgm_dt: {np.any(np.isinf(cgm_dt))}")
-        
-        # Convert to lists for JSON serialization
-        print("Creating traces with:")
-        print(f"  time_hours_plot: {len(time_hours_plot)} points, type: {type(time_hours_plot)}")
-        print(f"  cgm_actual_plot: {len(cgm_actual)} points, type: {type(cgm_actual)}")
-        print(f"  cgm_pop_plot: {len(cgm_pop)} points, type: {type(cgm_pop)}")
-        print(f"  cgm_dt_plot: {len(cgm_dt)} points, type: {type(cgm_dt)}")
-        
-        time_list = time_hours_plot.tolist()
-        cgm_actual_list = cgm_actual.tolist()
-        cgm_pop_list = cgm_pop.tolist()
-        cgm_dt_list = cgm_dt.tolist()
-        
-        print("After conversion:")
-        print(f"  time_list: {len(time_list)} points")
-        print(f"  cgm_actual_list: {len(cgm_actual_list)} points")
-        
-        # Find meal times
-        meal_mask = current_scenario['input_meal_carbs'] > 0
-        meal_times = time_hours_plot[meal_mask]
-        meal_carbs = current_scenario['input_meal_carbs'][meal_mask]
-        
-        print("=== MEAL ANALYSIS ===")
-        print(f"Meal mask sum: {meal_mask.sum()} meals found")
-        print(f"Meal times: {meal_times}")
-        print(f"Meal carbs: {meal_carbs.values}")
-        print(f"User meal time: {scenario_params['meal_time']} minutes")
-        print(f"User meal size: {scenario_params['meal_size']}g carbs")
-        
-        # Create Plotly figure
-        fig = go.Figure()
-        
-        # Add traces
-        fig.add_trace(go.Scatter(
-            x=time_list,
-            y=cgm_actual_list,
-            mode='lines',
-            name='Actual CGM',
-            line=dict(color='red', width=2)
-        ))
-        
-        fig.add_trace(go.Scatter(
-            x=time_list,
-            y=cgm_pop_list,
-            mode='lines',
-            name='Population Model',
-            line=dict(color='blue', width=2)
-        ))
-        
-        fig.add_trace(go.Scatter(
-            x=time_list,
-            y=cgm_dt_list,
-            mode='lines',
-            name='Digital Twin',
-            line=dict(color='green', width=2)
-        ))
-        
-        # Add meal markers
-        if len(meal_times) > 0:
-            fig.add_trace(go.Scatter(
-                x=meal_times.tolist(),
-                y=[250] * len(meal_times),  # Place at top of chart
-                mode='markers',
-                name='Meals',
-                marker=dict(color='yellow', size=10, symbol='diamond'),
-                text=[f"{carbs}g carbs" for carbs in meal_carbs],
-                hovertemplate='<b>Meal</b><br>%{text}<extra></extra>'
-            ))
-        
-        # Add threshold lines
-        fig.add_hline(y=180, line_dash="dash", line_color="red", annotation_text="Hyper Threshold")
-        fig.add_hline(y=70, line_dash="dash", line_color="red", annotation_text="Hypo Threshold")
-        fig.add_hline(y=250, line_dash="dash", line_color="yellow", annotation_text="High Threshold")
-        
-        # Add target range shading
-        fig.add_hrect(y0=70, y1=180, fillcolor="lightblue", opacity=0.2, annotation_text="Target Range")
-        
-        # Update layout
-        fig.update_layout(
-            title=f"Greens Health Simulator - Patient {current_digital_twin}<br><sub>CGM={scenario_params['init_cgm']:.1f} mg/dL, Basal={scenario_params['basal_insulin']:.1f} U/h, Meal={scenario_params['meal_size']:.1f}g at {scenario_params['meal_time']:.1f}min</sub>",
-            xaxis_title="Time (hours)",
-            yaxis_title="CGM (mg/dL)",
-            yaxis_range=[50, 350],
-            xaxis_range=[0, 25],
-            hovermode='x unified',
-            template='plotly_white'
-        )
-        
-        # Convert to JSON
-        plot_json = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
-        print(f"Plot JSON length: {len(plot_json)}")
-        print(f"Number of traces in JSON: {len(fig.data)}")
-        
-        for i, trace in enumerate(fig.data):
-            print(f"Trace {i}: {trace.name} - {len(trace.x)} points")
-            if hasattr(trace, 'x') and trace.x:
-                print(f"  X range: {min(trace.x):.1f} to {max(trace.x):.1f}")
-            if hasattr(trace, 'y') and trace.y:
-                print(f"  Y range: {min(trace.y):.1f} to {max(trace.y):.1f}")
-        
-        print("Plot generated successfully")
-        return plot_json
-        
-    except Exception as e:
-        print(f"Error generating plot: {e}")
-        import traceback
-        traceback.print_exc()
-        return None
+    return {
+        'plot_data': plot_payload(current_scenario, df_simulation, digital_twin_id, scenario_params),
+        'stats': compute_stats(current_scenario, df_simulation),
+        'params': scenario_params,
+        'digital_twin': digital_twin_id
+    }
+
+def submit_simulation(digital_twin_id, scenario_params):
+    """Queue a simulation; an identical one already in flight is reused"""
+    key = scenario_key(digital_twin_id, sorted(scenario_params.items()))
+    return job_queue.submit(key, run_simulation, digital_twin_id, scenario_params)
+
+def simulate_session():
+    """Simulation of the current session, waiting for its job"""
+    digital_twin_id, params = get_session_state()
+    job = submit_simulation(digital_twin_id, params)
+    return job_queue.wait(job, timeout=SIMULATION_TIMEOUT)
+
+def compute_stats(current_scenario, df_simulation):
+    """Glucose statistics of the actual, population and digital twin CGM"""
+    if df_simulation is not None:
+        # simulate overwrites output_cgm with the population model states
+        actual_glucose = df_simulation['cgm_Actual'] if 'cgm_Actual' in df_simulation.columns else df_simulation.output_cgm
+        pop_glucose = df_simulation.cgm_NNPop if 'cgm_NNPop' in df_simulation.columns else actual_glucose
+        dt_glucose = df_simulation.cgm_NNDT if 'cgm_NNDT' in df_simulation.columns else actual_glucose
+    else:
+        # Fallback statistics
+        actual_glucose = current_scenario['output_cgm']
+        pop_glucose = actual_glucose
+        dt_glucose = actual_glucose
+    
+    stats = {
+        'actual': {
+            'mean': float(round(actual_glucose.mean(), 1)),
+            'max': float(round(actual_glucose.max(), 1)),
+            'min': float(round(actual_glucose.min(), 1)),
+            'time_in_range': float(round(((actual_glucose >= 70) & (actual_glucose <= 180)).sum() / len(actual_glucose) * 100, 1))
+        },
+        'population': {
+            'mean': float(round(pop_glucose.mean(), 1)),
+            'max': float(round(pop_glucose.max(), 1)),
+            'min': float(round(pop_glucose.min(), 1)),
+            'time_in_range': float(round(((pop_glucose >= 70) & (pop_glucose <= 180)).sum() / len(pop_glucose) * 100, 1))
+        },
+        'digital_twin': {
+            'mean': float(round(dt_glucose.mean(), 1)),
+            'max': float(round(dt_glucose.max(), 1)),
+            'min': float(round(dt_glucose.min(), 1)),
+            'time_in_range': float(round(((dt_glucose >= 70) & (dt_glucose <= 180)).sum() / len(dt_glucose) * 100, 1))
+        }
+    }
+    
+    return stats
 
 @app.route('/')
 def index():
     """Main page"""
     print("Index route called")
-    global current_scenario, current_digital_twin
+    digital_twin_id, params = get_session_state()
     
-    if current_scenario is None:
-        current_scenario = load_patient_data(current_digital_twin)
-    
-    plot_json = generate_plot()
+    try:
+        plot_data = simulate_session()['plot_data']
+    except Exception as e:
+        print(f"Error in index: {e}")
+        plot_data = None
     
     return render_template('index.html', 
-                         plot_json=plot_json, 
-                         params=scenario_params,
+                         plot_data=plot_data, 
+                         params=params,
                          voice_enabled=VOICE_ENABLED,
                          voice_module_available=VOICE_MODULE_AVAILABLE)
 
 @app.route('/update_scenario', methods=['POST'])
 def update_scenario():
     """Update simulation parameters"""
-    global current_scenario, current_digital_twin
-    
     try:
-        data = request.get_json()
-        
-        # Update parameters
-        if 'digital_twin' in data:
-            current_digital_twin = int(data['digital_twin'])
-        if 'init_cgm' in data:
-            scenario_params['init_cgm'] = float(data['init_cgm'])
-        if 'basal_insulin' in data:
-            scenario_params['basal_insulin'] = float(data['basal_insulin'])
-        if 'meal_size' in data:
-            scenario_params['meal_size'] = float(data['meal_size'])
-        if 'meal_time' in data:
-            scenario_params['meal_time'] = float(data['meal_time'])
-        
-        # Reload scenario with new parameters
-        current_scenario = load_patient_data(current_digital_twin)
+        update_session_state(request.get_json())
+        result = simulate_session()
         
-        # Create new scenario if needed
-        if current_scenario is None:
-            current_scenario = load_patient_data(current_digital_twin)
-        plot_json = generate_plot()
-        
-        return jsonify({
-            'plot_json': plot_json,
-            'params': scenario_params,
-            'digital_twin': current_digital_twin
+        return compressed_json({
+            'plot_data': result['plot_data'],
+            'params': result['params'],
+            'digital_twin': result['digital_twin']
         })
     except Exception as e:
         print(f"Error in update_scenario: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/plot_data')
+def get_plot_data():
+    """Columnar plot data of the session scenario"""
+    try:
+        return compressed_json(simulate_session()['plot_data'])
+    except Exception as e:
+        print(f"Error getting plot data: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/simulate', methods=['POST'])
+def simulate():
+    """Start a simulation of the session scenario and return its job ID"""
+    update_session_state(request.get_json(silent=True) or {})
+    job = submit_simulation(*get_session_state())
+    
+    return jsonify(job.to_dict()), 202
+
+@app.route('/simulate_batch', methods=['POST'])
+def simulate_batch():
+    """Simulate a list of scenario specs on one or several digital twins
+
+    JSON body: {"scenarios": [spec, ...], "digital_twins": [id, ...],
+    "trajectories": true}. The spec keys are those of
+    t1dsim_ai.batch.scenario_from_spec, plus an optional "digital_twin";
+    digital_twins defaults to the session one. The batch runs as one job
+    (one batched rollout per twin); if it takes longer than
+    SIMULATION_TIMEOUT the job is returned with 202 to be polled.
+    """
+    if not DIGITAL_TWIN_AVAILABLE:
+        return jsonify({'error': 'DigitalTwin not available'}), 503
+    
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict):
+        return jsonify({'error': 'JSON object expected'}), 400
+    digital_twin_id, _ = get_session_state()
+    specs = data.get('scenarios', [])
+    digital_twins = data.get('digital_twins', [digital_twin_id])
+    trajectories = bool(data.get('trajectories', True))
+    
+    # Invalid specs are rejected before the batch is queued
+    try:
+        runs = plan_cohort(twin_registry, specs, digital_twins, max_runs=MAX_BATCH_RUNS)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def run_batch():
+        return batch_payload(simulate_runs(twin_registry, runs), trajectories)
+    
+    key = scenario_key('batch', json.dumps([specs, digital_twins, trajectories], sort_keys=True))
+    job = job_queue.submit(key, run_batch)
+    try:
+        return compressed_json(job_queue.wait(job, timeout=SIMULATION_TIMEOUT))
+    except FuturesTimeoutError:
+        return jsonify(job.to_dict()), 202
+
+@app.route('/stream_simulation')
+def stream_simulation():
+    """Stream the simulation of the session scenario as server-sent events
+
+    The browser appends the records to the plot, so an animation costs one
+    simulation (see plot_payload.simulation_events).
+    """
+    if not DIGITAL_TWIN_AVAILABLE:
+        return jsonify({'error': 'DigitalTwin not available'}), 503
+    
+    digital_twin_id, params = get_session_state()
+    myDigitalTwin = twin_registry.get(digital_twin_id)
+    df_scenario = myDigitalTwin.preprocess_scenario(load_patient_data(digital_twin_id, params))
+    
+    return event_stream(simulation_events(myDigitalTwin, df_scenario, digital_twin_id))
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    """Poll a simulation job; ?wait=<seconds> long-polls until it finishes"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = float('nan')
+    if not np.isfinite(wait):
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    wait = min(max(wait, 0), MAX_POLL_WAIT)
+    try:
+        result = job_queue.wait(job, timeout=wait)
+    except FuturesTimeoutError:
+        return jsonify(job.to_dict()), 202
+    except Exception:
+        return jsonify(job.to_dict()), 500
+    
+    return compressed_json(dict(job.to_dict(), result=result))
+
 @app.route('/get_stats')
 def get_stats():
     """Get simulation statistics"""
-    global current_scenario, current_digital_twin
-    
-    if current_scenario is None:
-        current_scenario = load_patient_data(current_digital_twin)
-    
     try:
-        if DIGITAL_TWIN_AVAILABLE:
-            myDigitalTwin = DigitalTwin(n_digitalTwin=current_digital_twin)
-            df_simulation = myDigitalTwin.simulate(current_scenario)
-            
-            # Calculate statistics
-            actual_glucose = df_simulation.output_cgm
-            pop_glucose = df_simulation.cgm_NNPop if 'cgm_NNPop' in df_simulation.columns else actual_glucose
-            dt_glucose = df_simulation.cgm_NNDT if 'cgm_NNDT' in df_simulation.columns else actual_glucose
-        else:
-            # Fallback statistics
-            actual_glucose = current_scenario['output_cgm']
-            pop_glucose = actual_glucose
-            dt_glucose = actual_glucose
-        
-        stats = {
-            'actual': {
-                'mean': float(round(actual_glucose.mean(), 1)),
-                'max': float(round(actual_glucose.max(), 1)),
-                'min': float(round(actual_glucose.min(), 1)),
-                'time_in_range': float(round(((actual_glucose >= 70) & (actual_glucose <= 180)).sum() / len(actual_glucose) * 100, 1))
-            },
-            'population': {
-                'mean': float(round(pop_glucose.mean(), 1)),
-                'max': float(round(pop_glucose.max(), 1)),
-                'min': float(round(pop_glucose.min(), 1)),
-                'time_in_range': float(round(((pop_glucose >= 70) & (pop_glucose <= 180)).sum() / len(pop_glucose) * 100, 1))
-            },
-            'digital_twin': {
-                'mean': float(round(dt_glucose.mean(), 1)),
-                'max': float(round(dt_glucose.max(), 1)),
-                'min': float(round(dt_glucose.min(), 1)),
-                'time_in_range': float(round(((dt_glucose >= 70) & (dt_glucose <= 180)).sum() / len(dt_glucose) * 100, 1))
-            }
-        }
-        
-        return jsonify(stats)
+        return jsonify(simulate_session()['stats'])
     except Exception as e:
         print(f"Error getting stats: {e}")
         return jsonify({'error': str(e)}), 500
@@ -0,0 +1,65 @@
+import time
+
+import pandas as pd
+import torch
+
+from t1dsim_ai.individual_model import IndividualModel
+from t1dsim_ai.ensemble import IndividualModelEnsemble
+from t1dsim_ai.options import hidden_compartments
+
+# MODIFY THIS: Number of subjects trained together
+ensemble_sizes = [1, 4, 8, 16]
+n_iter = 20
+batch_size = 32
+
+df_data = pd.read_csv("data_example/data_example.csv")
+
+
+def train_step(optimizer, nn_solution, loss_fn, batch):
+    batch_x0_hidden, batch_u_pop, batch_u_ind, batch_y, _ = batch
+
+    optimizer.zero_grad()
+    batch_x_sim = nn_solution(batch_x0_hidden, batch_u_pop, batch_u_ind)
+    loss = loss_fn(batch_x_sim[:, :, [0]], batch_y).sum()
+    loss.backward()
+    optimizer.step()
+
+
+print(f"{'K':>3} {'sequential [s/it]':>18} {'ensemble [s/it]':>16} {'speedup':>8}")
+for n_models in ensemble_sizes:
+    individual_models = [
+        IndividualModel("DT" + str(k), df_data.copy(), "") for k in range(n_models)
+    ]
+
+    # Sequential: one IndividualModel per subject
+    init_time = time.perf_counter()
+    for individual_model in individual_models:
+        individual_model.setup_nn(hidden_compartments, 1e-4, batch_size, 1)
+        for _ in range(n_iter):
+            train_step(
+                individual_model.optimizer,
+                individual_model.nn_solution,
+                individual_model.loss,
+                individual_model.batch.get_batch(True),
+            )
+    time_sequential = (time.perf_counter() - init_time) / n_iter
+
+    # Ensemble: the K subjects in one rollout
+    ensemble = IndividualModelEnsemble(individual_models)
+    ensemble.setup_nn(hidden_compartments, 1e-4, batch_size, 1)
+    init_time = time.perf_counter()
+    for _ in range(n_iter):
+        list_batches = [
+            individual_model.batch.get_batch(True)
+            for individual_model in individual_models
+        ]
+        batch = [
+            torch.cat(tensors, 0 if i == 0 else 1)
+            for i, tensors in enumerate(zip(*list_batches))
+        ]
+        train_step(ensemble.optimizer, ensemble.nn_solution, ensemble.loss, batch)
+    time_ensemble = (time.perf_counter() - init_time) / n_iter
+
+    print(
+        f"{n_models:>3} {time_sequential:>18.3f} {time_ensemble:>16.3f} {time_sequential / time_ensemble:>8.2f}"
+    )
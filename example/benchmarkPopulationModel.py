@@ -0,0 +1,61 @@
+import time
+from pathlib import Path
+
+import torch
+
+import t1dsim_ai
+from t1dsim_ai.options import n_neurons_pop
+from t1dsim_ai.population_model import (
+    CGMOHSUSimStateSpaceModel_V2,
+    FusedCGMOHSUSimStateSpaceModel,
+)
+
+torch.manual_seed(0)
+
+# MODIFY THIS: Batch sizes (number of simulated scenarios) and Euler steps
+batch_sizes = [1, 32, 256]
+n_steps = 288  # 1 day at 5 min
+
+state_dict = torch.load(
+    Path(t1dsim_ai.__file__).parent
+    / "models/PopulationModel/population_model_05022024_epoch_15.pt"
+)
+
+ss_pop_model = CGMOHSUSimStateSpaceModel_V2(n_feat=n_neurons_pop)
+ss_pop_model.load_state_dict(state_dict)
+ss_pop_model.eval()
+
+fused_pop_model = FusedCGMOHSUSimStateSpaceModel.from_state_dict(
+    state_dict, n_neurons_pop
+)
+
+
+def euler_rollout(model, x0, u):
+    x_step = x0
+    for step in range(u.shape[0]):
+        x_step = x_step + 5 * model(x_step, u[step])
+    return x_step
+
+
+print(
+    f"{'batch':>6} {'V2 steps/s':>12} {'Fused steps/s':>14} {'speedup':>8} {'max |dx|':>10}"
+)
+with torch.inference_mode():
+    for batch_size in batch_sizes:
+        x0 = 0.1 * torch.randn(batch_size, 10)
+        u = torch.randn(n_steps, batch_size, 2).abs()
+
+        # Same dx within float tolerance
+        dx_err = (ss_pop_model(x0, u[0]) - fused_pop_model(x0, u[0])).abs().max()
+
+        results = {}
+        for name, model in [("V2", ss_pop_model), ("Fused", fused_pop_model)]:
+            euler_rollout(model, x0, u[:10])  # warm-up
+            init_time = time.perf_counter()
+            euler_rollout(model, x0, u)
+            results[name] = n_steps / (time.perf_counter() - init_time)
+
+        print(
+            f"{batch_size:>6} {results['V2']:>12.0f} {results['Fused']:>14.0f} "
+            f"{results['Fused'] / results['V2']:>7.1f}x {dx_err.item():>10.2e}"
+        )
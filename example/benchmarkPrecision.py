@@ -0,0 +1,51 @@
+import time
+
+import pandas as pd
+import torch
+
+from t1dsim_ai.individual_model import DigitalTwin, IndividualModel
+from t1dsim_ai.options import hidden_compartments
+from compare_variants import compare_accuracy, compare_throughput
+
+# MODIFY THIS: Precisions compared against float32
+precisions = ["bfloat16"]
+batch_sizes = [1, 16, 64]
+n_repeats = 3
+n_iter = 20
+batch_size = 32
+
+df_data = pd.read_csv("data_example/data_example.csv")
+
+# Accuracy: drift of every bundled twin over data_example.csv [mg/dL]
+print("Accuracy vs float32 on data_example.csv [mg/dL]")
+variants = {precision: {"precision": precision} for precision in precisions}
+df_scenario = DigitalTwin(n_digitalTwin=0).preprocess_scenario(df_data)
+compare_accuracy(df_scenario, variants, label="precision")
+
+# Inference throughput: batched rollouts of data_example.csv
+print("\nInference throughput [steps/s]")
+compare_throughput(df_scenario, variants, batch_sizes, n_repeats)
+
+# Training: seconds per iteration of IndividualModel
+print("\nTraining [s/it]")
+for precision in ["float32"] + precisions:
+    torch.manual_seed(0)
+    NNIndividual = IndividualModel("DT", df_data.copy(), "")
+    NNIndividual.setup_nn(hidden_compartments, 1e-4, batch_size, 1, precision=precision)
+    init_time = time.perf_counter()
+    for _ in range(n_iter):
+        (
+            batch_x0_hidden,
+            batch_u_pop,
+            batch_u_ind,
+            batch_y,
+            _,
+        ) = NNIndividual.batch.get_batch(True)
+        NNIndividual.optimizer.zero_grad()
+        batch_x_sim = NNIndividual.nn_solution(
+            batch_x0_hidden, batch_u_pop, batch_u_ind
+        )
+        loss = NNIndividual.loss(batch_x_sim[:, :, [0]], batch_y)
+        loss.backward()
+        NNIndividual.optimizer.step()
+    print(f"{precision:>10} {(time.perf_counter() - init_time) / n_iter:>8.3f}")
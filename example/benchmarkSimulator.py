@@ -0,0 +1,71 @@
+import time
+
+import pandas as pd
+import torch
+from torch.profiler import profile, ProfilerActivity
+
+from t1dsim_ai.individual_model import DigitalTwin
+
+# MODIFY THIS: Horizons in 5 min steps (1 day and the full data_example.csv)
+horizons = [288, 8064]
+n_repeats = 3
+n_steps_profile = 288  # Allocations are counted on a shorter rollout
+
+df_data = pd.read_csv("data_example/data_example.csv")
+myDigitalTwin = DigitalTwin(n_digitalTwin=0)
+nn_solution = myDigitalTwin.nn_solution
+
+
+def list_rollout(x0_batch, u_batch, u_batch_ind):
+    """Reference: per-step list + torch.stack with boolean-mask clamping"""
+
+    X_sim_list = []
+    x_step = x0_batch
+    for step in range(u_batch.shape[0]):
+        X_sim_list += [x_step]
+
+        dx = nn_solution.ss_pop_model(x_step, u_batch[step])
+        dx_ind = nn_solution.ss_ind_model(x_step, u_batch[step], u_batch_ind[step])
+        dx[:, 0] += dx_ind[:, 0]
+
+        x_step = x_step + nn_solution.ts * dx
+
+        cgm = x_step[:, 0]
+        cgm[cgm > nn_solution.cgm_max] = nn_solution.cgm_max
+        cgm[cgm < nn_solution.cgm_min] = nn_solution.cgm_min
+        x_step[:, 0] = cgm
+
+    return torch.stack(X_sim_list, 0)
+
+
+def allocations_per_step(fn, x0_batch, u_batch, u_batch_ind):
+    u_batch, u_batch_ind = u_batch[:n_steps_profile], u_batch_ind[:n_steps_profile]
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        fn(x0_batch, u_batch, u_batch_ind)
+    n_alloc = sum(1 for event in prof.events() if event.cpu_memory_usage > 0)
+    return n_alloc / u_batch.shape[0]
+
+
+print(
+    f"{'steps':>6} {'rollout':>8} {'time [s]':>9} {'alloc/step':>11} {'max |dCGM|':>11}"
+)
+with torch.no_grad():
+    for n_steps in horizons:
+        df_scenario = pd.concat([df_data] * (n_steps // len(df_data) + 1))
+        df_scenario = myDigitalTwin.preprocess_scenario(df_scenario.iloc[:n_steps])
+        x0_est, u_pop, u_ind = myDigitalTwin.prepare_data(df_scenario)
+
+        X_ref = list_rollout(x0_est, u_pop, u_ind)
+        X_sim = nn_solution(x0_est, u_pop, u_ind)
+        err = (X_ref[:, :, 0] - X_sim[:, :, 0]).abs().max().item()
+
+        for name, fn in [("list", list_rollout), ("buffer", nn_solution)]:
+            init_time = time.perf_counter()
+            for _ in range(n_repeats):
+                fn(x0_est, u_pop, u_ind)
+            wall_time = (time.perf_counter() - init_time) / n_repeats
+
+            n_alloc = allocations_per_step(fn, x0_est, u_pop, u_ind)
+            print(
+                f"{n_steps:>6} {name:>8} {wall_time:>9.3f} {n_alloc:>11.1f} {err:>11.2e}"
+            )
@@ -0,0 +1,71 @@
+import time
+
+import numpy as np
+
+from t1dsim_ai.individual_model import DigitalTwin, list_digital_twins
+
+
+def cgm_errors(df_sim, df_ref):
+    """(RMSE, max error) of the population and digital twin CGM [mg/dL]"""
+    errors = []
+    for column in ["cgm_NNPop", "cgm_NNDT"]:
+        error = df_sim[column].values - df_ref[column].values
+        errors += [np.sqrt(np.mean(error**2)), np.abs(error).max()]
+    return errors
+
+
+def compare_accuracy(df_scenario, variants, tolerances=None, label="variant"):
+    """CGM error vs float32 of every bundled twin, for DigitalTwin variants
+
+    `variants` maps a name to the DigitalTwin keyword arguments of the
+    variant; `tolerances` maps a name to the accepted (RMSE, max error) in
+    mg/dL (missing or None: report only). Prints a table and returns the
+    (n_digitalTwin, name) above tolerance.
+    """
+    tolerances = tolerances or {}
+
+    print(
+        f"{'twin':>4} {label:>10} {'RMSE pop':>9} {'max pop':>8} {'RMSE DT':>8} {'max DT':>7}"
+    )
+    failures = []
+    for n_digitalTwin in range(len(list_digital_twins())):
+        df_ref = DigitalTwin(n_digitalTwin=n_digitalTwin).simulate(df_scenario)
+        for name, kwargs in variants.items():
+            df_sim = DigitalTwin(n_digitalTwin=n_digitalTwin, **kwargs).simulate(
+                df_scenario
+            )
+            errors = cgm_errors(df_sim, df_ref)
+            print(
+                f"{n_digitalTwin:>4} {name:>10} {errors[0]:>9.3f} {errors[1]:>8.3f} {errors[2]:>8.3f} {errors[3]:>7.3f}"
+            )
+            if tolerances.get(name) is not None:
+                max_rmse, max_error = tolerances[name]
+                if (
+                    max(errors[0], errors[2]) > max_rmse
+                    or max(errors[1], errors[3]) > max_error
+                ):
+                    failures.append((n_digitalTwin, name))
+
+    for n_digitalTwin, name in failures:
+        print(
+            f"FAIL: twin {n_digitalTwin} {name}: error above (RMSE, max) = {tolerances[name]} mg/dL"
+        )
+
+    return failures
+
+
+def compare_throughput(df_scenario, variants, batch_sizes, n_repeats=3):
+    """Steps/s of batched rollouts of the float32 twin 0 and of its variants"""
+    print(f"{'batch':>5} " + " ".join(f"{c:>10}" for c in ["float32", *variants]))
+    for n_scenarios in batch_sizes:
+        throughput = []
+        for kwargs in [{}, *variants.values()]:
+            myDigitalTwin = DigitalTwin(n_digitalTwin=0, **kwargs)
+            list_scenarios = [df_scenario] * n_scenarios
+            myDigitalTwin.simulate_batch(list_scenarios, as_frame=False)  # warm-up
+            init_time = time.perf_counter()
+            for _ in range(n_repeats):
+                myDigitalTwin.simulate_batch(list_scenarios, as_frame=False)
+            wall_time = (time.perf_counter() - init_time) / n_repeats
+            throughput.append(n_scenarios * len(df_scenario) / wall_time)
+        print(f"{n_scenarios:>5} " + " ".join(f"{t:>10.0f}" for t in throughput))
@@ -0,0 +1,147 @@
+import base64
+import gzip
+import json
+
+import numpy as np
+from flask import Response, request, stream_with_context
+
+# Sampling time of the simulations in hours (5 minutes)
+DT_HOURS = 5 / 60
+
+# Responses smaller than this are not worth compressing
+GZIP_MIN_BYTES = 1024
+
+# Steps simulated per model call while streaming (one hour)
+STREAM_CHUNK_STEPS = 12
+
+
+def encode_column(values):
+    """Base64 of a column as little-endian float32 (a JS Float32Array)"""
+    data = np.ascontiguousarray(values, dtype="<f4").tobytes()
+    return base64.b64encode(data).decode("ascii")
+
+
+def plot_payload(current_scenario, df_simulation, digital_twin_id, scenario_params):
+    """Time series of the simulation plot as a compact columnar payload
+
+    Only the columns are sent, as base64 float32 arrays; the page builds the
+    Plotly figure itself. Without a simulation (DigitalTwin not available)
+    only the scenario columns are sent.
+    """
+    df = current_scenario if df_simulation is None else df_simulation
+
+    # simulate overwrites output_cgm with the population model states
+    cgm_actual = df["cgm_Actual"] if "cgm_Actual" in df.columns else df["output_cgm"]
+    columns = {
+        "cgm_actual": cgm_actual,
+        "insulin": df["input_insulin"],
+        "carbs": df["input_meal_carbs"],
+    }
+    if df_simulation is not None:
+        columns["cgm_pop"] = df_simulation["cgm_NNPop"]
+        columns["cgm_dt"] = df_simulation["cgm_NNDT"]
+
+    return {
+        "encoding": "float32-base64",
+        "length": len(df),
+        "dt_hours": DT_HOURS,
+        "columns": {name: encode_column(values) for name, values in columns.items()},
+        "digital_twin": digital_twin_id,
+        "params": scenario_params,
+    }
+
+
+def compressed_json(data, status=200):
+    """JSON response, gzip-compressed when the client accepts it"""
+    body = json.dumps(data, separators=(",", ":")).encode()
+    response = Response(body, status=status, mimetype="application/json")
+    response.vary.add("Accept-Encoding")
+
+    if len(body) >= GZIP_MIN_BYTES and "gzip" in request.accept_encodings:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+
+    return response
+
+
+def batch_payload(results, trajectories=True):
+    """Summaries and, optionally, CGM columns of t1dsim_ai.batch.simulate_cohort results"""
+    payload = []
+    for result in results:
+        item = {
+            "scenario": result["scenario"],
+            "digital_twin": result["digital_twin"],
+            "length": len(result["cgm_NNDT"]),
+            "summary": result["summary"],
+        }
+        if trajectories:
+            item["columns"] = {
+                "cgm_pop": encode_column(result["cgm_NNPop"]),
+                "cgm_dt": encode_column(result["cgm_NNDT"]),
+            }
+        payload.append(item)
+
+    return {"encoding": "float32-base64", "dt_hours": DT_HOURS, "results": payload}
+
+
+def sse_event(data, event=None):
+    """Server-sent event with a compact JSON payload"""
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def simulation_events(digital_twin, df_scenario, digital_twin_id):
+    """Server-sent events of a simulation, one record per step
+
+    The preprocessed scenario is simulated once by a DigitalTwinSession, one
+    chunk of steps at a time, and each step is sent as soon as it is computed
+    as [time_hours, cgm_actual, cgm_pop, cgm_dt, insulin, carbs], between a
+    "meta" and an "end" event.
+    """
+    # Needs torch, unlike the rest of the module
+    from t1dsim_ai.session import DigitalTwinSession
+
+    n_steps = len(df_scenario)
+    cgm_actual = df_scenario.output_cgm.values
+    insulin = df_scenario.input_insulin.values
+    carbs = df_scenario.input_meal_carbs.values
+
+    def record(k, cgm_pop, cgm_dt):
+        return [
+            round(float(k * DT_HOURS), 4),
+            round(float(cgm_actual[k]), 1),
+            round(float(cgm_pop), 1),
+            round(float(cgm_dt), 1),
+            round(float(insulin[k]), 3),
+            float(carbs[k]),
+        ]
+
+    fields = ["time_hours", "cgm_actual", "cgm_pop", "cgm_dt", "insulin", "carbs"]
+    meta = {"fields": fields, "total_frames": n_steps, "digital_twin": digital_twin_id}
+    yield sse_event(meta, event="meta")
+
+    # Row 0 is the steady state of the initial CGM
+    twin_session = DigitalTwinSession(digital_twin, cgm_actual[0])
+    yield sse_event(record(0, cgm_actual[0], cgm_actual[0]))
+
+    # The inputs of row k give the states of row k + 1
+    for start in range(0, n_steps - 1, STREAM_CHUNK_STEPS):
+        end = min(start + STREAM_CHUNK_STEPS, n_steps - 1)
+        df_chunk = twin_session.advance(end - start, df_scenario.iloc[start:end])
+        yield "".join(
+            sse_event(record(k, cgm_pop, cgm_dt))
+            for k, cgm_pop, cgm_dt in zip(
+                df_chunk.index, df_chunk.cgm_NNPop, df_chunk.cgm_NNDT
+            )
+        )
+
+    yield sse_event({"total_frames": n_steps}, event="end")
+
+
+def event_stream(events):
+    """Unbuffered text/event-stream response of a generator of events"""
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -4,7 +4,7 @@ import matplotlib.pyplot as plt
 import matplotlib.animation as animation
 from matplotlib.animation import FuncAnimation
 from matplotlib.widgets import Slider, Button, TextBox
-from t1dsim_ai.individual_model import DigitalTwin
+from t1dsim_ai.registry import DigitalTwinRegistry
 import datetime
 
 # Global variables for interactive control
@@ -13,6 +13,10 @@ current_speed = 50
 animation_running = True
 current_scenario = None
 
+# Twins are built once and reused by every frame; hourly prefix checkpoints
+# resume edited scenarios at the first change
+twin_registry = DigitalTwinRegistry(capacity=5, checkpoint_every=12)
+
 # Setup the figure with extra space for controls
 fig = plt.figure(figsize=(16, 12))
 fig.suptitle('Interactive T1D Digital Twin - Simple Scenario Creator', fontsize=16, fontweight='bold')
@@ -273,7 +277,7 @@ def animate(frame):
         return line_actual, line_pop, line_dt, line_insulin, line_carbs, time_text, glucose_text
     
     # Simulate the scenario with current digital twin
-    myDigitalTwin = DigitalTwin(n_digitalTwin=current_digital_twin)
+    myDigitalTwin = twin_registry.get(current_digital_twin)
     df_simulation = myDigitalTwin.simulate(current_scenario)
     
     # Calculate window start and end (show last 4 hours)
@@ -0,0 +1,31 @@
+import pandas as pd
+
+from t1dsim_ai.individual_model import DigitalTwin
+from compare_variants import compare_accuracy, compare_throughput
+
+# MODIFY THIS: Quantized models compared against the float32 twin
+configurations = {"individual": True, "both": ["population", "individual"]}
+# Accepted CGM error vs float32 [mg/dL]: (RMSE, max error) over the whole
+# file (None: report only). Measured: individual ~1.4 / 18, both ~10 / 100
+tolerances = {"individual": (2.0, 25.0), "both": None}
+batch_sizes = [1, 16, 64]
+n_repeats = 3
+
+df_data = pd.read_csv("data_example/data_example.csv")
+
+# CGM trajectory error of every bundled twin over data_example.csv [mg/dL]
+print("CGM error vs float32 on data_example.csv [mg/dL]")
+variants = {
+    name: {"quantized": quantized} for name, quantized in configurations.items()
+}
+df_scenario = DigitalTwin(n_digitalTwin=0).preprocess_scenario(df_data)
+failures = compare_accuracy(df_scenario, variants, tolerances, label="quantized")
+if not failures:
+    print("All configurations within tolerance")
+
+# Throughput: batched rollouts of data_example.csv
+print("\nThroughput [steps/s]")
+compare_throughput(df_scenario, variants, batch_sizes, n_repeats)
+
+if failures:
+    raise SystemExit(1)
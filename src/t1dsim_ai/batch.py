@@ -0,0 +1,232 @@
+from t1dsim_ai.create_scenarios import digitalTwin_scenario
+from t1dsim_ai.utils.metrics import (
+    get_TIR,
+    get_TBR70,
+    get_TAR180,
+    get_glucose_variability,
+)
+
+import numpy as np
+
+# Longest scenario of a spec [min]: one week
+max_sim_time = 7 * 24 * 60
+
+# Spec keys and the digitalTwin_scenario arguments they set
+spec_arguments = {
+    "init_cgm": "init_cgm",
+    "basal_insulin": "basal_insulin",
+    "carb_ratio": "carb_ratio",
+    "sim_time": "sim_time",
+    "heart_rate": "hr",
+    "heart_rate_profile": "hr_profile",
+    "initial_time": "initial_time",
+    "bedtime": "bedtime",
+    "sleep_duration": "sleep_duration",
+}
+
+
+def scenario_from_spec(spec):
+    """Scenario DataFrame of a JSON scenario spec
+
+    All keys are optional (defaults of digitalTwin_scenario, but no meals):
+    init_cgm [mg/dL], basal_insulin [U/h], carb_ratio [g/U], meals (list of
+    {"time": min since start, "carbs": g}), heart_rate (baseline, bpm),
+    heart_rate_profile (bpm every 5 min, sim_time // 5 + 1 values),
+    sim_time [min], initial_time ("HH:MM:SS"), bedtime [min since start] and
+    sleep_duration [h]. Raises ValueError on an invalid spec.
+    """
+
+    spec = dict(spec)
+    meals = spec.pop("meals", [])
+
+    unknown = set(spec) - set(spec_arguments)
+    if unknown:
+        raise ValueError("Unknown scenario keys: {}".format(sorted(unknown)))
+
+    kwargs = {spec_arguments[key]: value for key, value in spec.items()}
+    for key in ("init_cgm", "basal_insulin", "carb_ratio", "hr", "sleep_duration"):
+        if key in kwargs:
+            kwargs[key] = float(kwargs[key])
+    for key in ("sim_time", "bedtime"):
+        if key in kwargs:
+            kwargs[key] = int(kwargs[key])
+
+    if not 0 < kwargs.get("sim_time", 1) <= max_sim_time:
+        raise ValueError("sim_time must be between 1 and {} min".format(max_sim_time))
+    if kwargs.get("carb_ratio", 1) <= 0:
+        raise ValueError("carb_ratio must be positive")
+    if "initial_time" in kwargs:
+        try:
+            hours, minutes, seconds = map(int, kwargs["initial_time"].split(":"))
+        except (AttributeError, ValueError):
+            raise ValueError('initial_time must be "HH:MM:SS"')
+
+    try:
+        meal_time = [float(meal["time"]) for meal in meals]
+        meal_size = [float(meal["carbs"]) for meal in meals]
+    except (KeyError, TypeError):
+        raise ValueError('Meals must be a list of {"time": min, "carbs": g}')
+
+    return digitalTwin_scenario(
+        meal_size_array=meal_size, meal_time_fromStart_array=meal_time, **kwargs
+    )
+
+
+def glucose_summary(cgm, lim_inf=70, lim_sup=180):
+    """Glycemic summary of a CGM trajectory [mg/dL]
+
+    Mean, min and max in mg/dL; coefficient of variation (cv), time in range
+    (tir), below range (tbr) and above range (tar) in %.
+    """
+
+    cgm = np.asarray(cgm, dtype=np.float64)
+
+    return {
+        "mean": float(np.nanmean(cgm)),
+        "min": float(np.nanmin(cgm)),
+        "max": float(np.nanmax(cgm)),
+        "cv": 100 * float(get_glucose_variability(cgm)),
+        "tir": 100 * float(get_TIR(cgm, lim_inf, lim_sup)),
+        "tbr": 100 * float(get_TBR70(cgm, lim_inf)),
+        "tar": 100 * float(get_TAR180(cgm, lim_sup)),
+    }
+
+
+def plan_cohort(registry, specs, digital_twins=(0,), max_runs=None):
+    """Validate scenario specs and group their scenarios by digital twin
+
+    A spec with a "digital_twin" key runs on that twin only, the others on
+    every twin of `digital_twins`. Nothing is simulated, so a request can
+    be checked before it is queued.
+
+    Parameters
+    ----------
+    registry: DigitalTwinRegistry
+        Provides the list of digital twins
+    specs: list of dict
+        Scenario specs, see scenario_from_spec
+    digital_twins: list of int
+        Indexes of the bundled digital twins
+    max_runs: int
+        Maximum number of (spec, twin) pairs
+
+    Returns
+    -------
+    dict
+        (index of the spec, scenario DataFrame) pairs by twin index
+
+    Raises ValueError, naming the index of the spec, if a spec or a twin
+    index is invalid.
+
+    """
+
+    if not isinstance(specs, (list, tuple)):
+        raise ValueError("Scenarios must be a list of specs")
+    if not specs:
+        raise ValueError("No scenarios to simulate")
+
+    n_available = len(registry.digital_twin_list)
+
+    def twin_indexes(twins):
+        twins = [int(n_digitalTwin) for n_digitalTwin in twins]
+        for n_digitalTwin in twins:
+            if not 0 <= n_digitalTwin < n_available:
+                raise ValueError("Unknown digital twin: {}".format(n_digitalTwin))
+        return twins
+
+    try:
+        digital_twins = twin_indexes(digital_twins)
+    except (TypeError, ValueError) as e:
+        raise ValueError("Invalid digital twins: {}".format(e)) from e
+
+    runs = {}
+    n_runs = 0
+    for n_spec, spec in enumerate(specs):
+        # Malformed values may fail deep in digitalTwin_scenario
+        try:
+            spec = dict(spec)
+            if "digital_twin" in spec:
+                twins = twin_indexes([spec.pop("digital_twin")])
+            else:
+                twins = digital_twins
+            df_scenario = scenario_from_spec(spec)
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ValueError("Scenario {}: {}".format(n_spec, e)) from e
+
+        for n_digitalTwin in twins:
+            runs.setdefault(n_digitalTwin, []).append((n_spec, df_scenario))
+
+            n_runs += 1
+            if max_runs is not None and n_runs > max_runs:
+                raise ValueError("More than {} simulations".format(max_runs))
+
+    return runs
+
+
+def simulate_runs(registry, runs):
+    """Simulate the runs of plan_cohort, one batched rollout per twin
+
+    Returns the results of simulate_cohort.
+    """
+
+    results = []
+    for n_digitalTwin, twin_runs in runs.items():
+        sim = registry.get(n_digitalTwin).simulate_batch(
+            [df_scenario for _, df_scenario in twin_runs], as_frame=False
+        )
+
+        for n, (n_spec, _) in enumerate(twin_runs):
+            length = sim["length"][n]
+            cgm_pop = sim["cgm_NNPop"][n, :length]
+            cgm_DT = sim["cgm_NNDT"][n, :length]
+
+            results.append(
+                {
+                    "scenario": n_spec,
+                    "digital_twin": n_digitalTwin,
+                    "cgm_NNPop": cgm_pop,
+                    "cgm_NNDT": cgm_DT,
+                    "summary": {
+                        "population": glucose_summary(cgm_pop),
+                        "digital_twin": glucose_summary(cgm_DT),
+                    },
+                }
+            )
+
+    return sorted(results, key=lambda result: result["scenario"])
+
+
+def simulate_cohort(registry, specs, digital_twins=(0,), max_runs=None):
+    """Simulate scenario specs on one or several digital twins
+
+    A spec with a "digital_twin" key runs on that twin only, the others on
+    every twin of `digital_twins`. The scenarios of a twin are simulated in
+    one batched rollout (DigitalTwin.simulate_batch).
+
+    Parameters
+    ----------
+    registry: DigitalTwinRegistry
+        Provides the digital twins
+    specs: list of dict
+        Scenario specs, see scenario_from_spec
+    digital_twins: list of int
+        Indexes of the bundled digital twins
+    max_runs: int
+        Maximum number of (spec, twin) pairs, checked before simulating
+
+    Returns
+    -------
+    list of dict
+        One result per (spec, twin) pair, grouped by spec: the indexes of the
+        spec ("scenario") and of the twin ("digital_twin"), the trajectories
+        "cgm_NNPop" and "cgm_NNDT" [mg/dL] and their glucose summaries
+        ("summary": {"population": ..., "digital_twin": ...}).
+
+    Raises ValueError, naming the index of the spec, if a spec or a twin
+    index is invalid; nothing is simulated then.
+
+    """
+
+    return simulate_runs(
+        registry, plan_cohort(registry, specs, digital_twins, max_runs)
+    )
@@ -1,7 +1,6 @@
 import numpy as np
 import pandas as pd
 import datetime
-from pathlib import Path
 from t1dsim_ai.options import states, inputs, input_ind
 
 
@@ -12,17 +11,16 @@ def digitalTwin_scenario(
     basal_insulin=1,  # U/h
     carb_ratio=12,
     sim_time=5 * 60,
-    hr=70,  # int or array of len sim_time
+    hr=70,  # Baseline heart rate (bpm)
     initial_time="08:00:00",
     bedtime=13 * 60,  # Bedtime since start simulation
     sleep_duration=8,  # Sleep duration in hours
     exercise_time=60 * 2,
     exercise_duration=0.5,
+    hr_profile=None,  # Heart rate every 5 min (sim_time // 5 + 1 values)
 ):
-    np.random.seed(0)
-    dfInitStates = pd.read_csv(
-        Path(__file__).parent / "models/initSteadyStates.csv"
-    ).set_index("initCGM")
+    # Local generator: same noise as np.random.seed(0), without global state
+    rng = np.random.RandomState(0)
 
     base_date = datetime.datetime(2024, 8, 15)
     (h, m, s) = initial_time.split(":")
@@ -34,38 +32,51 @@ def digitalTwin_scenario(
         pd.Timestamp(base_date + initial_time + datetime.timedelta(minutes=sim_time)),
         freq="5 min",
     )
+    n_steps = len(df_scenario)
+
+    idx_meals = np.array(meal_time_fromStart_array, dtype=int) // 5
+    if np.any((idx_meals < 0) | (idx_meals >= n_steps)):
+        raise ValueError("Meal times must be between 0 and sim_time")
 
     df_scenario[states + inputs + input_ind] = 0.0
     df_scenario["feat_hour_of_day_cos"] = np.cos(
         2 * np.pi * df_scenario["time"].dt.hour / 24
     )
-    df_scenario["feat_hour_of_day_cos"] = np.sin(
+    df_scenario["feat_hour_of_day_sin"] = np.sin(
         2 * np.pi * df_scenario["time"].dt.hour / 24
     )
-    df_scenario.loc[0, "cgm"] = init_cgm
-    df_scenario.loc[
-        np.array(meal_time_fromStart_array) // 5, "input_meal_carbs"
-    ] = meal_size_array
+
+    # The simulation starts at the steady state of the initial CGM
+    df_scenario.loc[0, "output_cgm"] = init_cgm
+    df_scenario.loc[idx_meals, "input_meal_carbs"] = meal_size_array
 
     df_scenario["input_insulin"] = basal_insulin
-    df_scenario.loc[np.array(meal_time_fromStart_array) // 5, "input_insulin"] = (
+    df_scenario.loc[idx_meals, "input_insulin"] = (
         12 * np.array(meal_size_array) / carb_ratio
     )
 
-    df_scenario["heart_rate"] = hr + np.random.normal(0, 2, len(df_scenario))
+    df_scenario["heart_rate"] = hr + rng.normal(0, 2, n_steps)
 
-    df_scenario.loc[0, states] = dfInitStates.loc[int(init_cgm), states]
-
-    df_scenario.loc[
-        bedtime // 5 : (bedtime + sleep_duration * 60) // 5, "sleep_efficiency"
-    ] = 1
-    df_scenario.loc[
-        bedtime // 5 : (bedtime + sleep_duration * 60) // 5, "heart_rate"
-    ] = (hr - 10 + np.random.normal(0, 1, sleep_duration * 12 + 1))
+    is_asleep = (df_scenario.index >= bedtime // 5) & (
+        df_scenario.index <= (bedtime + sleep_duration * 60) // 5
+    )
+    df_scenario.loc[is_asleep, "sleep_efficiency"] = 1
+    df_scenario.loc[is_asleep, "heart_rate"] = (
+        hr - 10 + rng.normal(0, 1, is_asleep.sum())
+    )
 
     # df_scenario.loc[
     #    exercise_time // 5 : (exercise_time + exercise_duration * 60) // 5, "heart_rate"
     # ] = (hr + 30 + np.random.normal(0, 1, int(exercise_duration * 12) + 1))
+
+    if hr_profile is not None:
+        hr_profile = np.asarray(hr_profile, dtype=np.float64)
+        if hr_profile.shape != (n_steps,):
+            raise ValueError(
+                "hr_profile has {} values, {} needed".format(hr_profile.size, n_steps)
+            )
+        df_scenario["heart_rate"] = hr_profile
+
     df_scenario["heart_rate_WRTbaseline"] = df_scenario["heart_rate"] - hr
 
     return df_scenario
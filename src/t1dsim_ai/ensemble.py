@@ -0,0 +1,384 @@
+from t1dsim_ai.individual_model import (
+    CGMIndividual,
+    ForwardEulerSimulator,
+    load_population_model,
+)
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+
+class EnsembleCGMIndividual(nn.Module):
+
+    """K CGMIndividual networks with stacked weights
+
+    Every layer holds the weights of the K networks in a (K, n_out, n_in)
+    tensor and is evaluated for all of them with a single batched matmul.
+    The batch axis is split in K consecutive blocks: rows
+    [k * q, (k + 1) * q) go through network k. When `active` is set, only
+    those networks are evaluated, one block each in the order of `active`.
+
+    Attributes
+    ----------
+    n_models: int
+        Number of stacked networks (K)
+    weights: nn.ParameterList
+        Weights of each layer. Size: (K, n_out, n_in)
+    biases: nn.ParameterList
+        Biases of each layer. Size: (K, 1, n_out)
+    active: torch.Tensor
+        Indexes of the networks evaluated by forward (None: all)
+
+    """
+
+    def __init__(self, hidden_compartments, n_models, init_small=True, generators=None):
+        super(EnsembleCGMIndividual, self).__init__()
+
+        self.hidden_compartments = hidden_compartments
+        self.n_models = n_models
+        self.active = None
+
+        n_neurons = list(hidden_compartments["models"][:-1]) + [1]
+        self.weights = nn.ParameterList(
+            [
+                nn.Parameter(torch.zeros(n_models, n_neurons[i + 1], n_neurons[i]))
+                for i in range(len(n_neurons) - 1)
+            ]
+        )
+        self.biases = nn.ParameterList(
+            [
+                nn.Parameter(torch.zeros(n_models, 1, n_neurons[i + 1]))
+                for i in range(len(n_neurons) - 1)
+            ]
+        )
+
+        with torch.no_grad():
+            for k in range(n_models):
+                generator = None if generators is None else generators[k]
+                if init_small:
+                    for weight in self.weights:
+                        weight[k].normal_(mean=0, std=1e-4, generator=generator)
+                else:
+                    self.load_model(k, CGMIndividual(hidden_compartments, False))
+
+    @classmethod
+    def from_models(cls, hidden_compartments, list_models):
+        ensemble = cls(hidden_compartments, len(list_models))
+        for k, model in enumerate(list_models):
+            ensemble.load_model(k, model)
+        return ensemble
+
+    def linear_layers(self, model):
+        return [m for m in model.net_model if isinstance(m, nn.Linear)]
+
+    def load_model(self, k, model):
+        """Copy the weights of a CGMIndividual into network k"""
+
+        with torch.no_grad():
+            for weight, bias, linear in zip(
+                self.weights, self.biases, self.linear_layers(model)
+            ):
+                weight[k].copy_(linear.weight)
+                bias[k, 0].copy_(linear.bias)
+
+    def model(self, k):
+        """CGMIndividual with a copy of the weights of network k"""
+
+        # The initialization of the new model must not consume the global RNG
+        with torch.random.fork_rng(devices=[]):
+            model = CGMIndividual(self.hidden_compartments)
+        model.to(self.weights[0].device)
+
+        with torch.no_grad():
+            for weight, bias, linear in zip(
+                self.weights, self.biases, self.linear_layers(model)
+            ):
+                linear.weight.copy_(weight[k])
+                linear.bias.copy_(bias[k, 0])
+
+        return model
+
+    @property
+    def n_active(self):
+        return self.n_models if self.active is None else len(self.active)
+
+    def forward(self, in_x, u_pop, u_ind):
+        # Same inputs as CGMIndividual
+        inp = torch.cat((in_x[..., 0:2], in_x[..., 5:6], in_x[..., 7:9], u_ind), -1)
+
+        weights, biases = self.weights, self.biases
+        if self.active is not None:
+            weights = [weight.index_select(0, self.active) for weight in weights]
+            biases = [bias.index_select(0, self.active) for bias in biases]
+
+        hidden = inp.reshape(self.n_active, -1, inp.shape[-1])
+        for i, (weight, bias) in enumerate(zip(weights, biases)):
+            hidden = torch.baddbmm(bias, hidden, weight.transpose(1, 2))
+            if i < len(self.weights) - 1:
+                hidden = torch.relu(hidden)
+
+        return hidden.reshape(-1, 1)
+
+
+class IndividualModelEnsemble:
+
+    """Train the individual models of several subjects at once
+
+    The K individual networks are stacked in an EnsembleCGMIndividual and
+    share one frozen population model. Each iteration draws one minibatch per
+    subject, concatenates them on the batch axis and runs a single
+    ForwardEulerSimulator rollout and backward pass for the K subjects.
+
+    The loss is the sum of the per-subject losses. Networks do not share
+    parameters and Adam works element-wise, so each subject follows the same
+    optimization as with IndividualModel.fit. Each subject keeps its own epoch
+    counter, best model and early stopping; when it stops, it is no longer
+    sampled nor simulated.
+
+    Attributes
+    ----------
+    individual_models: list
+        IndividualModel of each subject (data, batches and saving)
+    n_models: int
+        Number of subjects (K)
+
+    """
+
+    def __init__(self, individual_models, device="cpu"):
+        self.individual_models = individual_models
+        self.n_models = len(individual_models)
+        self.device = device
+
+        self.popModelFolder = individual_models[0].popModelFolder
+        self.LIM_INFERIOR = individual_models[0].LIM_INFERIOR
+        self.LIM_SUPERIOR = individual_models[0].LIM_SUPERIOR
+
+    def setup_nn(
+        self,
+        hidden_compartments,
+        lr,
+        batch_size,
+        n_epochs,
+        overlap=0.9,
+        seq_len=61,
+        ts=5,
+        weight_decay=1e-5,
+        validation=0.0,
+        max_epochs_without_improvement=150,
+        eval_every=1,
+        eval_subset=None,
+        seeds=None,
+        fused=True,
+        precision="float32",
+    ):
+
+        self.hidden_compartments = hidden_compartments
+        self.ts = ts
+        self.precision = precision
+        self.max_epochs_without_improvement = max_epochs_without_improvement
+
+        # One generator per subject: sampling and initialization do not
+        # depend on the other subjects of the ensemble
+        generators = None
+        if seeds is not None:
+            generators = [
+                torch.Generator(device=self.device).manual_seed(seed) for seed in seeds
+            ]
+
+        for k, individual_model in enumerate(self.individual_models):
+            individual_model.setup_batch(
+                batch_size,
+                overlap,
+                seq_len,
+                None if generators is None else generators[k],
+                validation,
+            )
+            individual_model.setup_evaluation(eval_every, eval_subset)
+
+        self.individual_model = EnsembleCGMIndividual(
+            hidden_compartments, self.n_models, generators=generators
+        )
+        self.individual_model.to(self.device)
+
+        self.ss_pop_model = load_population_model(self.device, fused)
+
+        self.nn_solution = ForwardEulerSimulator(
+            self.ss_pop_model,
+            self.individual_model,
+            self.popModelFolder,
+            ts=ts,
+            precision=precision,
+        )
+
+        self.optimizer = optim.Adam(
+            self.individual_model.parameters(), lr=lr, weight_decay=weight_decay
+        )
+
+        self.n_epochs = n_epochs + 1
+
+    def simulator(self, k):
+        """ForwardEulerSimulator with a copy of the network of subject k"""
+
+        return ForwardEulerSimulator(
+            self.ss_pop_model,
+            self.individual_model.model(k),
+            self.popModelFolder,
+            ts=self.ts,
+            precision=self.precision,
+        )
+
+    def fit(self, save_model):
+        """Train the K subjects
+
+        Early stopping and the best model of each subject follow
+        IndividualModel.fit. Checkpointing is not supported.
+
+        Returns
+        -------
+        list
+            Simulation loss on the training windows of the best model of each
+            subject (nan if its training diverged)
+
+        """
+
+        loss_temp = [[] for _ in range(self.n_models)]
+
+        is_active = np.ones(self.n_models, dtype=bool)
+        scores = [np.nan] * self.n_models
+
+        for individual_model in self.individual_models:
+            individual_model.curr_epoch = 1
+            individual_model.best_loss = float("inf")
+            individual_model.best_score = np.nan
+            individual_model.best_model = None
+            individual_model.best_epoch = 0
+            individual_model.epochs_without_improvement = 0
+            individual_model.LOSS = []
+            individual_model.LOSS_TRAIN = []
+            individual_model.LOSS_VAL = []
+
+        print("---Epoch {}: lr {}---".format(1, self.optimizer.param_groups[0]["lr"]))
+
+        while True:
+            self.optimizer.zero_grad()
+
+            # Minibatches of the subjects still training stacked on the batch axis
+            active = np.flatnonzero(is_active)
+            self.individual_model.active = torch.as_tensor(active, device=self.device)
+            list_batches = [
+                self.individual_models[k].batch.get_batch(True) for k in active
+            ]
+            batch_x0_hidden, batch_u_pop, batch_u_ind, batch_y = [
+                torch.cat(tensors, 0 if i == 0 else 1)
+                for i, tensors in enumerate(list(zip(*list_batches))[:4])
+            ]
+            batch_x_sim = self.nn_solution(batch_x0_hidden, batch_u_pop, batch_u_ind)
+
+            losses = self.loss(batch_x_sim[:, :, [0]], batch_y)
+            is_finite = (
+                torch.isfinite(batch_x_sim)
+                .reshape(batch_x_sim.shape[0], len(active), -1)
+                .all(2)
+                .all(0)
+            )
+            loss_values = losses.tolist()
+            is_finite = is_finite.tolist()
+
+            for j, k in enumerate(active):
+                individual_model = self.individual_models[k]
+
+                if not is_finite[j]:
+                    print(
+                        "INFO: Training of {} had stopped because an inf in batch simulation".format(
+                            individual_model.subjectID
+                        )
+                    )
+                    is_active[k] = False
+                    continue
+
+                loss_temp[k].append(loss_values[j])
+
+                if individual_model.curr_epoch < individual_model.batch.epoch:
+                    individual_model.LOSS.append(np.mean(loss_temp[k]))
+                    loss_temp[k] = []
+
+                    individual_model.curr_epoch = individual_model.batch.epoch
+
+                    is_last_epoch = individual_model.curr_epoch == self.n_epochs
+                    if (
+                        is_last_epoch
+                        or (individual_model.curr_epoch - 1)
+                        % individual_model.eval_every
+                        == 0
+                    ):
+                        individual_model.evaluate(self.simulator(k))
+
+                    if (
+                        is_last_epoch
+                        or individual_model.epochs_without_improvement
+                        >= self.max_epochs_without_improvement
+                    ):
+                        is_active[k] = False
+                        scores[k] = individual_model.best_score
+                    else:
+                        print(
+                            f"{individual_model.subjectID} | Epoch {individual_model.curr_epoch-1} | Loss {individual_model.LOSS[-1]:.6f}"
+                        )
+
+            if not is_active.any():
+                break
+
+            # Optimize
+            loss = losses[
+                torch.as_tensor(is_active[active], device=losses.device)
+            ].sum()
+            loss.backward()
+            self.optimizer.step()
+
+        self.individual_model.active = None
+
+        # Each IndividualModel gets its trained network
+        for individual_model in self.individual_models:
+            if individual_model.best_model is None:
+                continue
+
+            individual_model.individual_model = CGMIndividual(self.hidden_compartments)
+            individual_model.individual_model.load_state_dict(
+                individual_model.best_model
+            )
+            individual_model.individual_model.to(self.device)
+            individual_model.nn_solution = ForwardEulerSimulator(
+                self.ss_pop_model,
+                individual_model.individual_model,
+                self.popModelFolder,
+                ts=self.ts,
+                precision=self.precision,
+            )
+
+            if save_model:
+                individual_model.save()
+
+        return scores
+
+    def loss(self, y_pred, y_true):
+        """IndividualModel.loss of each evaluated subject. Size: (n_active,)"""
+
+        n_active = self.individual_model.n_active
+        y_pred = y_pred.reshape(y_pred.shape[0], n_active, -1)
+        y_true = y_true.reshape(y_true.shape[0], n_active, -1)
+
+        err_fit = y_pred[1:] - y_true[1:]
+        err_df = torch.diff(y_pred, dim=0) - torch.diff(y_true, dim=0)
+
+        is_penalized = torch.logical_or(
+            torch.logical_and(y_true[1:] <= self.LIM_INFERIOR, y_pred[1:] > y_true[1:]),
+            torch.logical_and(y_true[1:] >= self.LIM_SUPERIOR, y_pred[1:] < y_true[1:]),
+        )
+        penalty = torch.where(is_penalized, 6.0, 1.0)
+
+        MSE_cgm = torch.mean(err_fit**2 * penalty, dim=(0, 2))
+        MSE_Dcgm = torch.mean(err_df**2, dim=(0, 2))
+
+        return MSE_cgm + 10 * MSE_Dcgm
@@ -0,0 +1,174 @@
+from t1dsim_ai.individual_model import DigitalTwin, list_digital_twins
+from t1dsim_ai.population_model import FusedCGMOHSUSimStateSpaceModel
+from t1dsim_ai.utils.preprocess import scaler_store
+from t1dsim_ai.steady_states import get_init_states_table
+from t1dsim_ai.options import input_ind, idx_robust
+
+import argparse
+import os
+from typing import Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+
+class DigitalTwinModule(nn.Module):
+
+    """Self-contained digital twin for TorchScript / torch.compile
+
+    Bundles the population model, the individual model, the scaler affine
+    constants and the steady-state table, so a rollout goes from raw inputs
+    to states in mg/dL without Python-side preprocessing. There is no
+    data-dependent Python control flow, so the module can be scripted.
+
+    Attributes
+    ----------
+    ss_pop_model: nn.Module
+        Frozen population model (fused)
+    ss_ind_model: nn.Module
+        Frozen individual model
+    ts: float
+        Models sampling time
+
+    """
+
+    def __init__(self, digital_twin):
+        super(DigitalTwinModule, self).__init__()
+
+        nn_solution = digital_twin.nn_solution
+        ss_pop_model = nn_solution.ss_pop_model
+        if not isinstance(ss_pop_model, FusedCGMOHSUSimStateSpaceModel):
+            ss_pop_model = FusedCGMOHSUSimStateSpaceModel.from_model(ss_pop_model)
+
+        self.ss_pop_model = ss_pop_model
+        self.ss_ind_model = nn_solution.ss_ind_model
+        self.ts = float(nn_solution.ts)
+        self.cgm_min = float(nn_solution.cgm_min)
+        self.cgm_max = float(nn_solution.cgm_max)
+
+        scaler_states = scaler_store.states(digital_twin.popModelFolder)
+        scaler_inputs = scaler_store.inputs(digital_twin.popModelFolder)
+
+        # Robust scaling only applies to the idx_robust individual inputs
+        center_ind = np.zeros(len(input_ind))
+        scale_ind = np.ones(len(input_ind))
+        center_ind[idx_robust] = digital_twin.scaler_featsRobust.center_
+        scale_ind[idx_robust] = digital_twin.scaler_featsRobust.scale_
+
+        init_cgm_min, table_init_states = get_init_states_table()
+
+        self.register_buffer("center_states", self._float(scaler_states.center))
+        self.register_buffer("scale_states", self._float(scaler_states.scale))
+        self.register_buffer("center_inputs", self._float(scaler_inputs.center))
+        self.register_buffer("scale_inputs", self._float(scaler_inputs.scale))
+        self.register_buffer("center_ind", self._float(center_ind))
+        self.register_buffer("scale_ind", self._float(scale_ind))
+        self.register_buffer("init_states", self._float(table_init_states))
+        self.init_cgm_min = init_cgm_min
+        self.init_cgm_max = init_cgm_min + len(table_init_states) - 1
+
+        self.eval()
+        for param in self.parameters():
+            param.requires_grad = False
+
+    @staticmethod
+    def _float(array):
+        return torch.tensor(np.asarray(array, dtype=np.float32))
+
+    def forward(
+        self, init_cgm: torch.Tensor, u_pop: torch.Tensor, u_ind: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Population and personalized simulation from raw inputs
+
+        Parameters
+        ----------
+        init_cgm: Tensor. Size: (q,)
+            Initial CGM [mg/dL] of each scenario
+
+        u_pop: Tensor. Size: (m, q, n_u)
+            Unscaled population inputs (inputs in options)
+
+        u_ind: Tensor. Size: (m, q, n_u_ind)
+            Unscaled individual inputs (input_ind in options)
+
+        Returns
+        -------
+        (Tensor, Tensor). Size: (m, q, n_x)
+            Population and personalized states in the original units
+
+        """
+
+        q = init_cgm.shape[0]
+        n_steps = u_pop.shape[0]
+
+        idx_init = init_cgm.clamp(self.init_cgm_min, self.init_cgm_max).long()
+        x0 = self.init_states[idx_init - self.init_cgm_min]
+
+        u_pop = (u_pop - self.center_inputs) / self.scale_inputs
+        u_ind = (u_ind - self.center_ind) / self.scale_ind
+
+        # Population and personalized trajectories stacked on the batch axis
+        x_step = torch.cat((x0, x0), 0)
+        u_pop = torch.cat((u_pop, u_pop), 1)
+
+        X_sim = torch.empty(
+            (n_steps, 2 * q, x0.shape[1]), dtype=x0.dtype, device=x0.device
+        )
+        X_sim[0] = x_step
+        for step in range(n_steps - 1):
+            dx = self.ss_pop_model(x_step, u_pop[step])
+            dx_ind = self.ss_ind_model(x_step[q:], u_pop[step, q:], u_ind[step])
+            dx[q:, 0] += dx_ind[:, 0]
+
+            x_step = x_step + self.ts * dx
+            x_step[:, 0].clamp_(self.cgm_min, self.cgm_max)
+            X_sim[step + 1] = x_step
+
+        X_sim = X_sim * self.scale_states + self.center_states
+        return X_sim[:, :q], X_sim[:, q:]
+
+
+def export_digital_twin(digital_twin, path):
+    """Save a DigitalTwin as a single TorchScript file"""
+
+    scripted_module = torch.jit.script(DigitalTwinModule(digital_twin))
+    torch.jit.save(scripted_module, path)
+
+    return scripted_module
+
+
+def load_digital_twin(path, device=torch.device("cpu")):
+    return torch.jit.load(path, map_location=device)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export digital twins as TorchScript files"
+    )
+    parser.add_argument(
+        "n_digitalTwin",
+        type=int,
+        nargs="*",
+        help="Indexes of the bundled digital twins (default: all)",
+    )
+    parser.add_argument("--custom_DT", help="Folder of a custom digital twin")
+    parser.add_argument("--output", default=".", help="Output folder")
+    args = parser.parse_args()
+
+    if args.custom_DT is not None:
+        digital_twins = [DigitalTwin(custom_DT=args.custom_DT)]
+    else:
+        n_digitalTwins = args.n_digitalTwin or range(len(list_digital_twins()))
+        digital_twins = [DigitalTwin(n_digitalTwin=n) for n in n_digitalTwins]
+
+    os.makedirs(args.output, exist_ok=True)
+    for digital_twin in digital_twins:
+        name = os.path.basename(os.path.normpath(digital_twin.digital_twin_folder))
+        path = os.path.join(args.output, name + ".pt")
+        export_digital_twin(digital_twin, path)
+        print("Exported", path)
+
+
+if __name__ == "__main__":
+    main()
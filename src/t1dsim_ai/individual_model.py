@@ -2,9 +2,16 @@ from t1dsim_ai.utils.preprocess import scaler as scaler_pop
 from t1dsim_ai.utils.preprocess import (
     scaler_inverse,
     scale_single_state,
-    scale_inverse_Q1,
+    scaler_store,
 )
-from t1dsim_ai.population_model import CGMOHSUSimStateSpaceModel_V2
+from t1dsim_ai.utils.io import atomic_write, file_digest
+from t1dsim_ai.population_model import (
+    CGMOHSUSimStateSpaceModel_V2,
+    FusedCGMOHSUSimStateSpaceModel,
+    QuantizedCGMOHSUSimStateSpaceModel,
+)
+from t1dsim_ai.steady_states import init_states
+from t1dsim_ai.prefix_cache import PrefixStateCache
 from t1dsim_ai.options import (
     n_neurons_pop,
     hidden_compartments,
@@ -18,11 +25,13 @@ from t1dsim_ai.options import (
 import torch
 import torch.nn as nn
 import torch.optim as optim
+from torch.ao.quantization import quantize_dynamic
 from pathlib import Path
 import os
+import copy
 import numpy as np
 from pickle import load, dump
-from librosa.util import frame
+from numpy.lib.stride_tricks import sliding_window_view
 import pandas as pd
 
 
@@ -39,6 +48,13 @@ class WeightClipper(object):
             w = w.clamp(self.min, self.max)
 
 
+# Precision of the MLP evaluations (autocast dtype, None: float32)
+autocast_dtypes = {
+    "float32": None,
+    "bfloat16": torch.bfloat16,
+}
+
+
 class ForwardEulerSimulator(nn.Module):
 
     """This class implements prediction/simulation methods for the SS models structure
@@ -51,23 +67,86 @@ class ForwardEulerSimulator(nn.Module):
                    The individual-level neural state space models to be fitted
      ts: float
          models sampling time
+     precision: str
+         Precision of the MLPs (key of autocast_dtypes). With bfloat16 the
+         MLPs run under autocast and the Euler states stay in float32
 
     """
 
-    def __init__(self, ss_pop_model, ss_ind_model, path_scaler, ts=1.0):
+    def __init__(
+        self, ss_pop_model, ss_ind_model, path_scaler, ts=1.0, precision="float32"
+    ):
         super(ForwardEulerSimulator, self).__init__()
         self.ss_pop_model = ss_pop_model
         self.ss_ind_model = ss_ind_model
 
+        if precision not in autocast_dtypes:
+            raise ValueError(
+                "precision must be one of {}".format(list(autocast_dtypes))
+            )
+        self.precision = precision
+        self.autocast_dtype = autocast_dtypes[precision]
+
         self.ts = ts
         self.cgm_min = scale_single_state(40, "Q1", path_scaler)
         self.cgm_max = scale_single_state(400, "Q1", path_scaler)
 
     def adjust_cgm(self, x):
-        x[x > self.cgm_max] = self.cgm_max
-        x[x < self.cgm_min] = self.cgm_min
+        return x.clamp_(self.cgm_min, self.cgm_max)
+
+    def derivative(self, x_step, u_step, u_ind_step=None, n_pop=0):
+        """State derivative of one step; rows from n_pop on are personalized"""
+
+        if self.autocast_dtype is not None:
+            with torch.autocast(x_step.device.type, dtype=self.autocast_dtype):
+                dx = self.derivative_mlp(x_step, u_step, u_ind_step, n_pop)
+            return dx.float()
+
+        return self.derivative_mlp(x_step, u_step, u_ind_step, n_pop)
+
+    def derivative_mlp(self, x_step, u_step, u_ind_step=None, n_pop=0):
+        dx = self.ss_pop_model(x_step, u_step)
+
+        if u_ind_step is not None:
+            dx_ind = self.ss_ind_model(x_step[n_pop:], u_step[n_pop:], u_ind_step)
+            dx[n_pop:, 0] += dx_ind[:, 0]
 
-        return x
+        return dx
+
+    def rollout(self, x0_batch, u_batch, u_batch_ind=None, n_pop=0):
+        """Forward Euler rollout with structure (m, q, n_x)
+
+        Without autograd, the states are written in place into a preallocated
+        (m, q, n_x) tensor. With autograd, each step is a new tensor and the
+        sequence is stacked at the end, which keeps the backward pass linear
+        in the horizon.
+        """
+
+        n_steps = u_batch.shape[0]
+
+        if torch.is_grad_enabled():
+            X_sim_list = [x0_batch]
+            x_step = x0_batch
+            for step in range(n_steps - 1):
+                u_ind_step = None if u_batch_ind is None else u_batch_ind[step]
+                dx = self.derivative(x_step, u_batch[step], u_ind_step, n_pop)
+
+                x_step = x_step + self.ts * dx
+                self.adjust_cgm(x_step[..., 0])
+                X_sim_list.append(x_step)
+
+            return torch.stack(X_sim_list, 0)
+
+        X_sim = x0_batch.new_empty((n_steps,) + x0_batch.shape)
+        X_sim[0] = x0_batch
+        for step in range(n_steps - 1):
+            u_ind_step = None if u_batch_ind is None else u_batch_ind[step]
+            dx = self.derivative(X_sim[step], u_batch[step], u_ind_step, n_pop)
+
+            torch.add(X_sim[step], dx, alpha=self.ts, out=X_sim[step + 1])
+            self.adjust_cgm(X_sim[step + 1, ..., 0])
+
+        return X_sim
 
     def forward(
         self, x0_batch: torch.Tensor, u_batch: torch.Tensor, u_batch_ind, is_pers=True
@@ -89,36 +168,42 @@ class ForwardEulerSimulator(nn.Module):
 
         """
 
-        # X_sim_list: List[torch.Tensor] = []
-        X_sim_list: [torch.Tensor] = []
+        return self.rollout(x0_batch, u_batch, u_batch_ind if is_pers else None)
 
-        x_step = x0_batch
+    def forward_joint(self, x0_batch, u_batch, u_batch_ind):
+        """Population and personalized simulation in a single pass
 
-        for step in range(u_batch.shape[0]):
-            u_step = u_batch[step]
+        Both trajectories are stacked on the batch axis, so the population
+        model runs once per step for the two of them and the individual model
+        only for the personalized half.
 
-            if is_pers:
-                u_ind_step = u_batch_ind[step]
-
-            X_sim_list += [x_step]
+        Parameters
+        ----------
+        x0_batch: Tensor. Size: (q, n_x)
+             Initial state for each subsequence in the minibatch
 
-            dx_pop = self.ss_pop_model(x_step, u_step)
+        u_batch: Tensor. Size: (m, q, n_u)
+            Input sequence for each subsequence in the minibatch
 
-            dx = dx_pop
-            if is_pers:
-                dx_ind = self.ss_ind_model(x_step, u_step, u_ind_step)
-                dx[:, 0] += dx_ind[:, 0]
+        u_batch_ind: Tensor. Size: (m, q, n_u_ind)
+            Individual input sequence for each subsequence in the minibatch
 
-            x_step = x_step + self.ts * dx
+        Returns
+        -------
+        (Tensor, Tensor). Size: (m, q, n_x)
+            Population and personalized simulated states
 
-            if (len(x_step.shape)) == 1:
-                x_step[0] = self.adjust_cgm(x_step[0])
+        """
 
-            else:
-                x_step[:, 0] = self.adjust_cgm(x_step[:, 0])
+        q = x0_batch.shape[0]
 
-        X_sim = torch.stack(X_sim_list, 0)
-        return X_sim
+        X_sim = self.rollout(
+            torch.cat((x0_batch, x0_batch), 0),
+            torch.cat((u_batch, u_batch), 1),
+            u_batch_ind,
+            n_pop=q,
+        )
+        return X_sim[:, :q], X_sim[:, q:]
 
 
 class CGMIndividual(nn.Module):
@@ -155,20 +240,8 @@ class CGMIndividual(nn.Module):
 
     def forward(self, in_x, u_pop, u_ind):
         # q1, q2, s1, s2, I, x1, x2, x3, c2, c1
-        q1, q2, _, _, _, x1, _, x3, c2, _ = (
-            in_x[..., [0]],
-            in_x[..., [1]],
-            in_x[..., [2]],
-            in_x[..., [3]],
-            in_x[..., [4]],
-            in_x[..., [5]],
-            in_x[..., [6]],
-            in_x[..., [7]],
-            in_x[..., [8]],
-            in_x[..., [9]],
-        )
-
-        inp = torch.cat((q1, q2, x1, x3, c2, u_ind), -1)
+        # Inputs: (q1, q2), x1, (x3, c2) and the individual inputs
+        inp = torch.cat((in_x[..., 0:2], in_x[..., 5:6], in_x[..., 7:9], u_ind), -1)
         dQ1_Ind = self.net_model(inp)
 
         return dQ1_Ind
@@ -254,17 +327,19 @@ class IndividualModel:
         seq_len = 61,
         ts=5,
         weight_decay=1e-5,
+        validation=0.0,
+        max_epochs_without_improvement=150,
+        checkpoint_every=0,
+        eval_every=1,
+        eval_subset=None,
+        n_segments=1,
+        continuity_weight=1.0,
+        precision="float32",
     ):
 
         # Batch extraction class
-        self.seq_len = seq_len
-        self.batch = Batch(
-            batch_size,
-            self.seq_len,
-            overlap,
-            self.device,
-            [self.x_est_train, self.u_pop_train, self.y_id_train, self.u_ind_train],
-        )
+        self.setup_batch(batch_size, overlap, seq_len, validation=validation)
+        self.setup_evaluation(eval_every, eval_subset)
 
         # Setup neural model structure
         self.individual_model = CGMIndividual(hidden_compartments=hidden_compartments)
@@ -280,13 +355,23 @@ class IndividualModel:
 
         # Simulator
         self.nn_solution = ForwardEulerSimulator(
-            self.ss_pop_model, self.individual_model, self.popModelFolder, ts=ts
+            self.ss_pop_model,
+            self.individual_model,
+            self.popModelFolder,
+            ts=ts,
+            precision=precision,
         )
 
+        # Multiple shooting: each window is simulated as n_segments segments
+        self.setup_shooting(n_segments, continuity_weight)
+
         # Setup optimizer
         self.optimizer = optim.Adam(
             self.individual_model.parameters(), lr=lr, weight_decay=weight_decay
         )
+        # Sparse updates: only the nodes of the minibatch (and their moments)
+        if self.n_segments > 1:
+            self.optimizer_shooting = optim.SparseAdam([self.shooting_states], lr=lr)
         # lambda1 = lambda epoch: np.exp(-0.1) ** epoch
         # self.scheduler = torch.optim.lr_scheduler.LambdaLR(self.optimizer, lambda1)
 
@@ -295,22 +380,76 @@ class IndividualModel:
         self.curr_epoch = 1
 
         self.best_loss = float("inf")
+        self.best_score = np.nan
         self.best_model = None
+        self.best_epoch = 0
         self.epochs_without_improvement = 0
-        self.max_epochs_without_improvement = 150
+        self.max_epochs_without_improvement = max_epochs_without_improvement
 
-    def fit(self, save_model):
+        # Checkpoint every checkpoint_every epochs (0: never)
+        self.checkpoint_every = checkpoint_every
+        self.pathCheckpoint = self.pathModel + "/checkpoint.pt"
 
-        # Training loop
-        LOSS = []
-        LOSS_TRAIN = []
+        self.LOSS = []
+        self.LOSS_TRAIN = []
+        self.LOSS_VAL = []
+
+    def setup_batch(
+        self, batch_size, overlap=0.9, seq_len=61, generator=None, validation=0.0
+    ):
+        self.seq_len = seq_len
+        self.batch = Batch(
+            batch_size,
+            self.seq_len,
+            overlap,
+            self.device,
+            [self.x_est_train, self.u_pop_train, self.y_id_train, self.u_ind_train],
+            generator,
+            validation,
+        )
+
+    def fit(self, save_model, resume=False):
+        """Train the individual model
+
+        At the end of every epoch the simulation loss is computed on the
+        training windows and, if the Batch holds some, on the validation
+        windows. The model with the lowest validation loss (training loss
+        without validation) is kept, and training stops after
+        max_epochs_without_improvement epochs without improvement.
+
+        Parameters
+        ----------
+        save_model: bool
+            Save the best model and the robust scaler in pathModel
+        resume: bool
+            Continue from pathModel/checkpoint.pt if it exists
+
+        Returns
+        -------
+        float
+            Simulation loss on the training windows of the best model (nan if
+            the training diverged)
+
+        """
+
+        if resume and os.path.exists(self.pathCheckpoint):
+            self.load_checkpoint()
+            print("Resuming training from epoch", self.curr_epoch)
 
-        print("---Epoch {}: lr {}---".format(1, self.optimizer.param_groups[0]["lr"]))
+        # Training loop
+        print(
+            "---Epoch {}: lr {}---".format(
+                self.curr_epoch, self.optimizer.param_groups[0]["lr"]
+            )
+        )
         loss_temp = []
 
         while True:  # for itr in range(0, self.n_iter_max):
             self.optimizer.zero_grad()
+            if self.n_segments > 1:
+                self.optimizer_shooting.zero_grad()
             # Simulate
+            batch_scenarios_idx = self.batch.batch_scenarios_idx
             (
                 batch_x0_hidden,
                 batch_u_pop,
@@ -318,7 +457,14 @@ class IndividualModel:
                 batch_y,
                 batch_x_original,
             ) = self.batch.get_batch(True)
-            batch_x_sim = self.nn_solution(batch_x0_hidden, batch_u_pop, batch_u_ind)
+            if self.n_segments > 1:
+                batch_x_sim, loss_continuity = self.simulate_segments(
+                    batch_scenarios_idx, batch_x0_hidden, batch_u_pop, batch_u_ind
+                )
+            else:
+                batch_x_sim = self.nn_solution(
+                    batch_x0_hidden, batch_u_pop, batch_u_ind
+                )
 
             if torch.isnan(batch_x_sim).any() or torch.isinf(batch_x_sim).any():
                 print("INFO: Training had stopped because an inf in batch simulation")
@@ -326,10 +472,13 @@ class IndividualModel:
 
             # Compute fit loss
             loss = self.loss(batch_x_sim[:, :, [0]], batch_y).to(self.device)
+            if self.n_segments > 1:
+                loss = loss + self.continuity_weight * loss_continuity
             loss_temp.append(loss.item())
 
+            is_checkpoint = False
             if self.curr_epoch < self.batch.epoch:
-                LOSS.append(np.mean(loss_temp))
+                self.LOSS.append(np.mean(loss_temp))
                 loss_temp = []
 
                 self.curr_epoch = self.batch.epoch
@@ -337,73 +486,320 @@ class IndividualModel:
                 # if self.curr_epoch%50==0 and self.curr_epoch>10:
                 #    self.scheduler.step()
 
-                with torch.no_grad():
-                    (
-                        batch_x0_hidden,
-                        batch_u_pop,
-                        batch_u_ind,
-                        batch_y,
-                        batch_x_original,
-                    ) = self.batch.get_all("All")
-                    batch_x_sim = self.nn_solution(
-                        batch_x0_hidden, batch_u_pop, batch_u_ind
-                    )
-                    LOSS_TRAIN.append(
-                        torch.sqrt(
-                            torch.mean(
-                                (
-                                    scale_inverse_Q1(
-                                        batch_x_sim[:, :, [0]], self.popModelFolder
-                                    )
-                                    - scale_inverse_Q1(
-                                        batch_x_original[:, :, [0]], self.popModelFolder
-                                    )
-                                )
-                                ** 2
-                            )
-                        ).item()
-                    )
+                # Evaluation every eval_every epochs and at the last epoch
+                is_evaluated = (
+                    self.curr_epoch == self.n_epochs
+                    or (self.curr_epoch - 1) % self.eval_every == 0
+                )
+                if is_evaluated:
+                    self.evaluate()
 
                 # Early stopping condition
-
-                # if LOSS[-1] < self.best_loss:
-                #    self.best_loss = LOSS[-1]
-                #    self.best_model = self.nn_solution.ss_ind_model.state_dict()
-                #    self.epochs_without_improvement = 0
-
-                # else:
-                #    self.epochs_without_improvement += 1
-
-                # if self.epochs_without_improvement >= self.max_epochs_without_improvement:
-                #    print("Early stopping after {} epochs without improvement.".format(self.epochs_without_improvement))
-                #    break
+                if (
+                    self.epochs_without_improvement
+                    >= self.max_epochs_without_improvement
+                ):
+                    print(
+                        "Early stopping after {} epochs without improvement.".format(
+                            self.epochs_without_improvement
+                        )
+                    )
+                    break
 
                 if self.curr_epoch == self.n_epochs:
                     break
                 else:
                     print(
-                        f"Epoch {self.curr_epoch-1} | Loss {LOSS[-1]:.6f}  Simulation Loss {LOSS_TRAIN[-1]:.6f} "
+                        f"Epoch {self.curr_epoch-1} | Loss {self.LOSS[-1]:.6f} "
+                        + (
+                            f" Simulation Loss {self.LOSS_TRAIN[-1]:.6f} "
+                            if is_evaluated
+                            else ""
+                        )
+                        + (
+                            f"Validation Loss {self.LOSS_VAL[-1]:.6f} "
+                            if is_evaluated and self.LOSS_VAL
+                            else ""
+                        )
                     )
                     # print('---Epoch {} - lr {}---'.format(self.curr_epoch, self.optimizer.param_groups[0]['lr']))
+
+                is_checkpoint = (
+                    self.checkpoint_every > 0
+                    and (self.curr_epoch - 1) % self.checkpoint_every == 0
+                )
+
             # Optimize
             loss.backward()
             self.optimizer.step()
+            if self.n_segments > 1:
+                self.optimizer_shooting.step()
+
+            # After the step, so that a resumed run starts with the next batch
+            if is_checkpoint:
+                self.save_checkpoint()
 
         if self.best_model is None:
             self.best_model = self.nn_solution.ss_ind_model.state_dict()
+        self.nn_solution.ss_ind_model.load_state_dict(self.best_model)
 
         if save_model:
-            if not os.path.exists(self.pathModel):
-                os.mkdir(self.pathModel)
-            dump(
-                self.scaler_featsRobust,
-                open(self.pathModel + "/scaler_robust.pkl", "wb"),
+            self.save()
+
+        if os.path.exists(self.pathCheckpoint):
+            os.remove(self.pathCheckpoint)
+
+        return self.best_score
+
+    def setup_shooting(self, n_segments=1, continuity_weight=1.0):
+        """Multiple shooting nodes of the training windows
+
+        With n_segments > 1, each window of seq_len samples is split into
+        n_segments segments of segment_len samples that share their boundary
+        samples. The segments are simulated in parallel on the batch axis, so
+        gradients only flow through segment_len - 1 Euler steps. The first
+        segment starts from the steady state of the window. The initial state
+        of each other segment is a learnable node, initialized with the
+        observed CGM and the hidden states of a simulation of the whole
+        window. The loss adds continuity_weight times the mean squared gap
+        between the end of each segment and the node of the next one.
+
+        The nodes are stored per window in shooting_states, one row of
+        (n_segments - 1) * n_x values per window. Size: (n_windows,
+        (n_segments - 1) * n_x). The minibatch rows are gathered as a sparse
+        embedding, so that SparseAdam only updates the nodes of the minibatch.
+        """
+
+        self.n_segments = n_segments
+        self.continuity_weight = continuity_weight
+
+        if n_segments == 1:
+            return
+
+        if (self.seq_len - 1) % n_segments != 0:
+            raise ValueError(
+                "seq_len - 1 ({}) must be a multiple of n_segments ({})".format(
+                    self.seq_len - 1, n_segments
+                )
             )
-            torch.save(
-                self.best_model, os.path.join(self.pathModel + "/individual_model.pt")
+        self.segment_len = (self.seq_len - 1) // n_segments + 1
+
+        idx = self.batch.idx_scenarios
+        (
+            batch_x0_hidden,
+            batch_u_pop,
+            batch_u_ind,
+            batch_y,
+            batch_x_original,
+        ) = self.batch.take(idx)
+        with torch.no_grad():
+            batch_x_sim = self.nn_solution(batch_x0_hidden, batch_u_pop, batch_u_ind)
+
+        # States at the start of segments 1 .. n_segments - 1
+        step = self.segment_len - 1
+        nodes = batch_x_sim[step:-1:step].clone()
+        nodes[:, :, 0] = batch_y[step:-1:step, :, 0]
+
+        shooting_states = torch.zeros(
+            (self.batch.x0_data.shape[0], (n_segments - 1) * nodes.shape[2]),
+            device=self.device,
+        )
+        shooting_states[idx] = nodes.transpose(0, 1).reshape(len(idx), -1)
+        self.shooting_states = nn.Parameter(shooting_states)
+
+    def split_segments(self, u_batch):
+        """(m, q, n) -> (segment_len, n_segments * q, n), segment-major"""
+
+        segments = u_batch.unfold(0, self.segment_len, self.segment_len - 1)
+        return segments.permute(3, 0, 1, 2).reshape(
+            self.segment_len, -1, u_batch.shape[2]
+        )
+
+    def simulate_segments(
+        self, batch_scenarios_idx, batch_x0_hidden, batch_u_pop, batch_u_ind
+    ):
+        """Multiple shooting simulation of a minibatch
+
+        Returns
+        -------
+        batch_x_sim: Tensor. Size: (m, q, n_x)
+            Segments joined in one trajectory per window
+        loss_continuity: Tensor
+            Mean squared gap between consecutive segments
+
+        """
+
+        q, n_x = batch_x0_hidden.shape
+
+        nodes = nn.functional.embedding(
+            batch_scenarios_idx, self.shooting_states, sparse=True
+        ).view(q, self.n_segments - 1, n_x)
+        x0_segments = torch.cat((batch_x0_hidden[np.newaxis], nodes.transpose(0, 1)), 0)
+        X_sim = self.nn_solution(
+            x0_segments.reshape(-1, n_x),
+            self.split_segments(batch_u_pop),
+            self.split_segments(batch_u_ind),
+        ).view(self.segment_len, self.n_segments, q, n_x)
+
+        loss_continuity = torch.mean((X_sim[-1, :-1] - x0_segments[1:]) ** 2)
+
+        # First segment, then the other segments without their initial node
+        batch_x_sim = torch.cat(
+            (X_sim[:, 0], X_sim[1:, 1:].transpose(0, 1).reshape(-1, q, n_x)), 0
+        )
+
+        return batch_x_sim, loss_continuity
+
+    def setup_evaluation(self, eval_every=1, eval_subset=None):
+        """Cache on the device the windows of the end-of-epoch evaluation
+
+        Parameters
+        ----------
+        eval_every: int
+            Epochs between evaluations (the last epoch is always evaluated)
+        eval_subset: int
+            Evaluate on a fixed random subset of at most eval_subset windows
+            of each group (default: all the windows)
+
+        """
+
+        self.eval_every = eval_every
+
+        # The scaler is affine: an error in mg/dL is the scaled error times scale
+        self.scale_Q1 = float(scaler_store.states(self.popModelFolder).scale[0])
+
+        self.eval_data = {}
+        for group, idx in [
+            ("Train", self.batch.idx_scenarios),
+            ("Validation", self.batch.idx_validation),
+        ]:
+            if len(idx) == 0:
+                continue
+
+            if eval_subset is not None and eval_subset < len(idx):
+                generator = torch.Generator(device=self.device).manual_seed(0)
+                idx = idx[
+                    torch.randperm(len(idx), generator=generator, device=self.device)[
+                        :eval_subset
+                    ]
+                ]
+
+            (
+                batch_x0_hidden,
+                batch_u_pop,
+                batch_u_ind,
+                batch_y,
+                batch_x_original,
+            ) = self.batch.take(idx)
+            self.eval_data[group] = (
+                batch_x0_hidden,
+                batch_u_pop,
+                batch_u_ind,
+                batch_x_original[:, :, 0],
             )
 
-        return LOSS_TRAIN[-1]
+    def evaluate(self, nn_solution=None):
+        """Simulation losses, best model and early stopping counter of an epoch"""
+
+        if nn_solution is None:
+            nn_solution = self.nn_solution
+
+        self.LOSS_TRAIN.append(self.simulation_loss("Train", nn_solution))
+        if "Validation" in self.eval_data:
+            self.LOSS_VAL.append(self.simulation_loss("Validation", nn_solution))
+
+        loss_monitor = self.LOSS_VAL[-1] if self.LOSS_VAL else self.LOSS_TRAIN[-1]
+        if loss_monitor < self.best_loss:
+            self.best_loss = loss_monitor
+            self.best_score = self.LOSS_TRAIN[-1]
+            self.best_model = copy.deepcopy(nn_solution.ss_ind_model.state_dict())
+            self.best_epoch = self.curr_epoch - 1
+            self.epochs_without_improvement = 0
+        else:
+            self.epochs_without_improvement += self.eval_every
+
+    def simulation_loss(self, group, nn_solution=None):
+        """RMSE [mg/dL] of the simulated CGM on the evaluation windows of a group"""
+
+        if nn_solution is None:
+            nn_solution = self.nn_solution
+
+        batch_x0_hidden, batch_u_pop, batch_u_ind, batch_cgm = self.eval_data[group]
+
+        with torch.inference_mode():
+            batch_x_sim = nn_solution(batch_x0_hidden, batch_u_pop, batch_u_ind)
+            rmse = torch.sqrt(torch.mean((batch_x_sim[:, :, 0] - batch_cgm) ** 2))
+
+        return self.scale_Q1 * rmse.item()
+
+    def save_checkpoint(self):
+        """Save everything fit needs to continue: model, optimizer, sampler and RNG"""
+
+        checkpoint = {
+            "individual_model": self.nn_solution.ss_ind_model.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "batch": self.batch.state_dict(),
+            "curr_epoch": self.curr_epoch,
+            "LOSS": self.LOSS,
+            "LOSS_TRAIN": self.LOSS_TRAIN,
+            "LOSS_VAL": self.LOSS_VAL,
+            "best_loss": self.best_loss,
+            "best_score": self.best_score,
+            "shooting_states": (
+                self.shooting_states.detach() if self.n_segments > 1 else None
+            ),
+            "optimizer_shooting": (
+                self.optimizer_shooting.state_dict() if self.n_segments > 1 else None
+            ),
+            "best_model": self.best_model,
+            "best_epoch": self.best_epoch,
+            "epochs_without_improvement": self.epochs_without_improvement,
+            "rng_torch": torch.get_rng_state(),
+            "rng_numpy": np.random.get_state(),
+        }
+        if torch.cuda.is_available():
+            checkpoint["rng_cuda"] = torch.cuda.get_rng_state_all()
+
+        if not os.path.exists(self.pathModel):
+            os.mkdir(self.pathModel)
+        with atomic_write(self.pathCheckpoint) as f:
+            torch.save(checkpoint, f)
+
+    def load_checkpoint(self):
+        checkpoint = torch.load(
+            self.pathCheckpoint, map_location=self.device, weights_only=False
+        )
+
+        self.nn_solution.ss_ind_model.load_state_dict(checkpoint["individual_model"])
+        self.optimizer.load_state_dict(checkpoint["optimizer"])
+        if self.n_segments > 1:
+            with torch.no_grad():
+                self.shooting_states.copy_(checkpoint["shooting_states"])
+            self.optimizer_shooting.load_state_dict(checkpoint["optimizer_shooting"])
+        self.batch.load_state_dict(checkpoint["batch"])
+
+        self.curr_epoch = checkpoint["curr_epoch"]
+        self.LOSS = checkpoint["LOSS"]
+        self.LOSS_TRAIN = checkpoint["LOSS_TRAIN"]
+        self.LOSS_VAL = checkpoint["LOSS_VAL"]
+        self.best_loss = checkpoint["best_loss"]
+        self.best_score = checkpoint["best_score"]
+        self.best_model = checkpoint["best_model"]
+        self.best_epoch = checkpoint["best_epoch"]
+        self.epochs_without_improvement = checkpoint["epochs_without_improvement"]
+
+        torch.set_rng_state(checkpoint["rng_torch"].cpu())
+        np.random.set_state(checkpoint["rng_numpy"])
+        if "rng_cuda" in checkpoint and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(checkpoint["rng_cuda"])
+
+    def save(self):
+        if not os.path.exists(self.pathModel):
+            os.mkdir(self.pathModel)
+        with atomic_write(self.pathModel + "/scaler_robust.pkl") as f:
+            dump(self.scaler_featsRobust, f)
+        with atomic_write(self.pathModel + "/individual_model.pt") as f:
+            torch.save(self.best_model, f)
 
     def loss(self, y_pred, y_true):
         err_fit = y_pred[1:, :] - y_true[1:, :]
@@ -429,62 +825,57 @@ class IndividualModel:
 
 
 class Batch:
-    def __init__(self, batch_size, seq_len, overlap, device, data):
+    def __init__(
+        self, batch_size, seq_len, overlap, device, data, generator=None, validation=0.0
+    ):
 
         self.batch_size = batch_size
         self.seq_len = seq_len
         self.overlap = int((1 - overlap) * self.seq_len)
         self.device = device
+        self.generator = generator  # torch.Generator of the shuffling (on device)
 
-        # Reshape
+        # Windows are strided views over the original arrays: no data is copied
         x_est, u_fit, y_fit, u_fit_ind = data
-        self.x_est = np.array(
-            [
-                frame(
-                    x_est[i], frame_length=self.seq_len, hop_length=self.overlap, axis=0
-                )
-                for i in range(len(x_est))
-            ]
-        ).reshape(-1, seq_len, x_est.shape[2])
-        self.u_fit = np.array(
-            [
-                frame(
-                    u_fit[i], frame_length=self.seq_len, hop_length=self.overlap, axis=0
-                )
-                for i in range(len(u_fit))
-            ]
-        ).reshape(-1, seq_len, u_fit.shape[2])
-        self.y_fit = np.array(
-            [
-                frame(
-                    y_fit[i], frame_length=self.seq_len, hop_length=self.overlap, axis=0
-                )
-                for i in range(len(y_fit))
-            ]
-        ).reshape(-1, seq_len, y_fit.shape[2])
-        self.u_fit_ind = np.array(
-            [
-                frame(
-                    u_fit_ind[i],
-                    frame_length=self.seq_len,
-                    hop_length=self.overlap,
-                    axis=0,
-                )
-                for i in range(len(u_fit_ind))
-            ]
-        ).reshape(-1, seq_len, u_fit_ind.shape[2])
+        self.x_est = self.frame(x_est)
+        self.u_fit = self.frame(u_fit)
+        self.y_fit = self.frame(y_fit)
+        self.u_fit_ind = self.frame(u_fit_ind)
+
+        # Windows are numbered subject by subject
+        self.n_frames = self.y_fit.shape[1]
 
         idx_scenarios = self.filter_seq()  # Filter out sequences
 
-        # Define initial states
-        for scenario in idx_scenarios:
-            cgm_target = self.y_fit[scenario, 0, 0].item()
-            self.x_est[scenario, 0, :] = getInitSSFromFile(cgm_target)
+        # Define initial states (kept apart so the shared data is never written)
+        self.x0_est = np.zeros(
+            (self.y_fit.shape[0] * self.n_frames, x_est.shape[2]), dtype=x_est.dtype
+        )
+        self.x0_est[idx_scenarios] = init_states(
+            self.y_fit[(*self.unravel(idx_scenarios), 0, 0)]
+        )
 
-        self.idx_scenarios_temp = idx_scenarios
-        self.idx_scenarios = idx_scenarios
+        # Training data is uploaded to the device once, minibatches are gathered there
+        self.n_steps = x_est.shape[1]
+        self.x_est_data, self.u_fit_data, self.u_fit_ind_data, self.y_fit_data = [
+            torch.as_tensor(
+                np.ascontiguousarray(array.reshape(-1, array.shape[2])),
+                dtype=torch.float32,
+                device=device,
+            )
+            for array in (x_est, u_fit, u_fit_ind, y_fit)
+        ]
+        self.x0_data = torch.as_tensor(self.x0_est, dtype=torch.float32, device=device)
+        self.batch_offsets = torch.arange(self.seq_len, device=device)[:, None]
+
+        # The last windows of each subject are held out for validation
+        idx_scenarios, idx_validation = self.split_validation(idx_scenarios, validation)
+        self.idx_scenarios = torch.as_tensor(idx_scenarios, device=device)
+        self.idx_validation = torch.as_tensor(idx_validation, device=device)
 
         self.num_scenarios = len(self.idx_scenarios)
+        self.num_validation = len(self.idx_validation)
+        self.new_permutation()
 
         self.n_iter_per_epoch = int(
             self.num_scenarios / self.batch_size
@@ -494,117 +885,129 @@ class Batch:
 
         print("Number of iteration per epoch:", self.n_iter_per_epoch)
         print("Number of scenarios:", self.num_scenarios)
+        if self.num_validation > 0:
+            print("Number of validation scenarios:", self.num_validation)
 
     def get_all(self, group):
 
-        idx = self.idx_scenarios
+        if group == "Validation":
+            return self.take(self.idx_validation)
+        return self.take(self.idx_scenarios)
 
-        batch_start = np.zeros(idx.shape[0], dtype=np.int8)
-        batch_idx = batch_start[:, np.newaxis] + np.arange(
-            self.seq_len
-        )  # batch samples indices
-        batch_idx = (
-            batch_idx.T
-        )  # transpose indexes to obtain batches with structure (m, q, n_x)
+    def get_batch(self, count=True):
 
-        # Extract batch data
-        batch_x0_hidden = torch.tensor(
-            self.x_est[idx, batch_start, :], dtype=torch.float32
-        ).to(self.device)
-        batch_u_pop = torch.tensor(self.u_fit[idx, batch_idx], dtype=torch.float32).to(
-            self.device
-        )
-        batch_u_ind = torch.tensor(
-            self.u_fit_ind[idx, batch_idx], dtype=torch.float32
-        ).to(self.device)
-        batch_y = torch.tensor(self.y_fit[idx, batch_idx], dtype=torch.float32).to(
-            self.device
-        )
-        batch_x_original = torch.tensor(
-            self.x_est[idx, batch_idx], dtype=torch.float32
-        ).to(self.device)
+        batch = self.take(self.batch_scenarios_idx)
 
-        return batch_x0_hidden, batch_u_pop, batch_u_ind, batch_y, batch_x_original
+        if count:
+            self.update_batch_idx()
 
-    def get_batch(self, count=True):
+        return batch
 
-        self.batch_scenarios_idx = self.batch_scenarios_idx.astype(int)
-        batch_start = np.zeros(self.batch_scenarios_idx.shape[0], dtype=np.int8)
-        batch_idx = batch_start[:, np.newaxis] + np.arange(
-            self.seq_len
-        )  # batch samples indices
-        batch_idx = (
-            batch_idx.T
-        )  # transpose indexes to obtain batches with structure (m, q, n_x)
+    def new_permutation(self):
+        """Shuffle the scenarios of a new epoch"""
 
-        # Extract batch data
+        self.permutation = self.idx_scenarios[
+            torch.randperm(
+                self.num_scenarios, generator=self.generator, device=self.device
+            )
+        ]
+        self.n_used = 0
 
-        batch_x0_hidden = torch.tensor(
-            self.x_est[self.batch_scenarios_idx, batch_start, :], dtype=torch.float32
-        ).to(self.device)
-        batch_u_pop = torch.tensor(
-            self.u_fit[self.batch_scenarios_idx, batch_idx], dtype=torch.float32
-        ).to(self.device)
-        batch_u_ind = torch.tensor(
-            self.u_fit_ind[self.batch_scenarios_idx, batch_idx], dtype=torch.float32
-        ).to(self.device)
-        batch_y = torch.tensor(
-            self.y_fit[self.batch_scenarios_idx, batch_idx], dtype=torch.float32
-        ).to(self.device)
-        batch_x_original = torch.tensor(
-            self.x_est[self.batch_scenarios_idx, batch_idx], dtype=torch.float32
-        ).to(self.device)
+    def update_batch_idx(self):
+        n_remaining = self.num_scenarios - self.n_used
 
-        if count:
-            self.update_batch_idx()
+        if n_remaining < self.batch_size:
+            # The last batch of an epoch is completed with the next epoch
+            batch_scenarios_idx1 = self.permutation[self.n_used :]
+            self.new_permutation()
+
+            self.n_used = self.batch_size - n_remaining
+            self.batch_scenarios_idx = torch.cat(
+                [batch_scenarios_idx1, self.permutation[: self.n_used]]
+            )
+
+            self.epoch += 1
+
+        else:
+            self.batch_scenarios_idx = self.permutation[
+                self.n_used : self.n_used + self.batch_size
+            ]
+            self.n_used += self.batch_size
+
+    def frame(self, data):
+        """Strided view (n_subjects, n_frames, seq_len, n_feats) of (n_subjects, T, n_feats)"""
+
+        windows = sliding_window_view(data, self.seq_len, axis=1)[:, :: self.overlap]
+        return windows.transpose(0, 1, 3, 2)
+
+    def unravel(self, idx):
+        """(subject, frame) of flat window indexes"""
+
+        return idx // self.n_frames, idx % self.n_frames
+
+    def take(self, idx):
+        """Gather the windows idx on the device with structure (m, q, n_x)"""
+
+        subject, start = self.unravel(idx)
+        start = subject * self.n_steps + start * self.overlap
+        rows = (start + self.batch_offsets).reshape(-1)
+        shape = (self.seq_len, len(idx), -1)
+
+        batch_x0_hidden = self.x0_data.index_select(0, idx)
+        batch_u_pop = self.u_fit_data.index_select(0, rows).view(shape)
+        batch_u_ind = self.u_fit_ind_data.index_select(0, rows).view(shape)
+        batch_y = self.y_fit_data.index_select(0, rows).view(shape)
+        batch_x_original = self.x_est_data.index_select(0, rows).view(shape)
+        batch_x_original[0] = batch_x0_hidden
 
         return batch_x0_hidden, batch_u_pop, batch_u_ind, batch_y, batch_x_original
 
-    def update_batch_idx(self):
-        if True:
-            if len(self.idx_scenarios_temp) < self.batch_size:
-                batch_scenarios_idx1 = self.idx_scenarios_temp
-                self.idx_scenarios_temp = self.idx_scenarios
-
-                batch_scenarios_idx2 = np.random.choice(
-                    self.idx_scenarios_temp,
-                    self.batch_size - len(batch_scenarios_idx1),
-                    replace=False,
-                )
-                self.batch_scenarios_idx = np.concatenate(
-                    [batch_scenarios_idx1, batch_scenarios_idx2]
-                )
-                self.idx_scenarios_temp = np.array(
-                    list(set(self.idx_scenarios_temp).difference(batch_scenarios_idx2))
-                )
+    def split_validation(self, idx_scenarios, validation):
+        """Training and validation windows
 
-                self.epoch += 1
+        The last `validation` fraction of the windows of each subject is used
+        for validation. Training windows overlapping them are discarded.
+        """
 
-            else:
-                self.batch_scenarios_idx = np.random.choice(
-                    self.idx_scenarios_temp, self.batch_size, replace=False
-                )
-                self.idx_scenarios_temp = np.array(
-                    list(
-                        set(self.idx_scenarios_temp).difference(
-                            self.batch_scenarios_idx
-                        )
-                    )
-                )
+        if validation <= 0:
+            return idx_scenarios, idx_scenarios[:0]
 
-    def filter_seq(self):
+        subject, start = self.unravel(idx_scenarios)
+        start_validation = int(np.floor((1 - validation) * self.n_frames))
+        n_frames_overlap = int(np.ceil(self.seq_len / self.overlap))
 
-        dfScenario = pd.DataFrame(
-            columns=["isCompleteCGM", "isValid"], index=np.arange(self.x_est.shape[0])
-        )
-        for scenario in range(self.x_est.shape[0]):
-            dfScenario.loc[scenario, "isCompleteCGM"] = np.isnan(
-                self.y_fit[scenario, :, 0]
-            ).any()
+        is_validation = start >= start_validation
+        is_train = start <= start_validation - n_frames_overlap
 
-        dfScenario["isValid"] = np.logical_not(dfScenario["isCompleteCGM"])
+        return idx_scenarios[is_train], idx_scenarios[is_validation]
 
-        return dfScenario[dfScenario.isValid].index.astype(int)
+    def state_dict(self):
+        """Position of the sampler, to resume an epoch where it stopped"""
+
+        return {
+            "permutation": self.permutation,
+            "n_used": self.n_used,
+            "batch_scenarios_idx": self.batch_scenarios_idx,
+            "epoch": self.epoch,
+            "generator": (
+                None if self.generator is None else self.generator.get_state()
+            ),
+        }
+
+    def load_state_dict(self, state_dict):
+        self.permutation = state_dict["permutation"].to(self.device)
+        self.n_used = state_dict["n_used"]
+        self.batch_scenarios_idx = state_dict["batch_scenarios_idx"].to(self.device)
+        self.epoch = state_dict["epoch"]
+        if self.generator is not None and state_dict["generator"] is not None:
+            self.generator.set_state(state_dict["generator"].cpu())
+
+    def filter_seq(self):
+
+        # Windows with a missing CGM value are discarded
+        is_valid = ~np.isnan(self.y_fit[..., 0]).any(axis=-1)
+
+        return np.flatnonzero(is_valid.reshape(-1))
 
 
 class SequenceSelection:
@@ -615,9 +1018,7 @@ class SequenceSelection:
 
         idx_scenarios = self.get_sequences(data)  # Filter out sequences
 
-        for scenario in idx_scenarios:
-            cgm_target = self.y_fit[scenario, 0, 0].item()
-            self.x_est[scenario, 0, :] = getInitSSFromFile(cgm_target)
+        self.x_est[idx_scenarios, 0, :] = init_states(self.y_fit[idx_scenarios, 0, 0])
 
         # Define initial states
         self.idx_scenarios = idx_scenarios
@@ -690,36 +1091,95 @@ class SequenceSelection:
 
 
 class DigitalTwin:
-    def __init__(self, n_digitalTwin=0, custom_DT = None,device=torch.device("cpu"), ts=5):
+    def __init__(
+        self,
+        n_digitalTwin=0,
+        custom_DT=None,
+        device=torch.device("cpu"),
+        ts=5,
+        fused=True,
+        ss_pop_model=None,
+        precision="float32",
+        quantized=False,
+        backend="torch",
+        onnx_model=None,
+        checkpoint_every=0,
+        result_cache=None,
+    ):
         self.ts = ts
         self.device = device
+        self.fused = fused
+        self.precision = precision
+
+        # onnxruntime runs the rollouts of an ONNX export (path or bytes) of
+        # this twin, exported on the fly if onnx_model is None. CPU only. The
+        # twin still loads the torch models: to serve an export without torch
+        # use onnx_backend.OnnxDigitalTwin
+        if backend not in backends:
+            raise ValueError("backend must be one of {}".format(backends))
+        self.backend = backend
+        self.onnx_model = onnx_model
+
+        # simulate resumes from the states cached every checkpoint_every
+        # steps in prefix_state_cache (0: disabled). torch backend only
+        if checkpoint_every and backend != "torch":
+            raise ValueError("Prefix checkpoints need the torch backend")
+        self.checkpoint_every = checkpoint_every
+
+        # SimulationResultCache serving repeated simulate calls (None: off)
+        self.result_cache = result_cache
+
+        # True quantizes the individual model only, otherwise a subset of
+        # quantizable_models. The int8 population model is much less accurate:
+        # ~10 mg/dL CGM RMSE vs float32 with errors above 50 mg/dL, against
+        # ~1 mg/dL RMSE for the individual model (validateQuantization.py)
+        if quantized is True:
+            quantized = ("individual",)
+        self.quantized = tuple(quantized) if quantized else ()
+        if set(self.quantized) - set(quantizable_models):
+            raise ValueError(
+                "quantized must be a bool or a subset of {}".format(quantizable_models)
+            )
+        if self.quantized and (
+            precision != "float32" or torch.device(device).type != "cpu"
+        ):
+            raise ValueError("Quantized models run in float32 on CPU only")
+        if backend != "torch" and (self.quantized or precision != "float32"):
+            raise ValueError("The onnxruntime backend runs float32 models only")
+
+        self.popModelFolder = str(Path(__file__).parent) + "/models/PopulationModel/"
 
         if custom_DT is None:
             self.n_digitalTwin = n_digitalTwin
-
-            digitalTwin_list = [
-                f.path
-                for f in os.scandir(Path(__file__).parent / "models/IndividualModel/")
-                if f.is_dir()
-            ]
-            digitalTwin_list.sort()
-            self.digital_twin_folder = digitalTwin_list[self.n_digitalTwin]
+            self.digital_twin_folder = list_digital_twins()[self.n_digitalTwin]
         else:
             self.n_digitalTwin = 99
-            self.digital_twin_folder  = custom_DT
+            self.digital_twin_folder = custom_DT
+
+        self.setup_simulator(ss_pop_model)
+
+    def model_files(self):
+        """Files of the population and individual models of the twin"""
+
+        folder_pop = self.popModelFolder
+        paths = [
+            os.path.join(folder_pop, name) for name in sorted(os.listdir(folder_pop))
+        ] + [
+            os.path.join(self.digital_twin_folder, "individual_model.pt"),
+            os.path.join(self.digital_twin_folder, "scaler_robust.pkl"),
+        ]
+
+        return [path for path in paths if os.path.isfile(path)]
 
-        self.setup_simulator()
+    def setup_simulator(self, ss_pop_model=None):
+        # Digests of the models loaded below: the cache keys of their results
+        self.model_digests = tuple(file_digest(path) for path in self.model_files())
 
-    def setup_simulator(self):
         # Population Model
-        ss_pop_model = CGMOHSUSimStateSpaceModel_V2(n_feat=n_neurons_pop)
-        ss_pop_model.to(self.device)
-        ss_pop_model.load_state_dict(
-            torch.load(
-                Path(__file__).parent
-                / "models/PopulationModel/population_model_05022024_epoch_15.pt"
+        if ss_pop_model is None:
+            ss_pop_model = load_population_model(
+                self.device, self.fused, "population" in self.quantized
             )
-        )
 
         # Individual Model
         ss_individual_model = CGMIndividual(hidden_compartments=hidden_compartments)
@@ -728,109 +1188,318 @@ class DigitalTwin:
             torch.load(self.digital_twin_folder + "/individual_model.pt")
         )
 
-        for name, param in ss_pop_model.named_parameters():
-            param.requires_grad = False
         for name, param in ss_individual_model.named_parameters():
             param.requires_grad = False
 
+        if "individual" in self.quantized:
+            ss_individual_model = quantize_model(
+                ss_individual_model,
+                file_digest(self.digital_twin_folder + "/individual_model.pt"),
+            )
+
         # Simulator
         self.nn_solution = ForwardEulerSimulator(
             ss_pop_model,
             ss_individual_model,
-            str(Path(__file__).parent) + "/models/PopulationModel/",
+            self.popModelFolder,
             ts=self.ts,
+            precision=self.precision,
         )
 
         self.scaler_featsRobust = load(
             open(self.digital_twin_folder + "/scaler_robust.pkl", "rb")
         )
 
-    def prepare_data(self, df_scenario):
-        dfInitStates = pd.read_csv(
-            Path(__file__).parent / "models/initSteadyStates.csv"
-        ).set_index("initCGM")
+        if self.backend == "onnxruntime":
+            # Optional dependencies: onnx to export, onnxruntime to run
+            from t1dsim_ai.onnx_backend import OnnxSimulator
 
-        df_scenario[states] = df_scenario[states].astype(float)
+            if self.onnx_model is None:
+                from t1dsim_ai.onnx_export import export_onnx
 
-        df_scenario.loc[0, states] = dfInitStates.loc[
-            df_scenario.loc[0, states[0]].astype("int64"), states
-        ]
+                self.onnx_model = export_onnx(self)
+            self.onnx_solution = OnnxSimulator(self.onnx_model)
+
+    def preprocess_scenario(self, df_scenario_original):
+        df_scenario = df_scenario_original.copy()
+        df_scenario = df_scenario.reset_index()
+        try:
+            df_scenario[states]
+        except KeyError:
+            df_scenario[states[1:]] = 0
+
+        df_scenario["cgm_Actual"] = df_scenario["output_cgm"]
 
-        sim_time = len(df_scenario)
-        batch_start = np.array([0], dtype=np.int64)
-        batch_idx = batch_start[:, np.newaxis] + np.arange(sim_time)
+        return df_scenario
 
-        x_est = np.array(df_scenario[states].values).astype(np.float32)
-        u_pop = np.array(df_scenario[inputs].values).astype(np.float32)
-        u_ind = np.array(df_scenario[input_ind].values).astype(np.float32)
+    def scale_data(self, df_scenario):
+        # Initial states from the steady state of the initial CGM
+        x0_est = init_states(df_scenario[states[0]].iloc[0])[0]
 
-        # Scale states and inputs from the population models
-        x_est, u_pop = scaler_pop(
-            x_est, u_pop, str(Path(__file__).parent) + "/models/PopulationModel/", False
+        u_pop, u_ind = self.scale_inputs(
+            df_scenario[inputs].values, df_scenario[input_ind].values
         )
 
+        return x0_est, u_pop, u_ind
+
+    def scale_inputs(self, u_pop, u_ind):
+        """Scale raw inputs. Size: (n_steps, n_u) and (n_steps, n_u_ind)"""
+
+        u_pop = np.array(u_pop).astype(np.float32)
+        u_ind = np.array(u_ind).astype(np.float32)
+
+        # Scale inputs from the population models
+        u_pop = scaler_store.inputs(self.popModelFolder).transform(u_pop)
+
         # Scale new inputs
         u_ind[:, idx_robust] = self.scaler_featsRobust.transform(u_ind[:, idx_robust])
 
-        u_pop = u_pop.reshape(-1, sim_time, len(inputs))[0, batch_idx, :]
-        u_ind = u_ind.reshape(-1, sim_time, len(input_ind))[0, batch_idx, :]
+        return u_pop, u_ind
 
-        x0_est = torch.tensor(
-            df_scenario.loc[0, states].astype(float).values.reshape(1, -1),
-            dtype=torch.float32,
-        ).to(self.device)
+    def prepare_data(self, df_scenario):
+        x0_est, u_pop, u_ind = self.scale_data(df_scenario)
 
-        u_pop = torch.tensor(u_pop[[0], batch_idx.T], dtype=torch.float32).to(
-            self.device
-        )
-        u_ind = torch.tensor(u_ind[[0], batch_idx.T], dtype=torch.float32).to(
-            self.device
-        )
+        # Batch of one scenario with structure (m, q, n_x)
+        x0_est = torch.tensor(x0_est[np.newaxis], dtype=torch.float32).to(self.device)
+        u_pop = torch.tensor(u_pop[:, np.newaxis], dtype=torch.float32).to(self.device)
+        u_ind = torch.tensor(u_ind[:, np.newaxis], dtype=torch.float32).to(self.device)
 
-        return x0_est, u_pop[:, [0], :], u_ind[:, [0], :]
+        return x0_est, u_pop, u_ind
 
-    def simulate(self, df_scenario_original):
-        # Prepare data
+    def rollout_joint(self, x0_est, u_pop, u_ind):
+        """forward_joint on the backend; float32 arrays with structure (m, q, n_x)"""
 
-        df_scenario = df_scenario_original.copy()
-        df_scenario = df_scenario.reset_index()
-        try:
-            df_scenario[states]
-        except KeyError:
-            df_scenario[states[1:]] = 0
+        if self.backend == "onnxruntime":
+            return self.onnx_solution.forward_joint(x0_est, u_pop, u_ind)
 
-        df_scenario["cgm_Actual"] = df_scenario["output_cgm"]
+        x0_est = torch.as_tensor(x0_est, dtype=torch.float32).to(self.device)
+        u_pop = torch.as_tensor(u_pop, dtype=torch.float32).to(self.device)
+        u_ind = torch.as_tensor(u_ind, dtype=torch.float32).to(self.device)
+
+        with torch.no_grad():
+            x_sim_pop, x_sim_DT = self.nn_solution.forward_joint(x0_est, u_pop, u_ind)
+
+        return x_sim_pop.to("cpu").numpy(), x_sim_DT.to("cpu").numpy()
+
+    def rollout_checkpoints(self, x0_est, u_pop, u_ind):
+        """rollout_joint of one scenario resumed from the prefix checkpoints
+
+        The blocks of states of the longest input prefix already simulated
+        come from prefix_state_cache, only the remaining steps are simulated
+        and their full blocks are added to the cache.
+        """
+
+        config = (
+            self.digital_twin_folder,
+            self.model_digests,
+            self.ts,
+            self.fused,
+            self.precision,
+            self.quantized,
+            self.checkpoint_every,
+        )
+        keys = prefix_state_cache.prefix_keys(
+            config, x0_est, np.concatenate((u_pop, u_ind), 1), self.checkpoint_every
+        )
+        blocks = prefix_state_cache.get(keys)
 
-        x0_est, u_pop, u_ind = self.prepare_data(df_scenario)
+        # Rollout from the last cached state, stacked as in forward_joint
+        start = len(blocks) * self.checkpoint_every
+        x_start = blocks[-1][-1] if blocks else np.stack((x0_est, x0_est), 0)
+        u_pop = np.concatenate((u_pop[start:, np.newaxis],) * 2, 1)
+        u_ind = u_ind[start:, np.newaxis]
 
         with torch.no_grad():
-            x_sim_pop = self.nn_solution(x0_est, u_pop, None, is_pers=False)
-            df_scenario[states] = scaler_inverse(
-                x_sim_pop[:, 0, :].to("cpu").detach().numpy(),
-                str(Path(__file__).parent) + "/models/PopulationModel/",
+            X_sim = self.nn_solution.rollout(
+                torch.as_tensor(x_start, dtype=torch.float32).to(self.device),
+                torch.as_tensor(u_pop, dtype=torch.float32).to(self.device),
+                torch.as_tensor(u_ind, dtype=torch.float32).to(self.device),
+                n_pop=1,
             )
+        X_sim = X_sim.to("cpu").numpy()
 
-            x_sim_DT = self.nn_solution(x0_est, u_pop, u_ind, is_pers=True)
+        new_blocks = [
+            X_sim[i + 1 : i + self.checkpoint_every + 1].copy()
+            for i in range(0, len(X_sim) - 1, self.checkpoint_every)
+        ]
+        prefix_state_cache.put(keys[len(blocks) :], new_blocks)
+
+        # Initial state, cached blocks and new steps
+        X_sim = np.concatenate(
+            [np.stack((x0_est, x0_est), 0)[np.newaxis]] + blocks + [X_sim[1:]], 0
+        )
+
+        return X_sim[:, :1], X_sim[:, 1:]
+
+    def simulate_states(self, df_scenario):
+        """Population and personalized states in mg/dL. Size: (n_steps, n_x)"""
+
+        x0_est, u_pop, u_ind = self.scale_data(df_scenario)
 
-            df_scenario[[s + "_DT" for s in states]] = scaler_inverse(
-                x_sim_DT[:, 0, :].to("cpu").detach().numpy(),
-                str(Path(__file__).parent) + "/models/PopulationModel/",
+        # Batch of one scenario with structure (m, q, n_x)
+        if self.checkpoint_every:
+            x_sim_pop, x_sim_DT = self.rollout_checkpoints(x0_est, u_pop, u_ind)
+        else:
+            x_sim_pop, x_sim_DT = self.rollout_joint(
+                x0_est[np.newaxis], u_pop[:, np.newaxis], u_ind[:, np.newaxis]
             )
 
+        return (
+            scaler_inverse(x_sim_pop[:, 0, :], self.popModelFolder),
+            scaler_inverse(x_sim_DT[:, 0, :], self.popModelFolder),
+        )
+
+    def simulate(self, df_scenario_original):
+        # Prepare data
+        df_scenario = self.preprocess_scenario(df_scenario_original)
+
+        cached = None
+        if self.result_cache is not None:
+            key = self.result_cache.key(self, df_scenario)
+            cached = self.result_cache.get(key)
+
+        if cached is None:
+            x_sim_pop, x_sim_DT = self.simulate_states(df_scenario)
+            if self.result_cache is not None:
+                self.result_cache.put(key, x_sim_pop, x_sim_DT)
+        else:
+            x_sim_pop, x_sim_DT = cached
+
+        df_scenario[states] = x_sim_pop
+        df_scenario[[s + "_DT" for s in states]] = x_sim_DT
+
         df_scenario["cgm_NNPop"] = df_scenario["output_cgm"]
         df_scenario["cgm_NNDT"] = df_scenario["output_cgm_DT"]
 
         return df_scenario
 
+    def simulate_batch(self, list_scenarios, as_frame=True):
+        """Simulate several scenarios in one batched rollout
 
-def getInitSSFromFile(cgm_target):
+        Parameters
+        ----------
+        list_scenarios: list of pd.DataFrame
+            Scenarios in the format of `simulate`. Shorter scenarios are
+            zero-padded to the longest one; padded steps are discarded.
+        as_frame: bool
+            If True, return one DataFrame per scenario as `simulate` does.
+            Otherwise return a dict of arrays with structure (N, T, ...),
+            NaN on padded steps: "length", "states", "states_DT",
+            "cgm_NNPop" and "cgm_NNDT".
+
+        """
+
+        data = [self.scale_data(df_scenario) for df_scenario in list_scenarios]
+
+        sim_time = np.array([len(df_scenario) for df_scenario in list_scenarios])
+        n_scenarios, max_time = len(list_scenarios), sim_time.max()
+
+        # Stack scenarios with structure (m, q, n_x)
+        x0_est = np.stack([x0 for x0, _, _ in data])
+        u_pop = np.zeros((max_time, n_scenarios, len(inputs)), dtype=np.float32)
+        u_ind = np.zeros((max_time, n_scenarios, len(input_ind)), dtype=np.float32)
+        for n, (_, u_pop_n, u_ind_n) in enumerate(data):
+            u_pop[: sim_time[n], n] = u_pop_n
+            u_ind[: sim_time[n], n] = u_ind_n
+
+        x_sim_pop, x_sim_DT = self.rollout_joint(x0_est, u_pop, u_ind)
+
+        # (N, T, n_x) in mg/dL
+        x_sim_pop = scaler_inverse(x_sim_pop.transpose(1, 0, 2), self.popModelFolder)
+        x_sim_DT = scaler_inverse(x_sim_DT.transpose(1, 0, 2), self.popModelFolder)
+
+        if not as_frame:
+            is_padded = np.arange(max_time) >= sim_time[:, np.newaxis]
+            x_sim_pop[is_padded] = np.nan
+            x_sim_DT[is_padded] = np.nan
+
+            return {
+                "length": sim_time,
+                "states": x_sim_pop,
+                "states_DT": x_sim_DT,
+                "cgm_NNPop": x_sim_pop[..., 0],
+                "cgm_NNDT": x_sim_DT[..., 0],
+            }
+
+        list_df = [self.preprocess_scenario(df) for df in list_scenarios]
+        for n, df_scenario in enumerate(list_df):
+            df_scenario[states] = x_sim_pop[n, : sim_time[n]]
+            df_scenario[[s + "_DT" for s in states]] = x_sim_DT[n, : sim_time[n]]
+
+            df_scenario["cgm_NNPop"] = df_scenario["output_cgm"]
+            df_scenario["cgm_NNDT"] = df_scenario["output_cgm_DT"]
+
+        return list_df
+
+
+def list_digital_twins():
+    digitalTwin_list = [
+        f.path
+        for f in os.scandir(Path(__file__).parent / "models/IndividualModel/")
+        if f.is_dir()
+    ]
+    digitalTwin_list.sort()
 
-    if cgm_target < 40:
-        cgm_target = 40
-    if cgm_target > 400:
-        cgm_target = 400
-    dfInitStates = pd.read_csv(
-        Path(__file__).parent / "models/initSteadyStates.csv"
-    ).set_index("initCGM")
+    return digitalTwin_list
+
+
+# Trajectory blocks shared by the DigitalTwin instances (checkpoint_every)
+prefix_state_cache = PrefixStateCache()
+
+# Rollout backends of DigitalTwin
+backends = ("torch", "onnxruntime")
+
+# Models of DigitalTwin(quantized=...)
+quantizable_models = ("population", "individual")
+
+# int8 copies of the frozen models, cached by digest of the model file
+quantized_models = {}
+
+
+def quantize_model(model, key):
+    """int8 dynamic quantization of the nn.Linear layers of a frozen model
+
+    The quantized copy is cached by `key` (the digest of the model file, so a
+    retrained model is quantized again) and shared by all the DigitalTwin
+    instances. CPU only.
+    """
+
+    if key not in quantized_models:
+        quantized_models[key] = quantize_dynamic(
+            copy.deepcopy(model).eval(), {nn.Linear}, dtype=torch.qint8
+        )
+
+    return quantized_models[key]
+
+
+def load_population_model(device=torch.device("cpu"), fused=True, quantized=False):
+    path_model = (
+        Path(__file__).parent
+        / "models/PopulationModel/population_model_05022024_epoch_15.pt"
+    )
+    key = file_digest(str(path_model))
+    if quantized and key in quantized_models:
+        return quantized_models[key]
+
+    ss_pop_model = CGMOHSUSimStateSpaceModel_V2(n_feat=n_neurons_pop)
+    ss_pop_model.to(device)
+    ss_pop_model.load_state_dict(torch.load(path_model, map_location=device))
+
+    for name, param in ss_pop_model.named_parameters():
+        param.requires_grad = False
+
+    if quantized:
+        # Quantized from the fused packing: two int8 matmuls per step
+        ss_pop_model = QuantizedCGMOHSUSimStateSpaceModel.from_model(
+            FusedCGMOHSUSimStateSpaceModel.from_model(ss_pop_model)
+        )
+        quantized_models[key] = ss_pop_model
+    elif fused:
+        ss_pop_model = FusedCGMOHSUSimStateSpaceModel.from_model(ss_pop_model)
+
+    return ss_pop_model
+
+
+def getInitSSFromFile(cgm_target):
 
-    return dfInitStates.loc[int(cgm_target), states]
+    return pd.Series(init_states(cgm_target)[0], index=states)
@@ -0,0 +1,135 @@
+import hashlib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+def scenario_key(*parts):
+    """Stable hash of scenario parts (DataFrames, arrays, numbers, strings)"""
+
+    h = hashlib.sha256()
+    for part in parts:
+        if hasattr(part, "columns"):
+            h.update(repr(list(part.columns)).encode())
+            part = part.values
+        if isinstance(part, np.ndarray):
+            h.update(repr(part.shape).encode())
+            part = np.ascontiguousarray(part, dtype=np.float64).tobytes()
+        if not isinstance(part, bytes):
+            part = repr(part).encode()
+        h.update(part)
+
+    return h.hexdigest()
+
+
+class SimulationJob:
+
+    """A submitted simulation: its key, its future and its timestamps"""
+
+    def __init__(self, job_id, key, future):
+        self.job_id = job_id
+        self.key = key
+        self.future = future
+        self.created = time.monotonic()
+        self.finished = None
+
+    @property
+    def status(self):
+        if not self.future.done():
+            return "running" if self.future.running() else "pending"
+        return "error" if self.future.exception() is not None else "done"
+
+    def to_dict(self):
+        job = {"job_id": self.job_id, "status": self.status}
+        if self.status == "error":
+            job["error"] = str(self.future.exception())
+        return job
+
+
+class SimulationJobQueue:
+
+    """Background simulation jobs with single-flight deduplication
+
+    Jobs run on a bounded thread pool, so a burst of requests queues instead
+    of running every simulation at once on the request threads. A job
+    submitted with the key of a job still in flight returns that job, so
+    identical concurrent requests run one simulation. Finished jobs are
+    kept `ttl` seconds for polling. All methods are thread-safe.
+
+    Attributes
+    ----------
+    n_workers: int
+        Maximum number of simulations running at the same time
+    ttl: float
+        Seconds a finished job is kept
+
+    """
+
+    def __init__(self, n_workers=2, ttl=600):
+        self.n_workers = n_workers
+        self.ttl = ttl
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=n_workers, thread_name_prefix="simulation"
+        )
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._in_flight = {}
+
+    def submit(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) in the pool unless `key` is in flight"""
+
+        with self._lock:
+            self._purge()
+
+            job_id = self._in_flight.get(key)
+            if job_id is not None:
+                return self._jobs[job_id]
+
+            job = SimulationJob(uuid.uuid4().hex, key, None)
+            job.future = self._executor.submit(fn, *args, **kwargs)
+            self._jobs[job.job_id] = job
+            self._in_flight[key] = job.job_id
+
+        job.future.add_done_callback(lambda _: self._finish(job))
+        return job
+
+    def _finish(self, job):
+        with self._lock:
+            job.finished = time.monotonic()
+            if self._in_flight.get(job.key) == job.job_id:
+                del self._in_flight[job.key]
+
+    def _purge(self):
+        now = time.monotonic()
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.finished is not None and now - job.finished > self.ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job, timeout=None):
+        """Result of a job, waiting at most `timeout` seconds
+
+        Raises concurrent.futures.TimeoutError if it is still running and
+        the exception of the job if it failed.
+        """
+
+        return job.future.result(timeout=timeout)
+
+    def run(self, key, fn, *args, timeout=None, **kwargs):
+        """Submit and wait: synchronous call sharing the pool and single-flight"""
+
+        return self.wait(self.submit(key, fn, *args, **kwargs), timeout)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,139 @@
+import os
+
+import numpy as np
+import onnxruntime as ort
+
+
+class OnnxSimulator:
+
+    """forward_joint of ForwardEulerSimulator on onnxruntime
+
+    Runs the rollout exported by t1dsim_ai.onnx_export.export_rollout on the
+    CPU provider, on initial states and inputs already scaled. See
+    OnnxDigitalTwin to simulate raw scenarios.
+
+    Attributes
+    ----------
+    session: onnxruntime.InferenceSession
+        Session of the rollout model
+
+    """
+
+    def __init__(self, model, n_threads=None):
+        """`model` is the path or the serialized bytes of the ONNX rollout"""
+
+        sess_options = ort.SessionOptions()
+        if n_threads is not None:
+            sess_options.intra_op_num_threads = n_threads
+
+        self.session = ort.InferenceSession(
+            model, sess_options, providers=["CPUExecutionProvider"]
+        )
+
+    def forward_joint(self, x0_batch, u_batch, u_batch_ind):
+        """Population and personalized simulation
+
+        Parameters
+        ----------
+        x0_batch: np.ndarray. Size: (q, n_x)
+        u_batch: np.ndarray. Size: (m, q, n_u)
+        u_batch_ind: np.ndarray. Size: (m, q, n_u_ind)
+
+        Returns
+        -------
+        (np.ndarray, np.ndarray). Size: (m, q, n_x)
+            Population and personalized simulated states
+
+        """
+
+        # The Loop of the rollout has m - 1 iterations; onnxruntime cannot run
+        # it zero times, and the only step is x0
+        if len(u_batch) == 1:
+            x0 = np.asarray(x0_batch, dtype=np.float32)[np.newaxis]
+            return x0, x0.copy()
+
+        X_pop, X_DT = self.session.run(
+            None,
+            {
+                "x0": np.ascontiguousarray(x0_batch, dtype=np.float32),
+                "u_pop_seq": np.ascontiguousarray(u_batch, dtype=np.float32),
+                "u_ind_seq": np.ascontiguousarray(u_batch_ind, dtype=np.float32),
+            },
+        )
+
+        return X_pop, X_DT
+
+
+def constants_path(path):
+    """Path of the preprocessing constants exported next to an ONNX model"""
+
+    return os.path.splitext(path)[0] + ".npz"
+
+
+class OnnxDigitalTwin:
+
+    """DigitalTwin.simulate on an ONNX export, without torch
+
+    Loads a rollout exported by t1dsim_ai.onnx_export.export_onnx and the
+    preprocessing constants saved next to it (scalers, steady-state table
+    and column names). It only depends on NumPy, pandas and onnxruntime, so
+    a serving process can run exported twins without torch or scikit-learn.
+
+    Attributes
+    ----------
+    onnx_solution: OnnxSimulator
+        Rollout of the scaled states
+    constants: dict
+        Arrays of onnx_export.export_constants
+
+    """
+
+    def __init__(self, path, n_threads=None):
+        self.onnx_solution = OnnxSimulator(path, n_threads)
+
+        with np.load(constants_path(path)) as data:
+            self.constants = {key: data[key] for key in data.files}
+
+        self.states = list(self.constants["states"])
+        self.inputs = list(self.constants["inputs"])
+        self.input_ind = list(self.constants["input_ind"])
+
+    def scale(self, array, name):
+        center = self.constants["center_" + name].astype(array.dtype)
+        scale = self.constants["scale_" + name].astype(array.dtype)
+        return (array - center) / scale
+
+    def init_states(self, init_cgm):
+        """Steady states of the initial CGM [mg/dL], truncated as init_states"""
+
+        table = self.constants["init_states"]
+        pos = np.clip(np.asarray(init_cgm) - self.constants["init_cgm_min"], 0, None)
+        return table[np.minimum(pos, len(table) - 1).astype(np.int64)]
+
+    def simulate(self, df_scenario_original):
+        """Same DataFrame as DigitalTwin.simulate"""
+
+        df_scenario = df_scenario_original.copy().reset_index()
+        for state in self.states:
+            if state not in df_scenario.columns:
+                df_scenario[state] = 0
+        df_scenario["cgm_Actual"] = df_scenario["output_cgm"]
+
+        x0 = self.init_states(df_scenario[self.states[0]].values[:1])
+        u_pop = self.scale(df_scenario[self.inputs].values.astype(np.float32), "inputs")
+        u_ind = df_scenario[self.input_ind].values.astype(np.float64)
+        u_ind = self.scale(u_ind, "ind").astype(np.float32)
+
+        x_sim_pop, x_sim_DT = self.onnx_solution.forward_joint(
+            x0, u_pop[:, np.newaxis], u_ind[:, np.newaxis]
+        )
+
+        center = self.constants["center_states"].astype(np.float32)
+        scale = self.constants["scale_states"].astype(np.float32)
+        df_scenario[self.states] = x_sim_pop[:, 0] * scale + center
+        df_scenario[[s + "_DT" for s in self.states]] = x_sim_DT[:, 0] * scale + center
+
+        df_scenario["cgm_NNPop"] = df_scenario["output_cgm"]
+        df_scenario["cgm_NNDT"] = df_scenario["output_cgm_DT"]
+
+        return df_scenario
@@ -0,0 +1,300 @@
+from t1dsim_ai.individual_model import DigitalTwin, list_digital_twins
+from t1dsim_ai.population_model import (
+    CGMOHSUSimStateSpaceModel_V2,
+    FusedCGMOHSUSimStateSpaceModel,
+)
+from t1dsim_ai.onnx_backend import constants_path
+from t1dsim_ai.options import states, inputs, input_ind, idx_robust
+from t1dsim_ai.steady_states import get_init_states_table
+from t1dsim_ai.utils.preprocess import scaler_store
+
+import argparse
+import inspect
+import io
+import os
+
+import numpy as np
+import onnx
+from onnx import TensorProto, helper
+import torch
+import torch.nn as nn
+
+opset_version = 17
+
+
+class EulerStepModule(nn.Module):
+
+    """One step of ForwardEulerSimulator.forward_joint for ONNX export
+
+    Population and personalized states advance together: the population
+    model runs once on both of them, the individual model only on the
+    personalized states, then the Euler update and the CGM clamp. Inputs
+    and states are in the scaled space of the simulator.
+
+    Attributes
+    ----------
+    ss_pop_model: nn.Module
+        Frozen population model (fused)
+    ss_ind_model: nn.Module
+        Frozen individual model
+    ts: float
+        Models sampling time
+
+    """
+
+    def __init__(self, nn_solution):
+        super(EulerStepModule, self).__init__()
+
+        ss_pop_model = nn_solution.ss_pop_model
+        if isinstance(ss_pop_model, CGMOHSUSimStateSpaceModel_V2):
+            ss_pop_model = FusedCGMOHSUSimStateSpaceModel.from_model(ss_pop_model)
+        if not isinstance(ss_pop_model, FusedCGMOHSUSimStateSpaceModel):
+            raise ValueError("Only float32 population models can be exported")
+
+        self.ss_pop_model = ss_pop_model
+        self.ss_ind_model = nn_solution.ss_ind_model
+        self.ts = float(nn_solution.ts)
+        self.cgm_min = float(nn_solution.cgm_min)
+        self.cgm_max = float(nn_solution.cgm_max)
+
+        self.eval()
+
+    def update(self, x_step, dx):
+        x_step = x_step + self.ts * dx
+        cgm = x_step[:, :1].clamp(self.cgm_min, self.cgm_max)
+        return torch.cat((cgm, x_step[:, 1:]), 1)
+
+    def forward(self, x_pop, x_DT, u_pop, u_ind):
+        q = x_pop.shape[0]
+
+        dx = self.ss_pop_model(
+            torch.cat((x_pop, x_DT), 0), torch.cat((u_pop, u_pop), 0)
+        )
+        dx_ind = self.ss_ind_model(x_DT, u_pop, u_ind)
+
+        dx_pop = dx[:q]
+        dx_DT = torch.cat((dx[q:, :1] + dx_ind, dx[q:, 1:]), 1)
+
+        return self.update(x_pop, dx_pop), self.update(x_DT, dx_DT)
+
+
+def export_step(digital_twin):
+    """ONNX model of one Euler step
+
+    Inputs x_pop, x_DT (q, n_x), u_pop (q, n_u) and u_ind (q, n_u_ind).
+    Outputs x_pop_next and x_DT_next (q, n_x).
+    """
+
+    step_module = EulerStepModule(digital_twin.nn_solution)
+    n_x = 10
+    n_u = step_module.ss_pop_model.weight_1.shape[1] - n_x - 1
+    n_u_ind = step_module.ss_ind_model.net_model[0].in_features - 5
+
+    input_names = ["x_pop", "x_DT", "u_pop", "u_ind"]
+    output_names = ["x_pop_next", "x_DT_next"]
+    example_inputs = (
+        torch.zeros(2, n_x),
+        torch.zeros(2, n_x),
+        torch.zeros(2, n_u),
+        torch.zeros(2, n_u_ind),
+    )
+
+    # The TorchScript exporter: default up to torch 2.4, opt-in from 2.5 on
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False
+
+    f = io.BytesIO()
+    with torch.no_grad():
+        torch.onnx.export(
+            step_module,
+            example_inputs,
+            f,
+            input_names=input_names,
+            output_names=output_names,
+            dynamic_axes={name: {0: "q"} for name in input_names + output_names},
+            opset_version=opset_version,
+            **kwargs,
+        )
+
+    return onnx.load_from_string(f.getvalue())
+
+
+def export_rollout(digital_twin):
+    """ONNX model of the full forward_joint rollout as a Loop over export_step
+
+    Inputs x0 (q, n_x), u_pop (m, q, n_u) and u_ind (m, q, n_u_ind).
+    Outputs X_pop and X_DT (m, q, n_x), the first step being x0.
+    """
+
+    step_model = export_step(digital_twin)
+    step_graph = step_model.graph
+
+    # Loop body: the step graph fed with the inputs of iteration i
+    body_nodes = [
+        helper.make_node("Gather", ["u_pop_seq", "i"], ["u_pop"], axis=0),
+        helper.make_node("Gather", ["u_ind_seq", "i"], ["u_ind"], axis=0),
+        *step_graph.node,
+        helper.make_node("Identity", ["cond_in"], ["cond_out"]),
+        helper.make_node("Identity", ["x_pop_next"], ["x_pop_scan"]),
+        helper.make_node("Identity", ["x_DT_next"], ["x_DT_scan"]),
+    ]
+    body = helper.make_graph(
+        body_nodes,
+        "euler_step",
+        [
+            helper.make_tensor_value_info("i", TensorProto.INT64, []),
+            helper.make_tensor_value_info("cond_in", TensorProto.BOOL, []),
+            helper.make_tensor_value_info("x_pop", TensorProto.FLOAT, None),
+            helper.make_tensor_value_info("x_DT", TensorProto.FLOAT, None),
+        ],
+        [
+            helper.make_tensor_value_info("cond_out", TensorProto.BOOL, []),
+            helper.make_tensor_value_info("x_pop_next", TensorProto.FLOAT, None),
+            helper.make_tensor_value_info("x_DT_next", TensorProto.FLOAT, None),
+            helper.make_tensor_value_info("x_pop_scan", TensorProto.FLOAT, None),
+            helper.make_tensor_value_info("x_DT_scan", TensorProto.FLOAT, None),
+        ],
+        initializer=step_graph.initializer,
+    )
+
+    # Trip count: m - 1 steps after x0
+    nodes = [
+        helper.make_node("Shape", ["u_pop_seq"], ["shape_u"], start=0, end=1),
+        helper.make_node("Sub", ["shape_u", "one"], ["n_steps"]),
+        helper.make_node("Squeeze", ["n_steps", "zero"], ["trip_count"]),
+        helper.make_node(
+            "Loop",
+            ["trip_count", "", "x0", "x0"],
+            ["x_pop_last", "x_DT_last", "x_pop_sim", "x_DT_sim"],
+            body=body,
+        ),
+        helper.make_node("Unsqueeze", ["x0", "zero"], ["x0_step"]),
+        helper.make_node("Concat", ["x0_step", "x_pop_sim"], ["X_pop"], axis=0),
+        helper.make_node("Concat", ["x0_step", "x_DT_sim"], ["X_DT"], axis=0),
+    ]
+    x0_info = step_graph.input[0]
+    u_pop_info = step_graph.input[2]
+    u_ind_info = step_graph.input[3]
+    n_x = x0_info.type.tensor_type.shape.dim[1].dim_value
+    n_u = u_pop_info.type.tensor_type.shape.dim[1].dim_value
+    n_u_ind = u_ind_info.type.tensor_type.shape.dim[1].dim_value
+
+    graph = helper.make_graph(
+        nodes,
+        "digital_twin_rollout",
+        [
+            helper.make_tensor_value_info("x0", TensorProto.FLOAT, ["q", n_x]),
+            helper.make_tensor_value_info(
+                "u_pop_seq", TensorProto.FLOAT, ["m", "q", n_u]
+            ),
+            helper.make_tensor_value_info(
+                "u_ind_seq", TensorProto.FLOAT, ["m", "q", n_u_ind]
+            ),
+        ],
+        [
+            helper.make_tensor_value_info("X_pop", TensorProto.FLOAT, ["m", "q", n_x]),
+            helper.make_tensor_value_info("X_DT", TensorProto.FLOAT, ["m", "q", n_x]),
+        ],
+        initializer=[
+            helper.make_tensor("one", TensorProto.INT64, [1], [1]),
+            helper.make_tensor("zero", TensorProto.INT64, [1], [0]),
+        ],
+    )
+
+    model = helper.make_model(
+        graph,
+        opset_imports=[helper.make_opsetid("", opset_version)],
+        ir_version=step_model.ir_version,
+    )
+    onnx.checker.check_model(model)
+
+    return model
+
+
+def export_constants(digital_twin):
+    """Preprocessing constants of a DigitalTwin, as NumPy arrays
+
+    The affine constants of the state, input and individual input scalers,
+    the steady-state table of the initial states and the column names: what
+    onnx_backend.OnnxDigitalTwin needs to run the ONNX rollout on raw
+    scenarios without torch or scikit-learn.
+    """
+
+    scaler_states = scaler_store.states(digital_twin.popModelFolder)
+    scaler_inputs = scaler_store.inputs(digital_twin.popModelFolder)
+
+    # Robust scaling only applies to the idx_robust individual inputs
+    center_ind = np.zeros(len(input_ind))
+    scale_ind = np.ones(len(input_ind))
+    center_ind[idx_robust] = digital_twin.scaler_featsRobust.center_
+    scale_ind[idx_robust] = digital_twin.scaler_featsRobust.scale_
+
+    init_cgm_min, table_init_states = get_init_states_table()
+
+    return {
+        "center_states": scaler_states.center,
+        "scale_states": scaler_states.scale,
+        "center_inputs": scaler_inputs.center,
+        "scale_inputs": scaler_inputs.scale,
+        "center_ind": center_ind,
+        "scale_ind": scale_ind,
+        "init_cgm_min": np.int64(init_cgm_min),
+        "init_states": table_init_states,
+        "states": np.array(states),
+        "inputs": np.array(inputs),
+        "input_ind": np.array(input_ind),
+    }
+
+
+def export_onnx(digital_twin, path=None, rollout=True):
+    """Export a DigitalTwin as an ONNX model (full rollout or one step)
+
+    Returns the serialized model, also written to `path` if given, with the
+    preprocessing constants (export_constants) in a .npz of the same name.
+    """
+
+    model = export_rollout(digital_twin) if rollout else export_step(digital_twin)
+    model_bytes = model.SerializeToString()
+
+    if path is not None:
+        with open(path, "wb") as f:
+            f.write(model_bytes)
+        np.savez(constants_path(path), **export_constants(digital_twin))
+
+    return model_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export digital twins as ONNX files")
+    parser.add_argument(
+        "n_digitalTwin",
+        type=int,
+        nargs="*",
+        help="Indexes of the bundled digital twins (default: all)",
+    )
+    parser.add_argument("--custom_DT", help="Folder of a custom digital twin")
+    parser.add_argument("--output", default=".", help="Output folder")
+    parser.add_argument(
+        "--step", action="store_true", help="Export one Euler step instead of a Loop"
+    )
+    args = parser.parse_args()
+
+    if args.custom_DT is not None:
+        digital_twins = [DigitalTwin(custom_DT=args.custom_DT)]
+    else:
+        n_digitalTwins = args.n_digitalTwin or range(len(list_digital_twins()))
+        digital_twins = [DigitalTwin(n_digitalTwin=n) for n in n_digitalTwins]
+
+    os.makedirs(args.output, exist_ok=True)
+    for digital_twin in digital_twins:
+        name = os.path.basename(os.path.normpath(digital_twin.digital_twin_folder))
+        path = os.path.join(
+            args.output, name + ("_step" if args.step else "") + ".onnx"
+        )
+        export_onnx(digital_twin, path, rollout=not args.step)
+        print("Exported", path, "and", constants_path(path))
+
+
+if __name__ == "__main__":
+    main()
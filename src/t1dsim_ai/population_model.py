@@ -1,5 +1,7 @@
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
+from torch.ao.quantization import quantize_dynamic, per_channel_dynamic_qconfig
 
 
 class WeightClipper(object):
@@ -204,3 +206,153 @@ class CGMOHSUSimStateSpaceModel_V2(nn.Module):
         dx = torch.cat((dQ1, dQ2, dS1, dS2, dI, dX1, dX2, dX3, dC2, dC1), -1)
 
         return dx
+
+
+class FusedCGMOHSUSimStateSpaceModel(nn.Module):
+
+    """Inference-mode packing of CGMOHSUSimStateSpaceModel_V2
+
+    The ten compartment networks are packed into two matmuls. The first layer
+    is a block-sparse (sum(n_feat), n_x + n_u + 1) matrix: each compartment
+    owns a block of hidden units and only the columns of its inputs are
+    non-zero. The last column holds the first-layer biases and multiplies a
+    constant input of ones, so no separate bias pass runs over the hidden
+    units. The second layer is block-diagonal (n_x, sum(n_feat)). The
+    per-compartment input slicing of the original model is folded into the
+    weight packing through the precomputed index table `idx_inputs`.
+
+    Attributes
+    ----------
+    n_feat: dict
+        Hidden units per compartment, same as CGMOHSUSimStateSpaceModel_V2
+    idx_inputs: dict
+        Positions of each compartment inputs in cat((in_x, in_u), -1)
+
+    """
+
+    # Output order of dx and positions of the inputs in cat((in_x, in_u), -1):
+    # q1, q2, s1, s2, I, x1, x2, x3, c2, c1, u_I, u_carbs
+    compartments = ["Q1", "Q2", "S1", "S2", "I", "X1", "X2", "X3", "C2", "C1"]
+    idx_inputs = {
+        "Q1": [5, 7, 0, 1, 8],  # NN7(x1,x3,q1,q2,u_G)
+        "Q2": [5, 6, 0, 1],  # NN8(x1,x2,q2,q1)
+        "S1": [2, 10],  # NN1(s1,u_I)
+        "S2": [2, 3],  # NN2(s1,s2)
+        "I": [3, 4],  # NN3(s2,I)
+        "X1": [4, 5],  # NN4(I,x1)
+        "X2": [4, 6],  # NN5(I,x2)
+        "X3": [4, 7],  # NN6(I,x3)
+        "C2": [9, 8],  # NN9(c1,c2)
+        "C1": [9, 11],  # NN10(u_carbs,c1)
+    }
+
+    def __init__(self, n_feat=None, n_x=10, n_u=2):
+        super(FusedCGMOHSUSimStateSpaceModel, self).__init__()
+        self.n_feat = n_feat
+
+        n_hidden = sum(self.n_feat[key] for key in self.compartments)
+
+        # Packed layers, stored as (out_features, in_features) like nn.Linear
+        self.register_buffer("weight_1", torch.zeros(n_hidden, n_x + n_u + 1))
+        self.register_buffer("weight_2", torch.zeros(n_x, n_hidden))
+        self.register_buffer("bias_2", torch.zeros(n_x))
+
+    @torch.no_grad()
+    def pack(self, ss_pop_model):
+        """Copy the weights of a CGMOHSUSimStateSpaceModel_V2 into the packed layers"""
+
+        networks = {
+            "Q1": ss_pop_model.net_dQ1,
+            "Q2": ss_pop_model.net_dQ2,
+            "S1": ss_pop_model.net_dS1,
+            "S2": ss_pop_model.net_dS2,
+            "I": ss_pop_model.net_dI,
+            "X1": ss_pop_model.net_dX1,
+            "X2": ss_pop_model.net_dX2,
+            "X3": ss_pop_model.net_dX3,
+            "C2": ss_pop_model.net_dC2,
+            "C1": ss_pop_model.net_dC1,
+        }
+
+        self.weight_1.zero_()
+        self.weight_2.zero_()
+
+        start = 0
+        for k, key in enumerate(self.compartments):
+            layer_1, layer_2 = networks[key][0], networks[key][2]
+            block = slice(start, start + self.n_feat[key])
+
+            self.weight_1[block, self.idx_inputs[key]] = layer_1.weight
+            self.weight_1[block, -1] = layer_1.bias
+            self.weight_2[k, block] = layer_2.weight[0]
+            self.bias_2[k] = layer_2.bias[0]
+
+            start += self.n_feat[key]
+
+        return self
+
+    @classmethod
+    def from_model(cls, ss_pop_model):
+        fused_model = cls(n_feat=ss_pop_model.n_feat)
+        fused_model.to(next(ss_pop_model.parameters()).device)
+        return fused_model.pack(ss_pop_model)
+
+    @classmethod
+    def from_state_dict(cls, state_dict, n_feat):
+        ss_pop_model = CGMOHSUSimStateSpaceModel_V2(n_feat=n_feat, init_small=False)
+        ss_pop_model.load_state_dict(state_dict)
+        return cls.from_model(ss_pop_model)
+
+    def forward(self, in_x, in_u):
+
+        in_xu = torch.cat((in_x, in_u, torch.ones_like(in_u[..., :1])), -1)
+        hidden = torch.relu_(F.linear(in_xu, self.weight_1))
+        dx = F.linear(hidden, self.weight_2, self.bias_2)
+
+        return dx
+
+
+class QuantizedCGMOHSUSimStateSpaceModel(nn.Module):
+
+    """int8 dynamic quantization of FusedCGMOHSUSimStateSpaceModel
+
+    The two packed layers are copied into nn.Linear modules and converted
+    with torch.ao.quantization.quantize_dynamic: weights are stored in int8
+    with one scale per output unit, activations are quantized on the fly at
+    each call. Inference only, CPU only.
+
+    """
+
+    def __init__(self, n_hidden, n_x=10, n_u=2):
+        super(QuantizedCGMOHSUSimStateSpaceModel, self).__init__()
+
+        self.net = nn.Sequential(
+            nn.Linear(n_x + n_u + 1, n_hidden, bias=False),
+            nn.ReLU(),
+            nn.Linear(n_hidden, n_x),
+        )
+
+    @classmethod
+    def from_model(cls, fused_model):
+        quantized_model = cls(n_hidden=fused_model.weight_1.shape[0])
+
+        with torch.no_grad():
+            quantized_model.net[0].weight.copy_(fused_model.weight_1.cpu())
+            quantized_model.net[2].weight.copy_(fused_model.weight_2.cpu())
+            quantized_model.net[2].bias.copy_(fused_model.bias_2.cpu())
+
+        quantized_model.eval()
+        quantized_model.net = quantize_dynamic(
+            quantized_model.net,
+            {nn.Linear: per_channel_dynamic_qconfig},
+            dtype=torch.qint8,
+        )
+
+        return quantized_model
+
+    def forward(self, in_x, in_u):
+
+        in_xu = torch.cat((in_x, in_u, torch.ones_like(in_u[..., :1])), -1)
+        dx = self.net(in_xu)
+
+        return dx
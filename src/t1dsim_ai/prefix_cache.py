@@ -0,0 +1,80 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class PrefixStateCache:
+
+    """Thread-safe LRU cache of simulated trajectory blocks
+
+    A simulation is split in blocks of `checkpoint_every` steps. The block
+    ending at step k is keyed by a hash of everything the states up to k
+    depend on: the simulator configuration, the initial state and the
+    inputs of rows 0 to k - 1. A new scenario that shares a prefix with a
+    cached one reuses its blocks and resumes the rollout from the state at
+    the end of the last shared block.
+
+    Attributes
+    ----------
+    capacity: int
+        Maximum number of blocks kept in memory
+
+    """
+
+    def __init__(self, capacity=65536):
+        self.capacity = capacity
+
+        self._lock = threading.Lock()
+        self._blocks = OrderedDict()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    @staticmethod
+    def prefix_keys(config, x0, u, checkpoint_every):
+        """Key of each full block of u. Size of u: (n_steps, n_u + n_u_ind)
+
+        The block j covers the states of rows (j - 1) * checkpoint_every + 1
+        to j * checkpoint_every, so its key hashes the inputs up to row
+        j * checkpoint_every - 1.
+        """
+
+        h = hashlib.sha1(repr(config).encode())
+        h.update(np.ascontiguousarray(x0, dtype=np.float32).tobytes())
+
+        u = np.ascontiguousarray(u, dtype=np.float32)
+        keys = []
+        for end in range(checkpoint_every, len(u), checkpoint_every):
+            h.update(u[end - checkpoint_every : end].tobytes())
+            keys.append(h.digest())
+
+        return keys
+
+    def get(self, keys):
+        """Cached blocks of the longest cached prefix of keys"""
+
+        blocks = []
+        with self._lock:
+            for key in keys:
+                block = self._blocks.get(key)
+                if block is None:
+                    break
+                self._blocks.move_to_end(key)
+                blocks.append(block)
+
+        return blocks
+
+    def put(self, keys, blocks):
+        with self._lock:
+            for key, block in zip(keys, blocks):
+                self._blocks[key] = block
+                self._blocks.move_to_end(key)
+
+            while len(self._blocks) > self.capacity:
+                self._blocks.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._blocks.clear()
@@ -0,0 +1,161 @@
+from t1dsim_ai.individual_model import (
+    DigitalTwin,
+    list_digital_twins,
+    load_population_model,
+)
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import torch
+
+
+class DigitalTwinRegistry:
+
+    """Process-wide cache of DigitalTwin simulators
+
+    The frozen population model is loaded once and shared by every twin. Each
+    twin (individual model + robust scaler) is built on first use and kept in
+    an LRU cache of at most `capacity` entries. All methods are thread-safe:
+    a twin is built outside the registry lock, so lookups of the cached twins
+    do not wait for it, and concurrent requests of the same twin share one
+    build.
+
+    Attributes
+    ----------
+    capacity: int
+        Maximum number of digital twins kept in memory
+    device: torch.device
+        Device where the models are loaded
+    ts: float
+        Models sampling time
+    fused: bool
+        Use the fused population model for inference
+    precision: str
+        Precision of the MLPs ("float32" or "bfloat16")
+    quantized: bool or tuple
+        int8 models, see DigitalTwin
+    checkpoint_every: int
+        Steps between the prefix checkpoints of simulate, see DigitalTwin
+    result_cache: SimulationResultCache
+        Cache of simulate results shared by the twins (None: off)
+
+    """
+
+    def __init__(
+        self,
+        capacity=8,
+        device=torch.device("cpu"),
+        ts=5,
+        fused=True,
+        precision="float32",
+        quantized=False,
+        checkpoint_every=0,
+        result_cache=None,
+    ):
+        self.capacity = capacity
+        self.device = device
+        self.ts = ts
+        self.fused = fused
+        self.precision = precision
+        self.quantized = quantized
+        self.checkpoint_every = checkpoint_every
+        self.result_cache = result_cache
+
+        self._lock = threading.RLock()
+        self._twins = OrderedDict()
+        self._building = {}
+        self._ss_pop_model = None
+        self._digital_twin_list = None
+
+    @property
+    def ss_pop_model(self):
+        with self._lock:
+            if self._ss_pop_model is None:
+                self._ss_pop_model = load_population_model(
+                    self.device,
+                    self.fused,
+                    not isinstance(self.quantized, bool)
+                    and "population" in (self.quantized or ()),
+                )
+            return self._ss_pop_model
+
+    @property
+    def digital_twin_list(self):
+        with self._lock:
+            if self._digital_twin_list is None:
+                self._digital_twin_list = list_digital_twins()
+            return self._digital_twin_list
+
+    def get(self, n_digitalTwin=0, custom_DT=None):
+        """Return the DigitalTwin for an index of the bundled models or a custom folder"""
+
+        key = self.digital_twin_list[n_digitalTwin] if custom_DT is None else custom_DT
+
+        with self._lock:
+            if key in self._twins:
+                self._twins.move_to_end(key)
+                return self._twins[key]
+
+            # One build per key, waited for by the other requests of the twin
+            future = self._building.get(key)
+            if future is None:
+                future = self._building[key] = Future()
+                building = True
+            else:
+                building = False
+
+        if not building:
+            return future.result()
+
+        try:
+            digital_twin = DigitalTwin(
+                n_digitalTwin=n_digitalTwin,
+                custom_DT=custom_DT,
+                device=self.device,
+                ts=self.ts,
+                fused=self.fused,
+                ss_pop_model=self.ss_pop_model,
+                precision=self.precision,
+                quantized=self.quantized,
+                checkpoint_every=self.checkpoint_every,
+                result_cache=self.result_cache,
+            )
+        except BaseException as e:
+            with self._lock:
+                if self._building.get(key) is future:
+                    del self._building[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            # Not cached if the registry was cleared during the build
+            if self._building.get(key) is future:
+                del self._building[key]
+                self._twins[key] = digital_twin
+                while len(self._twins) > self.capacity:
+                    self._twins.popitem(last=False)
+
+        future.set_result(digital_twin)
+
+        return digital_twin
+
+    def warm_up(self, n_digitalTwins=None):
+        """Preload the population model and the given twins (default: all, up to capacity)"""
+
+        if n_digitalTwins is None:
+            n_digitalTwins = range(min(len(self.digital_twin_list), self.capacity))
+
+        return [self.get(n_digitalTwin) for n_digitalTwin in n_digitalTwins]
+
+    def clear(self):
+        with self._lock:
+            self._twins.clear()
+            self._building.clear()
+            self._ss_pop_model = None
+            self._digital_twin_list = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._twins)
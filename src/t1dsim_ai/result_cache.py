@@ -0,0 +1,154 @@
+from t1dsim_ai.utils.io import atomic_write
+from t1dsim_ai.options import states, inputs, input_ind
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# Bump when the simulation changes in a way that invalidates stored results
+cache_version = 1
+
+
+class SimulationResultCache:
+
+    """Content-addressed cache of DigitalTwin.simulate results
+
+    Results are keyed by a SHA-256 of the input columns (inputs, input_ind
+    and the initial CGM), the twin, its simulator configuration and the
+    digests of the population and individual model files it loaded, so a
+    retrained model never serves stale results. Entries are the simulated
+    states in mg/dL. They are kept in an in-memory LRU tier and, if
+    `cache_dir` is given, in a compressed .npz per entry on disk, evicted by
+    size (oldest access first). All methods are thread-safe.
+
+    Attributes
+    ----------
+    capacity: int
+        Maximum number of entries in memory
+    cache_dir: str
+        Folder of the on-disk tier (None: memory only)
+    max_disk_bytes: int
+        Maximum size of the on-disk tier
+    hits, misses: int
+        Lookups served from the cache and simulated
+
+    """
+
+    def __init__(self, capacity=64, cache_dir=None, max_disk_bytes=256 * 2**20):
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, digital_twin, df_scenario):
+        """Key of the simulation of a preprocessed scenario"""
+
+        config = (
+            cache_version,
+            os.path.basename(os.path.normpath(digital_twin.digital_twin_folder)),
+            digital_twin.ts,
+            digital_twin.fused,
+            digital_twin.precision,
+            digital_twin.quantized,
+            digital_twin.backend,
+        )
+
+        h = hashlib.sha256(repr(config).encode())
+        for digest in digital_twin.model_digests:
+            h.update(digest.encode())
+        h.update(np.float64(df_scenario[states[0]].iloc[0]).tobytes())
+        h.update(
+            np.ascontiguousarray(
+                df_scenario[inputs + input_ind].values, dtype=np.float64
+            ).tobytes()
+        )
+
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def get(self, key):
+        """(x_sim_pop, x_sim_DT) in mg/dL, or None on a miss"""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        if self.cache_dir is not None:
+            try:
+                with np.load(self.path(key)) as data:
+                    entry = (data["x_sim_pop"], data["x_sim_DT"])
+                os.utime(self.path(key))
+            except (OSError, KeyError, ValueError):
+                entry = None
+
+            if entry is not None:
+                self._put_memory(key, entry)
+                with self._lock:
+                    self.hits += 1
+                return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, x_sim_pop, x_sim_DT):
+        entry = (x_sim_pop, x_sim_DT)
+        for array in entry:
+            array.setflags(write=False)
+
+        self._put_memory(key, entry)
+
+        if self.cache_dir is not None:
+            with atomic_write(self.path(key)) as f:
+                np.savez_compressed(f, x_sim_pop=x_sim_pop, x_sim_DT=x_sim_DT)
+            self.evict_disk()
+
+    def _put_memory(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def evict_disk(self):
+        """Remove the least recently used files above max_disk_bytes"""
+
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npz") and entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+        total_bytes = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total_bytes <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+        if self.cache_dir is not None:
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith(".npz"):
+                    os.remove(entry.path)
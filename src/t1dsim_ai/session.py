@@ -0,0 +1,137 @@
+from t1dsim_ai.utils.preprocess import scaler_inverse
+from t1dsim_ai.steady_states import init_states
+from t1dsim_ai.options import states, inputs, input_ind
+
+import numpy as np
+import pandas as pd
+import torch
+
+
+class DigitalTwinSession:
+
+    """Stateful simulation of a DigitalTwin fed one sample at a time
+
+    The session keeps the current hidden state of the population and the
+    personalized simulations, so each call only computes the new steps. The
+    trajectory matches `DigitalTwin.simulate`: the session starts at the
+    steady state of the initial CGM (row 0) and the inputs of row k give the
+    states of row k + 1.
+
+    Attributes
+    ----------
+    digital_twin: DigitalTwin
+        Twin providing the simulator and the input scalers
+    x_step: torch.Tensor. Size: (2, n_x)
+        Current population (row 0) and personalized (row 1) scaled states
+    n_steps: int
+        Number of steps simulated since the initial state
+
+    """
+
+    def __init__(self, digital_twin, init_cgm):
+        self.digital_twin = digital_twin
+        self.nn_solution = digital_twin.nn_solution
+
+        x0 = torch.as_tensor(init_states(init_cgm)[0], dtype=torch.float32)
+        self.x_step = torch.stack((x0, x0), 0).to(digital_twin.device)
+        self.n_steps = 0
+
+    @staticmethod
+    def _values(sample, columns):
+        # Mapping (dict, pd.Series) keyed by column name or values in order
+        if hasattr(sample, "keys"):
+            return [sample[column] for column in columns]
+        return sample
+
+    def step(self, u_pop, u_ind):
+        """Advance one step with the raw inputs of the current row
+
+        Parameters
+        ----------
+        u_pop: array-like or mapping
+            Population inputs (inputs in options)
+        u_ind: array-like or mapping
+            Individual inputs (input_ind in options)
+
+        Returns
+        -------
+        pd.Series
+            New states in mg/dL, same columns as a row of `simulate`
+
+        """
+
+        u_pop = np.reshape(self._values(u_pop, inputs), (1, len(inputs)))
+        u_ind = np.reshape(self._values(u_ind, input_ind), (1, len(input_ind)))
+
+        return self.advance_inputs(u_pop, u_ind).iloc[0]
+
+    def advance(self, n_steps, df_inputs):
+        """Advance n_steps with the raw inputs of the next n_steps rows
+
+        `df_inputs` is a DataFrame with the `inputs` and `input_ind` columns
+        (its first n_steps rows are used) or a mapping of constant values.
+        Returns the n_steps new rows in the format of `simulate`.
+        """
+
+        if isinstance(df_inputs, pd.DataFrame):
+            if len(df_inputs) < n_steps:
+                raise ValueError(
+                    "df_inputs has {} rows, {} needed".format(len(df_inputs), n_steps)
+                )
+            u_pop = df_inputs[inputs].values[:n_steps]
+            u_ind = df_inputs[input_ind].values[:n_steps]
+        else:
+            u_pop = np.tile(self._values(df_inputs, inputs), (n_steps, 1))
+            u_ind = np.tile(self._values(df_inputs, input_ind), (n_steps, 1))
+
+        return self.advance_inputs(u_pop, u_ind)
+
+    def advance_inputs(self, u_pop, u_ind):
+        """Advance with raw input arrays. Size: (n_steps, n_u), (n_steps, n_u_ind)"""
+
+        n_steps = len(u_pop)
+        device = self.digital_twin.device
+
+        u_pop, u_ind = self.digital_twin.scale_inputs(u_pop, u_ind)
+
+        # One extra (unused) input row: the rollout returns x_step and the
+        # n_steps new states. Both trajectories as in forward_joint
+        u_pop = np.concatenate((u_pop, u_pop[-1:]), 0)[:, np.newaxis]
+        u_ind = np.concatenate((u_ind, u_ind[-1:]), 0)[:, np.newaxis]
+        u_pop = torch.as_tensor(np.concatenate((u_pop, u_pop), 1), dtype=torch.float32)
+        u_ind = torch.as_tensor(u_ind, dtype=torch.float32)
+
+        with torch.no_grad():
+            X_sim = self.nn_solution.rollout(
+                self.x_step, u_pop.to(device), u_ind.to(device), n_pop=1
+            )
+
+        self.x_step = X_sim[-1].clone()
+        self.n_steps += n_steps
+
+        X_sim = scaler_inverse(
+            X_sim[1:].to("cpu").numpy(), self.digital_twin.popModelFolder
+        )
+
+        # Built in one piece: adding columns one by one dominates a step
+        return pd.DataFrame(
+            np.concatenate((X_sim[:, 0], X_sim[:, 1], X_sim[:, :, 0]), 1),
+            columns=states + [s + "_DT" for s in states] + ["cgm_NNPop", "cgm_NNDT"],
+            index=np.arange(self.n_steps - n_steps + 1, self.n_steps + 1),
+        )
+
+    def snapshot(self):
+        """Copy of the session state, restored with `restore`"""
+
+        return {
+            "x_step": self.x_step.to("cpu").numpy().copy(),
+            "n_steps": self.n_steps,
+            "digital_twin_folder": self.digital_twin.digital_twin_folder,
+        }
+
+    def restore(self, snapshot):
+        if snapshot["digital_twin_folder"] != self.digital_twin.digital_twin_folder:
+            raise ValueError("Snapshot of another digital twin")
+
+        self.x_step = torch.as_tensor(snapshot["x_step"]).to(self.digital_twin.device)
+        self.n_steps = snapshot["n_steps"]
@@ -0,0 +1,64 @@
+from t1dsim_ai.options import states
+
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+path_init_states = Path(__file__).parent / "models/initSteadyStates.csv"
+
+_table = None
+_table_lock = threading.Lock()
+
+
+def get_init_states_table():
+    """Steady states of initSteadyStates.csv, read once per process
+
+    Returns
+    -------
+    cgm_min: int
+        CGM [mg/dL] of the first row
+    table: np.ndarray. Size: (n_cgm, n_x), float32
+        Row i holds the steady state at CGM cgm_min + i
+
+    """
+
+    global _table
+
+    with _table_lock:
+        if _table is None:
+            dfInitStates = pd.read_csv(path_init_states).set_index("initCGM")
+            table = dfInitStates[states].values.astype(np.float32)
+            table.setflags(write=False)
+            _table = (int(dfInitStates.index[0]), table)
+
+    return _table
+
+
+def init_states(cgm_array, interpolate=False):
+    """Initial states for an array of CGM values [mg/dL]
+
+    CGM is clipped to the range of the table. Without interpolation the
+    value is truncated to an integer, as getInitSSFromFile does; with
+    interpolation the two neighbouring rows are linearly blended.
+
+    Returns
+    -------
+    np.ndarray. Size: (len(cgm_array), n_x), float32
+
+    """
+
+    cgm_min, table = get_init_states_table()
+
+    cgm = np.asarray(cgm_array, dtype=np.float64).reshape(-1)
+    pos = np.clip(cgm - cgm_min, 0, len(table) - 1)
+
+    if not interpolate:
+        return table[pos.astype(np.int64)]
+
+    pos_low = np.floor(pos).astype(np.int64)
+    pos_high = np.minimum(pos_low + 1, len(table) - 1)
+    weight = (pos - pos_low).astype(np.float32)[:, np.newaxis]
+
+    return (1 - weight) * table[pos_low] + weight * table[pos_high]
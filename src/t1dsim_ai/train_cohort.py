@@ -0,0 +1,517 @@
+from t1dsim_ai.individual_model import IndividualModel, SequenceSelection
+from t1dsim_ai.ensemble import IndividualModelEnsemble
+from t1dsim_ai.options import hidden_compartments as default_hidden_compartments
+from t1dsim_ai.utils.io import atomic_write
+from t1dsim_ai.utils.metrics import (
+    get_TIR,
+    get_TBR70,
+    get_TAR180,
+    get_glucose_variability,
+)
+from t1dsim_ai.utils.preprocess import scale_inverse_Q1
+
+import argparse
+import inspect
+import multiprocessing
+import os
+import random
+import time
+import traceback
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+
+metrics_cgm = {"TIR": get_TIR, "TAR": get_TAR180, "TBR": get_TBR70}
+
+
+def subject_seed(subj, seed=0):
+    """Seed of a subject: stable across runs and independent of the worker order"""
+
+    return (zlib.crc32(str(subj).encode()) + seed) % 2**32
+
+
+def seed_everything(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def is_trainable(df_data_subj):
+    """Both splits must have data and at least one meal"""
+
+    for is_train in [True, False]:
+        df_split = df_data_subj[df_data_subj.is_train == is_train]
+        if len(df_split) == 0 or df_split["input_meal_carbs"].sum() < 1:
+            return False
+    return True
+
+
+def evaluate_subject(NNIndividual, df_data_subj):
+    """Metrics of a trained IndividualModel, as in info.csv"""
+
+    info = {
+        "subjectID": NNIndividual.subjectID,
+        "TIR": 100 * get_TIR(df_data_subj.output_cgm),
+        "TAR": 100 * get_TAR180(df_data_subj.output_cgm),
+        "TBR": 100 * get_TBR70(df_data_subj.output_cgm),
+        "GlucoseVariability": 100 * get_glucose_variability(df_data_subj.output_cgm),
+    }
+
+    data = {
+        "train": [
+            NNIndividual.x_est_train,
+            NNIndividual.u_pop_train,
+            NNIndividual.y_id_train,
+            NNIndividual.u_ind_train,
+        ],
+        "test": [
+            NNIndividual.x_est_test,
+            NNIndividual.u_pop_test,
+            NNIndividual.y_id_test,
+            NNIndividual.u_ind_test,
+        ],
+    }
+
+    def add_metrics(cgm, suffix):
+        for name, metric in metrics_cgm.items():
+            info[name + suffix] = 100 * np.mean(np.apply_along_axis(metric, 0, cgm))
+
+    for group in ["train", "test"]:
+        batch = SequenceSelection(NNIndividual.seq_len, "cpu", data[group])
+        with torch.no_grad():
+            (
+                batch_x0_hidden,
+                batch_u_pop,
+                batch_u_ind,
+                batch_y,
+                batch_x_original,
+            ) = batch.get_all("all")
+
+            cgm_original = scale_inverse_Q1(
+                batch_x_original[1:, :, [0]], NNIndividual.popModelFolder
+            )
+
+            info["n_seq_" + group] = batch_x0_hidden.shape[0]
+            add_metrics(cgm_original.numpy(), "_" + group)
+
+            for model_bool in [False, True]:
+                model = "AIPop" if not model_bool else "AIDT"
+                batch_x_sim = NNIndividual.nn_solution(
+                    batch_x0_hidden, batch_u_pop, batch_u_ind, model_bool
+                )
+                cgm_sim = scale_inverse_Q1(
+                    batch_x_sim[1:, :, [0]], NNIndividual.popModelFolder
+                )
+
+                info["RMSE_" + model + "_" + group] = torch.mean(
+                    torch.sqrt(torch.nanmean((cgm_sim - cgm_original) ** 2, dim=0))
+                ).item()
+                add_metrics(cgm_sim.numpy(), "_" + model + "_" + group)
+
+    info["train_epochs"] = NNIndividual.curr_epoch
+    info["best_epoch"] = NNIndividual.best_epoch
+
+    return info
+
+
+def train_subject(
+    df_data_subj,
+    personalization_path,
+    subj,
+    hidden_compartments=default_hidden_compartments,
+    lr=1e-4,
+    batch_size=32,
+    n_epochs=150,
+    overlap=0.9,
+    seed=0,
+    validation=0.0,
+    max_epochs_without_improvement=150,
+    checkpoint_every=0,
+    resume=False,
+    n_segments=1,
+    continuity_weight=1.0,
+):
+    """Train and save the digital twin of one subject
+
+    individual_model.pt, scaler_robust.pkl and info.csv are written
+    atomically in personalization_path/subj. With resume, the training
+    continues from the checkpoint of a previous run if there is one.
+
+    Returns
+    -------
+    dict
+        Row of the cohort summary (status, seed, wall time, RMSE)
+
+    """
+
+    init_time = time.perf_counter()
+    summary = {"subjectID": subj, "seed": subject_seed(subj, seed)}
+
+    if not is_trainable(df_data_subj):
+        summary["status"] = "skipped"
+        summary["wall_time"] = time.perf_counter() - init_time
+        return summary
+
+    seed_everything(summary["seed"])
+
+    NNIndividual = IndividualModel(subj, df_data_subj, personalization_path)
+    NNIndividual.setup_nn(
+        hidden_compartments,
+        lr,
+        batch_size,
+        n_epochs,
+        overlap,
+        validation=validation,
+        max_epochs_without_improvement=max_epochs_without_improvement,
+        checkpoint_every=checkpoint_every,
+        n_segments=n_segments,
+        continuity_weight=continuity_weight,
+    )
+    score = NNIndividual.fit(True, resume)
+
+    summarize_subject(NNIndividual, df_data_subj, score, summary)
+    summary["wall_time"] = time.perf_counter() - init_time
+
+    return summary
+
+
+def train_ensemble(
+    dict_data,
+    personalization_path,
+    hidden_compartments=default_hidden_compartments,
+    lr=1e-4,
+    batch_size=32,
+    n_epochs=150,
+    overlap=0.9,
+    seed=0,
+    validation=0.0,
+    max_epochs_without_improvement=150,
+    checkpoint_every=0,
+    resume=False,
+    n_segments=1,
+    continuity_weight=1.0,
+):
+    """Train and save the digital twins of several subjects as one ensemble
+
+    See IndividualModelEnsemble. The wall time of each subject is the wall
+    time of the whole ensemble. Ensembles are not checkpointed and only use
+    single shooting: checkpoint_every, resume, n_segments and
+    continuity_weight are ignored (train_cohort rejects them).
+
+    Returns
+    -------
+    list
+        Row of the cohort summary of each subject
+
+    """
+
+    init_time = time.perf_counter()
+
+    list_summary = []
+    individual_models = []
+    dict_data_subj = {}
+    for subj, df_data_subj in dict_data.items():
+        summary = {"subjectID": subj, "seed": subject_seed(subj, seed)}
+        list_summary.append(summary)
+
+        if not is_trainable(df_data_subj):
+            summary["status"] = "skipped"
+            continue
+
+        individual_models.append(
+            IndividualModel(subj, df_data_subj, personalization_path)
+        )
+        dict_data_subj[subj] = df_data_subj
+
+    if individual_models:
+        ensemble = IndividualModelEnsemble(individual_models)
+        ensemble.setup_nn(
+            hidden_compartments,
+            lr,
+            batch_size,
+            n_epochs,
+            overlap,
+            validation=validation,
+            max_epochs_without_improvement=max_epochs_without_improvement,
+            seeds=[subject_seed(model.subjectID, seed) for model in individual_models],
+        )
+        scores = ensemble.fit(True)
+
+        dict_summary = {summary["subjectID"]: summary for summary in list_summary}
+        for NNIndividual, score in zip(individual_models, scores):
+            subj = NNIndividual.subjectID
+            summarize_subject(
+                NNIndividual, dict_data_subj[subj], score, dict_summary[subj]
+            )
+
+    wall_time = time.perf_counter() - init_time
+    for summary in list_summary:
+        summary["n_ensemble"] = len(individual_models)
+        summary["wall_time"] = wall_time
+
+    return list_summary
+
+
+def summarize_subject(NNIndividual, df_data_subj, score, summary):
+    """Write info.csv of a trained subject and fill its summary row"""
+
+    if np.isnan(score):
+        summary["status"] = "diverged"
+        return
+
+    info = evaluate_subject(NNIndividual, df_data_subj)
+    with atomic_write(NNIndividual.pathModel + "/info.csv", "w") as f:
+        pd.DataFrame(info, index=[0]).T.to_csv(f)
+
+    summary["status"] = "trained"
+    summary["train_epochs"] = info["train_epochs"]
+    summary["best_epoch"] = info["best_epoch"]
+    summary["score"] = score
+    for group in ["train", "test"]:
+        for model in ["AIPop", "AIDT"]:
+            key = "RMSE_" + model + "_" + group
+            summary[key] = info[key]
+
+
+def _init_worker(n_threads):
+    # One pool of intra-op threads per worker, so workers do not oversubscribe
+    torch.set_num_threads(n_threads)
+    torch.set_num_interop_threads(1)
+
+
+def _train_worker(dict_data, personalization_path, kwargs):
+    """Train one subject, or one ensemble if dict_data has several subjects"""
+
+    init_time = time.perf_counter()
+    try:
+        if len(dict_data) > 1:
+            return train_ensemble(dict_data, personalization_path, **kwargs)
+
+        ((subj, df_data_subj),) = dict_data.items()
+        return [train_subject(df_data_subj, personalization_path, subj, **kwargs)]
+
+    except Exception:
+        traceback.print_exc()
+        return [
+            {
+                "subjectID": subj,
+                "status": "failed",
+                "wall_time": time.perf_counter() - init_time,
+            }
+            for subj in dict_data
+        ]
+
+
+def train_cohort(
+    dict_data,
+    personalization_path,
+    n_workers=None,
+    n_threads=1,
+    ensemble_size=1,
+    **kwargs,
+):
+    """Train the digital twins of a cohort in a process pool
+
+    Parameters
+    ----------
+    dict_data: dict
+        DataFrame of each subject, keyed by subjectID
+    personalization_path: str
+        Folder where a folder per subject is written
+    n_workers: int
+        Number of processes (default: cpu_count // n_threads)
+    n_threads: int
+        torch threads of each process
+    ensemble_size: int
+        Number of subjects trained together by each worker (see
+        IndividualModelEnsemble)
+    kwargs:
+        Arguments of train_subject (hidden_compartments, lr, batch_size,
+        n_epochs, overlap, seed)
+
+    Returns
+    -------
+    pd.DataFrame
+        Summary of each subject, also saved as summary.csv
+
+    """
+
+    personalization_path = os.path.join(personalization_path, "")
+    os.makedirs(personalization_path, exist_ok=True)
+
+    if ensemble_size > 1 and kwargs.get("n_segments", 1) > 1:
+        raise ValueError("Multiple shooting is not supported by ensembles")
+    if ensemble_size > 1 and (
+        kwargs.get("checkpoint_every", 0) or kwargs.get("resume")
+    ):
+        raise ValueError("Checkpoints are not supported by ensembles")
+
+    subjects = list(dict_data)
+    list_groups = [
+        {subj: dict_data[subj] for subj in subjects[i : i + ensemble_size]}
+        for i in range(0, len(subjects), ensemble_size)
+    ]
+
+    if n_workers is None:
+        n_workers = max(1, (os.cpu_count() or 1) // n_threads)
+    n_workers = min(n_workers, len(list_groups))
+
+    list_summary = []
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(n_threads,),
+    ) as executor:
+        futures = {
+            executor.submit(
+                _train_worker, dict_group, personalization_path, kwargs
+            ): dict_group
+            for dict_group in list_groups
+        }
+        for future in as_completed(futures):
+            try:
+                list_summary_group = future.result()
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory): the pool is unusable,
+                # so every pending group fails without stopping the driver
+                traceback.print_exc()
+                list_summary_group = [
+                    {"subjectID": subj, "status": "failed", "wall_time": np.nan}
+                    for subj in futures[future]
+                ]
+
+            for summary in list_summary_group:
+                print(
+                    "Subject {} {} in {:.1f} s".format(
+                        summary["subjectID"], summary["status"], summary["wall_time"]
+                    )
+                )
+                list_summary.append(summary)
+
+    df_summary = (
+        pd.DataFrame(list_summary).set_index("subjectID").reindex(list(dict_data))
+    )
+    with atomic_write(personalization_path + "summary.csv", "w") as f:
+        df_summary.to_csv(f)
+
+    return df_summary
+
+
+def read_cohort(list_paths, subject_column="subjectID"):
+    """One CSV per subject (named after the file) or CSVs with a subject column"""
+
+    dict_data = {}
+    for path in list_paths:
+        df_data = pd.read_csv(path)
+        if subject_column in df_data.columns:
+            for subj, df_data_subj in df_data.groupby(subject_column, sort=False):
+                dict_data[str(subj)] = df_data_subj.reset_index(drop=True)
+        else:
+            dict_data[Path(path).stem] = df_data
+
+    return dict_data
+
+
+def cli_parser():
+    """Command line of main, with the defaults of train_cohort and train_subject"""
+
+    defaults = {
+        name: parameter.default
+        for function in (train_cohort, train_subject)
+        for name, parameter in inspect.signature(function).parameters.items()
+    }
+
+    parser = argparse.ArgumentParser(
+        description="Train the digital twins of a cohort in parallel"
+    )
+    parser.add_argument(
+        "data",
+        nargs="+",
+        help="CSV files: one per subject, or with a subjectID column",
+    )
+    parser.add_argument("--output", required=True, help="Output folder")
+    parser.add_argument("--workers", type=int, default=defaults["n_workers"])
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=defaults["n_threads"],
+        help="torch threads per worker",
+    )
+    parser.add_argument(
+        "--ensemble_size",
+        type=int,
+        default=defaults["ensemble_size"],
+        help="Subjects trained together as one ensemble by each worker",
+    )
+    parser.add_argument("--epochs", type=int, default=defaults["n_epochs"])
+    parser.add_argument("--lr", type=float, default=defaults["lr"])
+    parser.add_argument("--batch_size", type=int, default=defaults["batch_size"])
+    parser.add_argument("--overlap", type=float, default=defaults["overlap"])
+    parser.add_argument("--seed", type=int, default=defaults["seed"])
+    parser.add_argument(
+        "--validation",
+        type=float,
+        default=defaults["validation"],
+        help="Fraction of the training windows held out for early stopping",
+    )
+    parser.add_argument(
+        "--patience",
+        type=int,
+        default=defaults["max_epochs_without_improvement"],
+        help="Epochs without improvement before early stopping",
+    )
+    parser.add_argument(
+        "--checkpoint_every",
+        type=int,
+        default=defaults["checkpoint_every"],
+        help="Epochs between checkpoints (0: no checkpoints)",
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="Continue from the last checkpoints"
+    )
+    parser.add_argument(
+        "--n_segments",
+        type=int,
+        default=defaults["n_segments"],
+        help="Multiple shooting segments per window (1: single shooting)",
+    )
+    parser.add_argument(
+        "--continuity_weight", type=float, default=defaults["continuity_weight"]
+    )
+    parser.add_argument("--subject_column", default="subjectID")
+
+    return parser
+
+
+def main():
+    args = cli_parser().parse_args()
+
+    df_summary = train_cohort(
+        read_cohort(args.data, args.subject_column),
+        args.output,
+        n_workers=args.workers,
+        n_threads=args.threads,
+        ensemble_size=args.ensemble_size,
+        lr=args.lr,
+        batch_size=args.batch_size,
+        n_epochs=args.epochs,
+        overlap=args.overlap,
+        seed=args.seed,
+        validation=args.validation,
+        max_epochs_without_improvement=args.patience,
+        checkpoint_every=args.checkpoint_every,
+        resume=args.resume,
+        n_segments=args.n_segments,
+        continuity_weight=args.continuity_weight,
+    )
+    print(df_summary.to_string())
+
+
+if __name__ == "__main__":
+    main()
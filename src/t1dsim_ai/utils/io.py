@@ -0,0 +1,56 @@
+import hashlib
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+# SHA-256 of files by path, with the (mtime, size) they were computed for
+_file_digests = {}
+_file_digests_lock = threading.Lock()
+
+
+@contextmanager
+def atomic_write(path, mode="wb"):
+    """Open a temporary file next to `path` and move it over `path` on success
+
+    Readers never see a partially written file: either the previous version
+    or the complete new one. The temporary file is removed if writing fails.
+    """
+
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        dir=folder, prefix="." + os.path.basename(path) + ".", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def file_digest(path):
+    """SHA-256 of a file, recomputed only when its mtime or size changes"""
+
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    with _file_digests_lock:
+        cached = _file_digests.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    with _file_digests_lock:
+        _file_digests[path] = (signature, digest)
+
+    return digest
@@ -1,13 +1,119 @@
 from t1dsim_ai.options import (
     states_name,
-    dict_states,
     inputs,
 )
+import os
+import threading
 import numpy as np
+import torch
 from pickle import dump, load
 from sklearn.preprocessing import RobustScaler
 
 
+class FittedScaler:
+
+    """Affine constants of a fitted RobustScaler
+
+    transform(x) = (x - center) / scale and inverse_transform(x) = x * scale + center
+    are applied directly on NumPy arrays or torch tensors (on their own device).
+
+    Attributes
+    ----------
+    scaler: RobustScaler
+        The unpickled scaler
+    center: np.ndarray
+        Per-feature center (zeros if the scaler was fitted without centering)
+    scale: np.ndarray
+        Per-feature scale (ones if the scaler was fitted without scaling)
+    mtime: int
+        Modification time (ns) of the pickle when it was loaded
+
+    """
+
+    def __init__(self, scaler, mtime=None):
+        self.scaler = scaler
+        self.mtime = mtime
+
+        n_features = scaler.n_features_in_
+        self.center = (
+            np.zeros(n_features)
+            if scaler.center_ is None
+            else np.asarray(scaler.center_, dtype=np.float64)
+        )
+        self.scale = (
+            np.ones(n_features)
+            if scaler.scale_ is None
+            else np.asarray(scaler.scale_, dtype=np.float64)
+        )
+
+        self._tensors = {}
+
+    def tensors(self, device="cpu", dtype=torch.float32):
+        """center and scale as torch tensors, cached per device and dtype"""
+
+        key = (str(device), dtype)
+        if key not in self._tensors:
+            self._tensors[key] = (
+                torch.tensor(self.center, dtype=dtype, device=device),
+                torch.tensor(self.scale, dtype=dtype, device=device),
+            )
+        return self._tensors[key]
+
+    def _constants(self, x):
+        if isinstance(x, torch.Tensor):
+            return self.tensors(x.device, x.dtype)
+        x = np.asarray(x)
+        dtype = x.dtype if np.issubdtype(x.dtype, np.floating) else np.float64
+        return self.center.astype(dtype), self.scale.astype(dtype)
+
+    def transform(self, x):
+        center, scale = self._constants(x)
+        return (x - center) / scale
+
+    def inverse_transform(self, x):
+        center, scale = self._constants(x)
+        return x * scale + center
+
+
+class ScalerStore:
+
+    """Thread-safe cache of fitted scalers keyed by path_scaler and scaler name
+
+    Each pickle is loaded once and reloaded only when its modification time
+    changes on disk.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._scalers = {}
+
+    def get(self, path_scaler, name="states"):
+        path = path_scaler + "scaler_" + name + ".pkl"
+        mtime = os.stat(path).st_mtime_ns
+
+        with self._lock:
+            fitted_scaler = self._scalers.get(path)
+            if fitted_scaler is None or fitted_scaler.mtime != mtime:
+                with open(path, "rb") as f:
+                    fitted_scaler = FittedScaler(load(f), mtime)
+                self._scalers[path] = fitted_scaler
+
+        return fitted_scaler
+
+    def states(self, path_scaler):
+        return self.get(path_scaler, "states")
+
+    def inputs(self, path_scaler):
+        return self.get(path_scaler, "inputs")
+
+    def clear(self):
+        with self._lock:
+            self._scalers.clear()
+
+
+scaler_store = ScalerStore()
+
+
 def scaler(x_est, u_id, path_scaler, train=False):
     if train:
         scaler_states = RobustScaler()  # MinMaxScaler()
@@ -22,46 +128,32 @@ def scaler(x_est, u_id, path_scaler, train=False):
 
         return x_est, u_id
     else:
-        scaler_states = load(open(path_scaler + "scaler_states.pkl", "rb"))
-        scaler_inputs = load(open(path_scaler + "scaler_inputs.pkl", "rb"))
-
-        x_est = scaler_states.transform(x_est)
-        u_id = scaler_inputs.transform(u_id)
+        x_est = scaler_store.states(path_scaler).transform(x_est)
+        u_id = scaler_store.inputs(path_scaler).transform(u_id)
         return x_est, u_id
 
 
 def scaler_inverse(x_est, path_scaler):
-    scaler_states = load(open(path_scaler + "scaler_states.pkl", "rb"))
-    x_est = scaler_states.inverse_transform(x_est)
-
-    return x_est
+    return scaler_store.states(path_scaler).inverse_transform(x_est)
 
 
 def scale_single_state(value, state, path_scaler):
 
     if state.split("_")[0] == "input":
-        pos = np.where(inputs == state)[0][0]
-        u_id = np.zeros(len(inputs)).reshape(1, -1).astype(float)
-        u_id[0, pos] = value
-
-        scaler_inputs = load(open(path_scaler + "scaler_inputs.pkl", "rb"))
-        u_id = scaler_inputs.transform(u_id)
-        return u_id[0, pos]
+        pos = inputs.index(state)
+        fitted_scaler = scaler_store.inputs(path_scaler)
 
     else:
         pos = np.where(states_name == state)[0][0]
-        x_est = np.zeros(len(dict_states)).reshape(1, -1).astype(float)
-        x_est[0, pos] = value
+        fitted_scaler = scaler_store.states(path_scaler)
 
-        scaler_states = load(open(path_scaler + "scaler_states.pkl", "rb"))
-        x_est = scaler_states.transform(x_est)
-        return x_est[0, pos]
+    return (value - fitted_scaler.center[pos]) / fitted_scaler.scale[pos]
 
 
 def scale_inverse_Q1(value_array, path_scaler):
-    scaler_states = load(open(path_scaler + "scaler_states.pkl", "rb"))
-    scale = scaler_states.scale_[0]
-    center = scaler_states.center_[0]
+    scaler_states = scaler_store.states(path_scaler)
+    scale = scaler_states.scale[0]
+    center = scaler_states.center[0]
 
     value_array *= scale
     value_array += center
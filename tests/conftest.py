@@ -0,0 +1,69 @@
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pytest
+import torch
+
+from t1dsim_ai.individual_model import DigitalTwin, list_digital_twins
+
+path_data = Path(__file__).parents[1] / "example/data_example/data_example.csv"
+
+
+@pytest.fixture(scope="session")
+def df_data():
+    """Test split of the example data"""
+
+    df_data = pd.read_csv(path_data)
+    return df_data[~df_data.is_train].reset_index(drop=True)
+
+
+@pytest.fixture(scope="session")
+def df_subject():
+    """Small training set: two days of training and one day of test data"""
+
+    df_data = pd.read_csv(path_data)
+    n_train = int(df_data.is_train.sum())
+
+    return df_data.iloc[n_train - 2 * 288 : n_train + 288].reset_index(drop=True)
+
+
+@pytest.fixture
+def df_day(df_data):
+    """One day (288 steps of 5 min) of the example data"""
+
+    return df_data.iloc[288:576].copy()
+
+
+@pytest.fixture(scope="session")
+def digital_twin():
+    """First bundled DigitalTwin, shared by the tests that do not modify it"""
+
+    return DigitalTwin(0)
+
+
+class RetrainableTwin:
+
+    """Copy of a bundled twin whose individual model can be retrained in place"""
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def retrain(self):
+        """Save new weights in the same folder, as a retraining would"""
+
+        path_model = self.folder + "/individual_model.pt"
+        state_dict = torch.load(path_model)
+        torch.save(
+            {name: 1.5 * value for name, value in state_dict.items()}, path_model
+        )
+
+    def build(self, **kwargs):
+        return DigitalTwin(custom_DT=self.folder, **kwargs)
+
+
+@pytest.fixture
+def retrainable_twin(tmp_path):
+    return RetrainableTwin(
+        str(shutil.copytree(list_digital_twins()[0], tmp_path / "twin"))
+    )
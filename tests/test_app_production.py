@@ -0,0 +1,240 @@
+import base64
+import gzip
+import importlib.util
+import json
+import threading
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+# Dependencies of the example apps, not of the package
+pytest.importorskip("flask")
+pytest.importorskip("dotenv")
+
+path_example = Path(__file__).parents[1] / "example"
+
+app_env = {
+    "VOICE_ENABLED": "false",
+    "PRELOAD_DIGITAL_TWINS": "false",
+    "SIMULATION_TIMEOUT": "60",
+}
+
+
+def import_app(monkeypatch, name="app_production"):
+    """Execute example/app_production.py as a new module"""
+
+    for key, value in app_env.items():
+        monkeypatch.setenv(key, value)
+    monkeypatch.syspath_prepend(str(path_example))
+
+    spec = importlib.util.spec_from_file_location(
+        name, path_example / "app_production.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+@pytest.fixture(scope="module")
+def app_production():
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.delenv("FLASK_ENV", raising=False)
+        module = import_app(monkeypatch)
+        yield module
+        module.job_queue.shutdown()
+
+
+@pytest.fixture
+def client(app_production):
+    return app_production.app.test_client()
+
+
+def test_simulate_returns_a_job(client):
+    response = client.post("/simulate", json={"meal_size": 50})
+    job = response.get_json()
+
+    assert response.status_code == 202
+    assert job["status"] in ("pending", "running", "done")
+
+    response = client.get("/jobs/{}?wait=30".format(job["job_id"]))
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "done"
+    assert set(response.get_json()["result"]) == {
+        "plot_data",
+        "stats",
+        "params",
+        "digital_twin",
+    }
+
+
+def test_identical_requests_share_a_job(app_production, client, monkeypatch):
+    # Simulations wait for the three requests, so they are still in flight
+    release = threading.Event()
+    run_simulation = app_production.run_simulation
+
+    def blocked_simulation(*args):
+        release.wait(30)
+        return run_simulation(*args)
+
+    monkeypatch.setattr(app_production, "run_simulation", blocked_simulation)
+
+    job_id = client.post("/simulate", json={"meal_size": 40}).get_json()["job_id"]
+    job_same = client.post("/simulate", json={"meal_size": 40}).get_json()
+    job_other = client.post("/simulate", json={"meal_size": 45}).get_json()
+    release.set()
+
+    assert job_same["job_id"] == job_id
+    assert job_other["job_id"] != job_id
+    for job in [job_id, job_other["job_id"]]:
+        assert client.get("/jobs/{}?wait=30".format(job)).status_code == 200
+
+
+@pytest.mark.parametrize(
+    "query, status",
+    [("wait=abc", 400), ("wait=nan", 400), ("wait=inf", 400), ("wait=-5", None)],
+)
+def test_job_wait_is_validated(client, query, status):
+    job_id = client.post("/simulate", json={}).get_json()["job_id"]
+    response = client.get("/jobs/{}?{}".format(job_id, query))
+
+    if status is None:
+        assert response.status_code in (200, 202)
+    else:
+        assert response.status_code == status
+
+
+def test_unknown_job(client):
+    assert client.get("/jobs/unknown").status_code == 404
+
+
+def test_production_requires_secret_key(monkeypatch):
+    monkeypatch.setenv("FLASK_ENV", "production")
+    monkeypatch.delenv("SECRET_KEY", raising=False)
+
+    with pytest.raises(RuntimeError):
+        import_app(monkeypatch, "app_production_without_key")
+
+
+def decode_column(column):
+    return np.frombuffer(base64.b64decode(column), dtype="<f4")
+
+
+def test_plot_data_is_compressed(app_production, client):
+    response = client.get("/plot_data", headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+
+    plot_data = json.loads(gzip.decompress(response.get_data()))
+    assert plot_data["encoding"] == "float32-base64"
+    for name in ["cgm_actual", "insulin", "carbs", "cgm_pop", "cgm_dt"]:
+        assert len(decode_column(plot_data["columns"][name])) == plot_data["length"]
+
+
+def test_stats_use_the_actual_cgm(app_production, client):
+    response = client.get("/get_stats")
+    stats = response.get_json()
+
+    assert response.status_code == 200
+    # Scenario of a new session
+    df_scenario = app_production.load_patient_data(
+        app_production.DEFAULT_DIGITAL_TWIN, app_production.DEFAULT_SCENARIO_PARAMS
+    )
+    actual = df_scenario["output_cgm"]
+    assert stats["actual"]["mean"] == pytest.approx(actual.mean(), abs=0.05)
+    assert stats["actual"]["max"] == pytest.approx(actual.max(), abs=0.05)
+    assert stats["population"]["mean"] != stats["actual"]["mean"]
+
+
+def parse_events(body):
+    """(event, data) of a text/event-stream body"""
+
+    events = []
+    for message in body.strip().split("\n\n"):
+        event = "message"
+        for line in message.split("\n"):
+            field, _, value = line.partition(": ")
+            if field == "event":
+                event = value
+            elif field == "data":
+                events.append((event, json.loads(value)))
+
+    return events
+
+
+def test_stream_simulation(client):
+    plot_data = client.get("/plot_data").get_json()
+    response = client.get("/stream_simulation")
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+
+    events = parse_events(response.get_data(as_text=True))
+    (_, meta), records, (end, _) = events[0], events[1:-1], events[-1]
+    assert meta["total_frames"] == len(records) == plot_data["length"]
+    assert end == "end"
+
+    # Same trajectories as the plot data, up to the rounding of the records
+    fields = meta["fields"]
+    for name in ["cgm_pop", "cgm_dt"]:
+        streamed = [record[fields.index(name)] for _, record in records]
+        np.testing.assert_allclose(
+            streamed, decode_column(plot_data["columns"][name]), atol=0.06
+        )
+
+
+def test_simulate_batch(client):
+    response = client.post(
+        "/simulate_batch",
+        json={
+            "scenarios": [{"meals": [{"time": 60, "carbs": 50}]}, {"init_cgm": 150}],
+            "digital_twins": [0, 1],
+        },
+    )
+    results = response.get_json()["results"]
+
+    assert response.status_code == 200
+    assert [(result["scenario"], result["digital_twin"]) for result in results] == [
+        (0, 0),
+        (0, 1),
+        (1, 0),
+        (1, 1),
+    ]
+    for result in results:
+        cgm_DT = decode_column(result["columns"]["cgm_dt"])
+        assert len(cgm_DT) == result["length"] == 61
+        assert result["summary"]["digital_twin"]["mean"] == pytest.approx(
+            cgm_DT.mean(), abs=1e-2
+        )
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"scenarios": []},
+        {"scenarios": [{"sim_time": -5}]},
+        {"scenarios": [{"meals": "lunch"}]},
+        {"scenarios": [{}], "digital_twins": [1000]},
+        {"scenarios": [{}] * 300},
+        {"scenarios": [{}, {"initial_time": 8}]},
+        {"scenarios": 5},
+        {"scenarios": [{}], "digital_twins": 1},
+        [{}],
+    ],
+)
+def test_simulate_batch_rejects_invalid_requests(client, data):
+    response = client.post("/simulate_batch", json=data)
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_simulate_batch_names_the_invalid_spec(client):
+    response = client.post(
+        "/simulate_batch", json={"scenarios": [{}, {}, {"initial_time": 8}]}
+    )
+
+    assert response.status_code == 400
+    assert response.get_json()["error"].startswith("Scenario 2: ")
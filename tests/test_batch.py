@@ -0,0 +1,121 @@
+import numpy as np
+import pytest
+
+from t1dsim_ai.batch import (
+    glucose_summary,
+    plan_cohort,
+    scenario_from_spec,
+    simulate_cohort,
+)
+from t1dsim_ai.create_scenarios import digitalTwin_scenario
+from t1dsim_ai.registry import DigitalTwinRegistry
+
+specs = [
+    {"meals": [{"time": 60, "carbs": 75}]},
+    {"meals": [{"time": 30, "carbs": 40}, {"time": 240, "carbs": 60}], "sim_time": 600},
+    {"init_cgm": 160, "basal_insulin": 1.5, "meals": [], "digital_twin": 2},
+]
+
+
+@pytest.fixture(scope="module")
+def registry():
+    return DigitalTwinRegistry(capacity=4)
+
+
+def test_simulate_cohort_matches_simulate(registry):
+    results = simulate_cohort(registry, specs, digital_twins=[0, 1])
+
+    # Specs 0 and 1 on both twins, spec 2 on its own twin
+    assert [(result["scenario"], result["digital_twin"]) for result in results] == [
+        (0, 0),
+        (0, 1),
+        (1, 0),
+        (1, 1),
+        (2, 2),
+    ]
+    for result in results:
+        spec = dict(specs[result["scenario"]])
+        spec.pop("digital_twin", None)
+        df_sim = registry.get(result["digital_twin"]).simulate(scenario_from_spec(spec))
+
+        np.testing.assert_allclose(result["cgm_NNPop"], df_sim["cgm_NNPop"], atol=1e-3)
+        np.testing.assert_allclose(result["cgm_NNDT"], df_sim["cgm_NNDT"], atol=1e-3)
+        assert result["summary"]["digital_twin"]["mean"] == pytest.approx(
+            df_sim["cgm_NNDT"].mean(), abs=1e-2
+        )
+
+
+def test_scenario_from_spec_defaults():
+    df_spec = scenario_from_spec({})
+    df_default = digitalTwin_scenario(meal_size_array=[], meal_time_fromStart_array=[])
+
+    assert df_spec.equals(df_default)
+
+
+def test_heart_rate_profile():
+    hr_profile = list(range(70, 70 + 61))
+    df_scenario = scenario_from_spec({"heart_rate_profile": hr_profile})
+
+    np.testing.assert_array_equal(df_scenario["heart_rate"], hr_profile)
+    np.testing.assert_array_equal(
+        df_scenario["heart_rate_WRTbaseline"], np.array(hr_profile) - 70
+    )
+
+
+@pytest.mark.parametrize(
+    "spec",
+    [
+        {"unknown": 1},
+        {"sim_time": 0},
+        {"sim_time": 8 * 24 * 60},
+        {"carb_ratio": 0},
+        {"meals": [{"time": 60}]},
+        {"meals": [{"time": 400, "carbs": 50}]},
+        {"heart_rate_profile": [70, 71]},
+    ],
+)
+def test_invalid_spec(spec):
+    with pytest.raises(ValueError):
+        scenario_from_spec(spec)
+
+
+def test_simulate_cohort_limits(registry):
+    with pytest.raises(ValueError):
+        simulate_cohort(registry, [])
+    with pytest.raises(ValueError):
+        simulate_cohort(
+            registry, specs[:1], digital_twins=[len(registry.digital_twin_list)]
+        )
+    with pytest.raises(ValueError):
+        simulate_cohort(registry, specs[:2], digital_twins=[0, 1], max_runs=3)
+
+
+@pytest.mark.parametrize(
+    "bad_spec",
+    [
+        {"initial_time": 8},
+        {"initial_time": "8h"},
+        {"init_cgm": [120]},
+        {"heart_rate_profile": {"a": 1}},
+        {"digital_twin": "first"},
+        "lunch",
+        7,
+    ],
+)
+def test_plan_cohort_names_the_invalid_spec(registry, bad_spec):
+    with pytest.raises(ValueError, match="Scenario 1: "):
+        plan_cohort(registry, [specs[0], bad_spec, specs[1]])
+
+
+@pytest.mark.parametrize("specs", [{"meals": []}, 3])
+def test_plan_cohort_needs_a_list(registry, specs):
+    with pytest.raises(ValueError):
+        plan_cohort(registry, specs)
+
+
+def test_glucose_summary():
+    summary = glucose_summary([60, 100, 150, 200])
+
+    assert summary["mean"] == pytest.approx(127.5)
+    assert (summary["min"], summary["max"]) == (60, 200)
+    assert (summary["tbr"], summary["tir"], summary["tar"]) == (25, 50, 25)
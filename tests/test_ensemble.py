@@ -0,0 +1,102 @@
+import pytest
+import torch
+
+from t1dsim_ai.ensemble import EnsembleCGMIndividual, IndividualModelEnsemble
+from t1dsim_ai.individual_model import CGMIndividual, IndividualModel
+from t1dsim_ai.options import hidden_compartments, input_ind
+from t1dsim_ai.train_cohort import train_cohort
+
+
+def test_ensemble_matches_individual_models():
+    torch.manual_seed(0)
+    list_models = [CGMIndividual(hidden_compartments, False) for _ in range(3)]
+    ensemble = EnsembleCGMIndividual.from_models(hidden_compartments, list_models)
+
+    q = 4
+    x = torch.randn(3 * q, 10)
+    u_pop = torch.randn(3 * q, 2)
+    u_ind = torch.randn(3 * q, len(input_ind))
+
+    with torch.no_grad():
+        dx = ensemble(x, u_pop, u_ind)
+        for k, model in enumerate(list_models):
+            block = slice(k * q, (k + 1) * q)
+            torch.testing.assert_close(
+                dx[block], model(x[block], u_pop[block], u_ind[block])
+            )
+            torch.testing.assert_close(
+                ensemble.model(k)(x[block], u_pop[block], u_ind[block]),
+                model(x[block], u_pop[block], u_ind[block]),
+            )
+
+
+def test_inactive_networks_are_skipped():
+    torch.manual_seed(0)
+    list_models = [CGMIndividual(hidden_compartments, False) for _ in range(3)]
+    ensemble = EnsembleCGMIndividual.from_models(hidden_compartments, list_models)
+    ensemble.active = torch.tensor([2, 0])
+
+    q = 4
+    x = torch.randn(2 * q, 10)
+    u_pop = torch.randn(2 * q, 2)
+    u_ind = torch.randn(2 * q, len(input_ind))
+
+    with torch.no_grad():
+        dx = ensemble(x, u_pop, u_ind)
+        for j, k in enumerate([2, 0]):
+            block = slice(j * q, (j + 1) * q)
+            torch.testing.assert_close(
+                dx[block], list_models[k](x[block], u_pop[block], u_ind[block])
+            )
+
+
+def fit_ensemble(dict_data, tmp_path, n_epochs=3):
+    individual_models = [
+        IndividualModel(subject, df.copy(), str(tmp_path) + "/")
+        for subject, df in dict_data.items()
+    ]
+    ensemble = IndividualModelEnsemble(individual_models)
+    ensemble.setup_nn(
+        hidden_compartments, 1e-3, 8, n_epochs, seeds=[0, 1][: len(dict_data)]
+    )
+
+    n_active = []
+    forward = ensemble.individual_model.forward
+
+    def recorded_forward(*args):
+        n_active.append(ensemble.individual_model.n_active)
+        return forward(*args)
+
+    ensemble.individual_model.forward = recorded_forward
+    ensemble.fit(False)
+
+    return individual_models, n_active
+
+
+def test_stopped_subjects_leave_the_rollout(df_subject, tmp_path):
+    # Subject b has half the windows, so its epochs end twice as fast
+    df_short = df_subject.iloc[len(df_subject) // 2 :].reset_index(drop=True)
+    (model_a, model_b), n_active = fit_ensemble(
+        {"a": df_subject, "b": df_short}, tmp_path
+    )
+    (model_alone,), _ = fit_ensemble({"a": df_subject}, tmp_path)
+
+    # Rollouts of the two subjects, then of a only (evaluation calls aside)
+    assert n_active[0] == 2
+    assert n_active[-1] == 1
+    assert model_b.curr_epoch == model_a.curr_epoch == 4
+
+    # Subject a trains as without b
+    assert model_a.LOSS == pytest.approx(model_alone.LOSS, rel=1e-5)
+    for name, tensor in model_alone.best_model.items():
+        torch.testing.assert_close(model_a.best_model[name], tensor)
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{"checkpoint_every": 10}, {"resume": True}, {"n_segments": 2}]
+)
+def test_train_cohort_rejects_ensemble_options(df_subject, tmp_path, kwargs):
+    dict_data = {"a": df_subject, "b": df_subject}
+
+    with pytest.raises(ValueError):
+        train_cohort(dict_data, str(tmp_path), ensemble_size=2, **kwargs)
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+import torch
+
+from t1dsim_ai.export import export_digital_twin, load_digital_twin
+from t1dsim_ai.options import inputs, input_ind
+
+
+@pytest.fixture(scope="module")
+def scripted_module(digital_twin, tmp_path_factory):
+    path = tmp_path_factory.mktemp("export") / "digital_twin.pt"
+    export_digital_twin(digital_twin, str(path))
+
+    return load_digital_twin(str(path))
+
+
+def simulate_scripted(scripted_module, df_scenario):
+    """CGM of the scripted module for one scenario [mg/dL]"""
+
+    init_cgm = torch.tensor([df_scenario["output_cgm"].iloc[0]], dtype=torch.float32)
+    u_pop = torch.tensor(df_scenario[inputs].values[:, None], dtype=torch.float32)
+    u_ind = torch.tensor(df_scenario[input_ind].values[:, None], dtype=torch.float32)
+
+    with torch.no_grad():
+        x_sim_pop, x_sim_DT = scripted_module(init_cgm, u_pop, u_ind)
+
+    return x_sim_pop[:, 0, 0].numpy(), x_sim_DT[:, 0, 0].numpy()
+
+
+@pytest.mark.parametrize("n_steps", [1, 2, 288])
+def test_scripted_module_matches_simulate(
+    digital_twin, scripted_module, df_day, n_steps
+):
+    df_scenario = df_day.iloc[:n_steps]
+    df_sim = digital_twin.simulate(df_scenario)
+
+    cgm_pop, cgm_DT = simulate_scripted(scripted_module, df_scenario)
+
+    assert cgm_DT.shape == (n_steps,)
+    np.testing.assert_allclose(cgm_pop, df_sim["cgm_NNPop"], atol=1e-3)
+    np.testing.assert_allclose(cgm_DT, df_sim["cgm_NNDT"], atol=1e-3)
+
+
+devices = ["meta"] + (["cuda"] if torch.cuda.is_available() else [])
+
+
+@pytest.mark.parametrize("device", devices)
+def test_scripted_module_runs_on_its_device(digital_twin, tmp_path, device):
+    # meta tensors have no data: the rollout runs on any machine without a GPU
+    path = str(tmp_path / "digital_twin.pt")
+    export_digital_twin(digital_twin, path)
+    scripted_module = load_digital_twin(path, device=torch.device(device))
+
+    init_cgm = torch.full((2,), 110.0, device=device)
+    u_pop = torch.zeros((5, 2, len(inputs)), device=device)
+    u_ind = torch.zeros((5, 2, len(input_ind)), device=device)
+    with torch.no_grad():
+        x_sim_pop, x_sim_DT = scripted_module(init_cgm, u_pop, u_ind)
+
+    assert x_sim_pop.device.type == x_sim_DT.device.type == device
+    assert x_sim_DT.shape == (5, 2, 10)
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from t1dsim_ai.jobs import SimulationJobQueue, scenario_key
+
+
+@pytest.fixture
+def job_queue():
+    job_queue = SimulationJobQueue(n_workers=2)
+    yield job_queue
+    job_queue.shutdown()
+
+
+class BlockedCall:
+
+    """Callable counting its calls and blocked until released"""
+
+    def __init__(self):
+        self.n_calls = 0
+        self.release = threading.Event()
+
+    def __call__(self, value):
+        self.n_calls += 1
+        self.release.wait(10)
+        return value
+
+
+def wait_finished(job_queue, job):
+    """Wait for the job and for its done callback, which runs after the result"""
+
+    result = job_queue.wait(job, 10)
+    while job.finished is None:
+        time.sleep(0.001)
+    return result
+
+
+def test_in_flight_key_is_deduplicated(job_queue):
+    fn = BlockedCall()
+    job = job_queue.submit("a", fn, 1)
+    job_same = job_queue.submit("a", fn, 1)
+    job_other = job_queue.submit("b", fn, 2)
+
+    assert job_same is job
+    assert job_other is not job
+
+    fn.release.set()
+    assert job_queue.wait(job, 10) == 1
+    assert job_queue.wait(job_other, 10) == 2
+    assert fn.n_calls == 2
+    assert job.to_dict() == {"job_id": job.job_id, "status": "done"}
+    assert job_queue.get(job.job_id) is job
+
+
+def test_finished_key_runs_again(job_queue):
+    fn = BlockedCall()
+    fn.release.set()
+
+    job = job_queue.submit("a", fn, 1)
+    wait_finished(job_queue, job)
+    job_again = job_queue.submit("a", fn, 1)
+    wait_finished(job_queue, job_again)
+
+    assert job_again is not job
+    assert fn.n_calls == 2
+
+
+def test_failed_job(job_queue):
+    def fail():
+        raise ValueError("bad scenario")
+
+    job = job_queue.submit("a", fail)
+    with pytest.raises(ValueError):
+        job_queue.wait(job, 10)
+
+    assert job.to_dict() == {
+        "job_id": job.job_id,
+        "status": "error",
+        "error": "bad scenario",
+    }
+
+
+def test_finished_jobs_expire():
+    job_queue = SimulationJobQueue(n_workers=1, ttl=0)
+    job = job_queue.submit("a", lambda: 1)
+    wait_finished(job_queue, job)
+    job.finished -= 1
+
+    # Purged on the next submit
+    job_queue.wait(job_queue.submit("b", lambda: 2), 10)
+    assert job_queue.get(job.job_id) is None
+    job_queue.shutdown()
+
+
+def test_scenario_key():
+    df = pd.DataFrame({"a": [1.0, 2.0], "b": [3.0, 4.0]})
+
+    assert scenario_key(df, 0, "x") == scenario_key(df.copy(), 0, "x")
+    assert scenario_key(df, 0, "x") != scenario_key(df, 1, "x")
+    assert scenario_key(df) != scenario_key(df.rename(columns={"b": "c"}))
+    assert scenario_key(np.zeros(4)) != scenario_key(np.zeros((2, 2)))
@@ -0,0 +1,88 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from t1dsim_ai.individual_model import DigitalTwin
+
+# Optional dependencies of the onnxruntime backend
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+from t1dsim_ai.onnx_export import export_onnx  # noqa: E402
+
+
+@pytest.fixture(scope="module", params=[True, False], ids=["fused", "V2"])
+def onnx_twin(request):
+    return DigitalTwin(0, fused=request.param, backend="onnxruntime")
+
+
+@pytest.mark.parametrize("n_steps", [1, 2, 288])
+def test_onnx_simulate_matches_torch(digital_twin, onnx_twin, df_day, n_steps):
+    df_scenario = df_day.iloc[:n_steps]
+    df_torch = digital_twin.simulate(df_scenario)
+    df_onnx = onnx_twin.simulate(df_scenario)
+
+    assert len(df_onnx) == n_steps
+    for column in ["cgm_NNPop", "cgm_NNDT"]:
+        np.testing.assert_allclose(df_onnx[column], df_torch[column], atol=1e-3)
+
+
+def test_onnx_simulate_batch_matches_torch(digital_twin, onnx_twin, df_day):
+    list_scenarios = [df_day, df_day.iloc[50:100]]
+    sim_torch = digital_twin.simulate_batch(list_scenarios, as_frame=False)
+    sim_onnx = onnx_twin.simulate_batch(list_scenarios, as_frame=False)
+
+    np.testing.assert_allclose(
+        sim_onnx["cgm_NNDT"], sim_torch["cgm_NNDT"], atol=1e-3, equal_nan=True
+    )
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{"quantized": True}, {"precision": "bfloat16"}, {"checkpoint_every": 12}]
+)
+def test_onnx_rejects_torch_only_options(kwargs):
+    with pytest.raises(ValueError):
+        DigitalTwin(0, backend="onnxruntime", **kwargs)
+
+
+# Runs OnnxDigitalTwin in a process where torch and scikit-learn cannot be imported
+torch_free_script = """
+import sys
+
+sys.modules["torch"] = None
+sys.modules["sklearn"] = None
+
+import pandas as pd
+from t1dsim_ai.onnx_backend import OnnxDigitalTwin
+
+df_sim = OnnxDigitalTwin(sys.argv[1]).simulate(pd.read_csv(sys.argv[2]))
+df_sim[["cgm_NNPop", "cgm_NNDT"]].to_csv(sys.argv[3], index=False)
+"""
+
+
+def test_exported_twin_runs_without_torch(digital_twin, df_day, tmp_path):
+    path_model = str(tmp_path / "digital_twin.onnx")
+    export_onnx(digital_twin, path_model)
+    df_day.to_csv(tmp_path / "scenario.csv", index=False)
+
+    subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            torch_free_script,
+            path_model,
+            str(tmp_path / "scenario.csv"),
+            str(tmp_path / "simulation.csv"),
+        ],
+        check=True,
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+    )
+
+    df_onnx = pd.read_csv(tmp_path / "simulation.csv")
+    df_torch = digital_twin.simulate(df_day)
+    for column in ["cgm_NNPop", "cgm_NNDT"]:
+        np.testing.assert_allclose(df_onnx[column], df_torch[column], atol=1e-3)
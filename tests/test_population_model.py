@@ -0,0 +1,70 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+import torch
+
+import t1dsim_ai
+from t1dsim_ai.individual_model import DigitalTwin
+from t1dsim_ai.options import n_neurons_pop
+from t1dsim_ai.population_model import (
+    CGMOHSUSimStateSpaceModel_V2,
+    FusedCGMOHSUSimStateSpaceModel,
+)
+
+path_model = (
+    Path(t1dsim_ai.__file__).parent
+    / "models/PopulationModel/population_model_05022024_epoch_15.pt"
+)
+
+
+@pytest.fixture(scope="module")
+def pop_models():
+    state_dict = torch.load(path_model)
+
+    ss_pop_model = CGMOHSUSimStateSpaceModel_V2(n_feat=n_neurons_pop)
+    ss_pop_model.load_state_dict(state_dict)
+    fused_pop_model = FusedCGMOHSUSimStateSpaceModel.from_state_dict(
+        state_dict, n_neurons_pop
+    )
+
+    return ss_pop_model.eval(), fused_pop_model.eval()
+
+
+@pytest.mark.parametrize("batch_shape", [(1,), (32,), (5, 3)])
+def test_fused_dx_matches_V2(pop_models, batch_shape):
+    ss_pop_model, fused_pop_model = pop_models
+
+    torch.manual_seed(0)
+    x = 0.1 * torch.randn(*batch_shape, 10)
+    u = torch.randn(*batch_shape, 2).abs()
+
+    with torch.no_grad():
+        dx = ss_pop_model(x, u)
+        dx_fused = fused_pop_model(x, u)
+
+    assert dx_fused.shape == dx.shape
+    torch.testing.assert_close(dx_fused, dx, rtol=1e-5, atol=1e-6)
+
+
+def test_fused_rollout_matches_V2(pop_models):
+    ss_pop_model, fused_pop_model = pop_models
+
+    torch.manual_seed(0)
+    x, x_fused = (0.1 * torch.randn(16, 10),) * 2
+    u = torch.randn(288, 16, 2).abs()
+
+    with torch.no_grad():
+        for u_step in u:
+            x = x + 5 * ss_pop_model(x, u_step)
+            x_fused = x_fused + 5 * fused_pop_model(x_fused, u_step)
+
+    torch.testing.assert_close(x_fused, x, rtol=1e-4, atol=1e-4)
+
+
+def test_fused_simulate_matches_V2(df_day):
+    df_fused = DigitalTwin(0, fused=True).simulate(df_day)
+    df_V2 = DigitalTwin(0, fused=False).simulate(df_day)
+
+    for column in ["cgm_NNPop", "cgm_NNDT"]:
+        np.testing.assert_allclose(df_fused[column], df_V2[column], atol=1e-2)
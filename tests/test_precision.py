@@ -0,0 +1,14 @@
+import numpy as np
+
+from t1dsim_ai.individual_model import DigitalTwin
+
+
+def test_bfloat16_is_close_to_float32(digital_twin, df_day):
+    df_float = digital_twin.simulate(df_day)
+    df_bfloat16 = DigitalTwin(0, precision="bfloat16").simulate(df_day)
+
+    # Measured on this day: RMSE ~1.7 mg/dL, max error ~6 mg/dL
+    for column in ["cgm_NNPop", "cgm_NNDT"]:
+        error = df_bfloat16[column].values - df_float[column].values
+        assert 0 < np.sqrt(np.mean(error**2)) < 5, column
+        assert np.abs(error).max() < 20, column
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from t1dsim_ai.individual_model import DigitalTwin, prefix_state_cache
+
+checkpoint_every = 12
+columns = ["cgm_NNPop", "cgm_NNDT"]
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    prefix_state_cache.clear()
+    yield
+    prefix_state_cache.clear()
+
+
+@pytest.fixture
+def checkpointed_twin():
+    return DigitalTwin(0, checkpoint_every=checkpoint_every)
+
+
+def edit_meal(df_scenario, row, carbs):
+    df_scenario = df_scenario.copy()
+    df_scenario.iloc[row, df_scenario.columns.get_loc("input_meal_carbs")] = carbs
+    return df_scenario
+
+
+def test_cache_miss_matches_simulate(digital_twin, checkpointed_twin, df_day):
+    df_cached = checkpointed_twin.simulate(df_day)
+    df_sim = digital_twin.simulate(df_day)
+
+    assert len(prefix_state_cache) == (len(df_day) - 1) // checkpoint_every
+    for column in columns:
+        np.testing.assert_allclose(df_cached[column], df_sim[column], atol=1e-4)
+
+
+def test_cache_hit_matches_miss(checkpointed_twin, df_day):
+    df_miss = checkpointed_twin.simulate(df_day)
+    n_blocks = len(prefix_state_cache)
+    df_hit = checkpointed_twin.simulate(df_day)
+
+    assert len(prefix_state_cache) == n_blocks
+    for column in columns:
+        np.testing.assert_array_equal(df_hit[column], df_miss[column])
+
+
+def test_edited_scenario_resumes_from_prefix(digital_twin, checkpointed_twin, df_day):
+    row = 150
+    df_edited = edit_meal(df_day, row, 60)
+
+    df_original = checkpointed_twin.simulate(df_day)
+    n_blocks = len(prefix_state_cache)
+    df_cached = checkpointed_twin.simulate(df_edited)
+    df_sim = digital_twin.simulate(df_edited)
+
+    # Only the blocks after the edited row are new
+    n_shared = row // checkpoint_every
+    assert len(prefix_state_cache) == 2 * n_blocks - n_shared
+    for column in columns:
+        np.testing.assert_array_equal(
+            df_cached[column][: row + 1], df_original[column][: row + 1]
+        )
+        np.testing.assert_allclose(df_cached[column], df_sim[column], atol=1e-4)
+
+
+def test_retrained_twin_misses_cache(retrainable_twin, df_day):
+    df_old = retrainable_twin.build(checkpoint_every=checkpoint_every).simulate(df_day)
+
+    retrainable_twin.retrain()
+    df_cached = retrainable_twin.build(checkpoint_every=checkpoint_every).simulate(
+        df_day
+    )
+    df_sim = retrainable_twin.build().simulate(df_day)
+
+    assert not np.allclose(df_sim["cgm_NNDT"], df_old["cgm_NNDT"])
+    np.testing.assert_allclose(df_cached["cgm_NNDT"], df_sim["cgm_NNDT"], atol=1e-4)
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from t1dsim_ai.individual_model import DigitalTwin, quantized_models
+from t1dsim_ai.population_model import QuantizedCGMOHSUSimStateSpaceModel
+
+
+def test_quantized_true_is_individual_only(digital_twin, df_day):
+    quantized_twin = DigitalTwin(0, quantized=True)
+
+    assert quantized_twin.quantized == ("individual",)
+    assert not isinstance(
+        quantized_twin.nn_solution.ss_pop_model, QuantizedCGMOHSUSimStateSpaceModel
+    )
+
+    df_quantized = quantized_twin.simulate(df_day)
+    df_float = digital_twin.simulate(df_day)
+
+    np.testing.assert_array_equal(df_quantized["cgm_NNPop"], df_float["cgm_NNPop"])
+    error = df_quantized["cgm_NNDT"] - df_float["cgm_NNDT"]
+    assert np.sqrt(np.mean(error**2)) < 2
+
+
+def test_quantized_population_model():
+    quantized_twin = DigitalTwin(0, quantized=["population", "individual"])
+
+    assert isinstance(
+        quantized_twin.nn_solution.ss_pop_model, QuantizedCGMOHSUSimStateSpaceModel
+    )
+
+
+def test_retrained_model_is_quantized_again(retrainable_twin, df_day):
+    df_old = retrainable_twin.build(quantized=True).simulate(df_day)
+
+    retrainable_twin.retrain()
+    df_new = retrainable_twin.build(quantized=True).simulate(df_day)
+    quantized_models.clear()
+    df_fresh = retrainable_twin.build(quantized=True).simulate(df_day)
+
+    assert not np.allclose(df_new["cgm_NNDT"], df_old["cgm_NNDT"])
+    np.testing.assert_array_equal(df_new["cgm_NNDT"], df_fresh["cgm_NNDT"])
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{"quantized": ["unknown"]}, {"quantized": True, "precision": "bfloat16"}]
+)
+def test_invalid_quantization(kwargs):
+    with pytest.raises(ValueError):
+        DigitalTwin(0, **kwargs)
@@ -0,0 +1,83 @@
+import threading
+
+import pytest
+
+import t1dsim_ai.registry
+from t1dsim_ai.registry import DigitalTwinRegistry
+
+
+@pytest.fixture
+def blocked_build(monkeypatch):
+    """DigitalTwin builds of the twin 1 wait for the returned event"""
+
+    release = threading.Event()
+    started = threading.Event()
+    builds = []
+    DigitalTwin = t1dsim_ai.registry.DigitalTwin
+
+    def build(**kwargs):
+        builds.append(kwargs["n_digitalTwin"])
+        if kwargs["n_digitalTwin"] == 1:
+            started.set()
+            assert release.wait(30)
+        return DigitalTwin(**kwargs)
+
+    monkeypatch.setattr(t1dsim_ai.registry, "DigitalTwin", build)
+
+    return started, release, builds
+
+
+def test_build_does_not_block_cached_twins(blocked_build):
+    started, release, builds = blocked_build
+    registry = DigitalTwinRegistry(capacity=4)
+    twin_0 = registry.get(0)
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(registry.get(1)))
+        for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    assert started.wait(30)
+
+    # The twin 1 is still being built
+    assert registry.get(0) is twin_0
+    assert len(registry) == 1
+
+    release.set()
+    for thread in threads:
+        thread.join(30)
+
+    assert builds == [0, 1]
+    assert len(results) == 3
+    assert all(twin is results[0] for twin in results)
+    assert registry.get(1) is results[0]
+    assert len(registry) == 2
+
+
+def test_failed_build_is_retried(monkeypatch):
+    registry = DigitalTwinRegistry(capacity=4)
+    DigitalTwin = t1dsim_ai.registry.DigitalTwin
+
+    def failing_build(**kwargs):
+        raise OSError("checkpoint not readable")
+
+    monkeypatch.setattr(t1dsim_ai.registry, "DigitalTwin", failing_build)
+    with pytest.raises(OSError):
+        registry.get(0)
+    assert len(registry) == 0
+
+    monkeypatch.setattr(t1dsim_ai.registry, "DigitalTwin", DigitalTwin)
+    assert registry.get(0) is registry.get(0)
+
+
+def test_lru_eviction():
+    registry = DigitalTwinRegistry(capacity=2)
+    twin_0 = registry.get(0)
+    registry.get(1)
+    registry.get(0)
+    registry.get(2)
+
+    assert len(registry) == 2
+    assert registry.get(0) is twin_0
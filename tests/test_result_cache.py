@@ -0,0 +1,93 @@
+import numpy as np
+
+from t1dsim_ai.individual_model import DigitalTwin
+from t1dsim_ai.result_cache import SimulationResultCache
+
+columns = ["cgm_NNPop", "cgm_NNDT"]
+
+
+def assert_same_simulation(df_a, df_b):
+    for column in columns:
+        np.testing.assert_array_equal(df_a[column], df_b[column])
+
+
+def test_hit_returns_the_simulated_result(digital_twin, df_day):
+    result_cache = SimulationResultCache()
+    cached_twin = DigitalTwin(0, result_cache=result_cache)
+
+    df_miss = cached_twin.simulate(df_day)
+    df_hit = cached_twin.simulate(df_day)
+
+    assert (result_cache.hits, result_cache.misses) == (1, 1)
+    assert_same_simulation(df_hit, df_miss)
+    for column in columns:
+        np.testing.assert_allclose(
+            df_hit[column], digital_twin.simulate(df_day)[column], atol=1e-4
+        )
+
+
+def test_edited_inputs_miss(df_day):
+    result_cache = SimulationResultCache()
+    cached_twin = DigitalTwin(0, result_cache=result_cache)
+
+    df_edited = df_day.copy()
+    df_edited.iloc[100, df_edited.columns.get_loc("input_meal_carbs")] += 20
+    df_cgm = df_day.copy()
+    df_cgm.iloc[0, df_cgm.columns.get_loc("output_cgm")] += 10
+
+    for df_scenario in [df_day, df_edited, df_cgm]:
+        cached_twin.simulate(df_scenario)
+
+    assert (result_cache.hits, result_cache.misses) == (0, 3)
+
+
+def test_configuration_misses(df_day):
+    result_cache = SimulationResultCache()
+
+    DigitalTwin(0, result_cache=result_cache).simulate(df_day)
+    DigitalTwin(1, result_cache=result_cache).simulate(df_day)
+    DigitalTwin(0, fused=False, result_cache=result_cache).simulate(df_day)
+
+    assert (result_cache.hits, result_cache.misses) == (0, 3)
+
+
+def test_retrained_model_misses(retrainable_twin, df_day):
+    result_cache = SimulationResultCache()
+    retrainable_twin.build(result_cache=result_cache).simulate(df_day)
+
+    retrainable_twin.retrain()
+    df_cached = retrainable_twin.build(result_cache=result_cache).simulate(df_day)
+
+    assert (result_cache.hits, result_cache.misses) == (0, 2)
+    assert_same_simulation(df_cached, retrainable_twin.build().simulate(df_day))
+
+
+def test_disk_tier_is_shared(df_day, tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    df_miss = DigitalTwin(
+        0, result_cache=SimulationResultCache(cache_dir=cache_dir)
+    ).simulate(df_day)
+
+    # A new process: empty memory tier, same folder
+    result_cache = SimulationResultCache(cache_dir=cache_dir)
+    df_hit = DigitalTwin(0, result_cache=result_cache).simulate(df_day)
+
+    assert (result_cache.hits, result_cache.misses) == (1, 0)
+    assert_same_simulation(df_hit, df_miss)
+
+    result_cache.clear()
+    DigitalTwin(0, result_cache=result_cache).simulate(df_day)
+    assert result_cache.misses == 1
+
+
+def test_disk_tier_is_evicted_by_size(tmp_path):
+    result_cache = SimulationResultCache(capacity=1, cache_dir=str(tmp_path))
+    result_cache.put("a", np.zeros((10, 10)), np.zeros((10, 10)))
+
+    # Room for one file: the least recently used one is removed
+    result_cache.max_disk_bytes = (tmp_path / "a.npz").stat().st_size
+    result_cache.put("b", np.zeros((10, 10)), np.zeros((10, 10)))
+
+    assert [path.name for path in tmp_path.iterdir()] == ["b.npz"]
+    assert result_cache.get("a") is None
+    assert result_cache.get("b") is not None
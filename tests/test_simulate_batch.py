@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from t1dsim_ai.create_scenarios import digitalTwin_scenario
+
+
+@pytest.fixture
+def list_scenarios(df_day):
+    return [
+        df_day,
+        df_day.iloc[100:160],
+        digitalTwin_scenario(
+            meal_size_array=[60, 40], meal_time_fromStart_array=[30, 200]
+        ),
+    ]
+
+
+def test_simulate_batch_matches_simulate(digital_twin, list_scenarios):
+    list_df = digital_twin.simulate_batch(list_scenarios)
+
+    assert len(list_df) == len(list_scenarios)
+    for df_scenario, df_batch in zip(list_scenarios, list_df):
+        df_single = digital_twin.simulate(df_scenario)
+
+        assert len(df_batch) == len(df_scenario)
+        for column in ["cgm_NNPop", "cgm_NNDT"]:
+            np.testing.assert_allclose(df_batch[column], df_single[column], atol=1e-3)
+
+
+def test_simulate_batch_arrays(digital_twin, list_scenarios):
+    sim = digital_twin.simulate_batch(list_scenarios, as_frame=False)
+
+    max_time = max(len(df_scenario) for df_scenario in list_scenarios)
+    assert sim["cgm_NNDT"].shape == (len(list_scenarios), max_time)
+    for n, df_scenario in enumerate(list_scenarios):
+        length = sim["length"][n]
+        df_single = digital_twin.simulate(df_scenario)
+
+        assert length == len(df_scenario)
+        assert np.isnan(sim["cgm_NNDT"][n, length:]).all()
+        np.testing.assert_allclose(
+            sim["cgm_NNDT"][n, :length], df_single["cgm_NNDT"], atol=1e-3
+        )
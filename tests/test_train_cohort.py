@@ -0,0 +1,30 @@
+import inspect
+
+from t1dsim_ai.train_cohort import cli_parser, train_cohort, train_subject
+
+# CLI option of each function argument
+cli_arguments = {
+    "n_workers": "workers",
+    "n_threads": "threads",
+    "ensemble_size": "ensemble_size",
+    "n_epochs": "epochs",
+    "lr": "lr",
+    "batch_size": "batch_size",
+    "overlap": "overlap",
+    "seed": "seed",
+    "validation": "validation",
+    "max_epochs_without_improvement": "patience",
+    "checkpoint_every": "checkpoint_every",
+    "resume": "resume",
+    "n_segments": "n_segments",
+    "continuity_weight": "continuity_weight",
+}
+
+
+def test_cli_defaults_match_the_functions():
+    args = vars(cli_parser().parse_args(["data.csv", "--output", "out"]))
+
+    for function in (train_cohort, train_subject):
+        for name, parameter in inspect.signature(function).parameters.items():
+            if name in cli_arguments:
+                assert args[cli_arguments[name]] == parameter.default, name
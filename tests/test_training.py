@@ -0,0 +1,136 @@
+import copy
+
+import numpy as np
+import pytest
+import torch
+
+from t1dsim_ai.individual_model import IndividualModel
+from t1dsim_ai.options import hidden_compartments
+
+
+class Interrupted(Exception):
+    pass
+
+
+def setup_model(df_subject, path_model, n_epochs=4, checkpoint_every=1, **kwargs):
+    np.random.seed(0)
+    torch.manual_seed(0)
+
+    path_model.mkdir(exist_ok=True)
+    model = IndividualModel("subject", df_subject.copy(), str(path_model) + "/")
+    model.setup_nn(
+        hidden_compartments,
+        1e-3,
+        8,
+        n_epochs,
+        validation=0.2,
+        checkpoint_every=checkpoint_every,
+        **kwargs,
+    )
+
+    return model
+
+
+def test_resume_is_bitwise_identical(df_subject, tmp_path, monkeypatch):
+    model = setup_model(df_subject, tmp_path / "full")
+    model.fit(False)
+
+    # Kill the second run after its second checkpoint
+    model_killed = setup_model(df_subject, tmp_path / "resumed")
+    save_checkpoint = model_killed.save_checkpoint
+    n_saved = []
+
+    def save_and_kill():
+        save_checkpoint()
+        n_saved.append(1)
+        if len(n_saved) == 2:
+            raise Interrupted()
+
+    monkeypatch.setattr(model_killed, "save_checkpoint", save_and_kill)
+    with pytest.raises(Interrupted):
+        model_killed.fit(False)
+
+    # A new process: different RNG state and initial weights
+    np.random.seed(1)
+    torch.manual_seed(1)
+    model_resumed = setup_model(df_subject, tmp_path / "resumed")
+    model_resumed.fit(False, resume=True)
+
+    assert model_resumed.LOSS == model.LOSS
+    assert model_resumed.LOSS_VAL == model.LOSS_VAL
+    assert model_resumed.best_epoch == model.best_epoch
+    state_dict = model.nn_solution.ss_ind_model.state_dict()
+    for name, tensor in model_resumed.nn_solution.ss_ind_model.state_dict().items():
+        assert torch.equal(tensor, state_dict[name]), name
+
+
+def test_early_stopping_restores_the_best_model(df_subject, tmp_path, monkeypatch):
+    model = setup_model(
+        df_subject,
+        tmp_path,
+        n_epochs=20,
+        checkpoint_every=0,
+        max_epochs_without_improvement=2,
+    )
+
+    # Validation loss improving for two epochs, then getting worse
+    validation_losses = iter([30.0, 20.0, 25.0, 26.0, 10.0, 5.0])
+    simulation_loss = model.simulation_loss
+    weights = []
+
+    def scripted_loss(group, nn_solution=None):
+        if group != "Validation":
+            return simulation_loss(group, nn_solution)
+        weights.append(copy.deepcopy(model.nn_solution.ss_ind_model.state_dict()))
+        return next(validation_losses)
+
+    monkeypatch.setattr(model, "simulation_loss", scripted_loss)
+    model.fit(False)
+
+    assert model.LOSS_VAL == [30.0, 20.0, 25.0, 26.0]
+    assert len(model.LOSS) == 4 < 20
+    # Epochs are numbered from 1
+    assert model.best_epoch == 2
+    assert model.best_loss == 20.0
+
+    # The weights of the best epoch, not those of the last one
+    state_dict = model.nn_solution.ss_ind_model.state_dict()
+    for name, tensor in weights[1].items():
+        assert torch.equal(state_dict[name], tensor), name
+    assert any(
+        not torch.equal(state_dict[name], tensor)
+        for name, tensor in weights[-1].items()
+    )
+
+
+def test_multiple_shooting(df_subject, tmp_path):
+    model = setup_model(df_subject, tmp_path, checkpoint_every=0, n_segments=2)
+    batch = model.batch
+
+    # Nodes on the single shooting trajectory: the segments join without gap
+    idx = batch.idx_scenarios[:8]
+    x0, u_pop, u_ind, y, _ = batch.take(idx)
+    with torch.no_grad():
+        x_sim = model.nn_solution(x0, u_pop, u_ind)
+        model.shooting_states[idx] = x_sim[model.segment_len - 1]
+        x_segments, loss_continuity = model.simulate_segments(idx, x0, u_pop, u_ind)
+
+    torch.testing.assert_close(x_segments, x_sim)
+    assert loss_continuity.item() < 1e-10
+
+    # Training steps only move the nodes of their minibatch
+    for _ in range(3):
+        idx = batch.batch_scenarios_idx
+        x0, u_pop, u_ind, y, _ = batch.get_batch(True)
+        nodes = model.shooting_states.detach().clone()
+
+        model.optimizer_shooting.zero_grad()
+        x_segments, loss_continuity = model.simulate_segments(idx, x0, u_pop, u_ind)
+        loss = model.loss(x_segments[:, :, [0]], y) + loss_continuity
+        loss.backward()
+        model.optimizer_shooting.step()
+
+        is_moved = (model.shooting_states.detach() != nodes).any(1)
+        in_batch = torch.zeros_like(is_moved)
+        in_batch[idx] = True
+        assert torch.equal(is_moved, in_batch)